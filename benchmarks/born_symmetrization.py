@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""Symmetrization of Born effective charges: batched vs. atom-by-atom
+
+Cubic perovskite supercells (5 atoms per unit cell) are built with their
+space group operations, i.e. the 48 point group operations combined with
+the lattice translations of the unit cell in the supercell. Random Born
+effective charges are symmetrized with the batched NumPy implementation
+of pwmat2phonopy.interface.pwmat and with the former loop over atoms and
+operations, which is kept here as the reference. The exit status is 1 if
+the results differ.
+
+Usage:
+    python benchmarks/born_symmetrization.py [--sizes 1,2,3] [--json FILE]
+
+"""
+
+import os
+import sys
+import json
+import time
+import itertools
+from optparse import OptionParser
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pwmat2phonopy.interface.pwmat import (get_atom_permutations,
+                                           get_cartesian_rotations,
+                                           symmetrize_2nd_rank_tensor)
+
+PEROVSKITE = np.array([[0.0, 0.0, 0.0],
+                       [0.5, 0.5, 0.5],
+                       [0.5, 0.5, 0.0],
+                       [0.5, 0.0, 0.5],
+                       [0.0, 0.5, 0.5]])
+A = 3.9
+
+def get_cubic_rotations():
+    rotations = []
+    for perm in itertools.permutations(range(3)):
+        for signs in itertools.product([1, -1], repeat=3):
+            r = np.zeros((3, 3), dtype='intc')
+            for i in range(3):
+                r[i, perm[i]] = signs[i]
+            rotations.append(r)
+    return np.array(rotations)
+
+def build_supercell(n):
+    grid = np.array(list(itertools.product(range(n), repeat=3)))
+    positions = ((PEROVSKITE[None, :, :] + grid[:, None, :]) /
+                 float(n)).reshape(-1, 3)
+    lattice = np.eye(3) * A * n
+    rotations = []
+    translations = []
+    for g in grid:
+        for r in get_cubic_rotations():
+            rotations.append(r)
+            translations.append(g / float(n))
+    return lattice, positions, np.array(rotations), np.array(translations)
+
+def similarity_transformation(rot, mat):
+    """ R x M x R^-1 """
+    return np.dot(rot, np.dot(mat, np.linalg.inv(rot)))
+
+def symmetrize_borns_loop(borns, lattice, positions, rotations, translations,
+                          symprec=1e-5):
+    borns_ = np.zeros_like(borns)
+    for i in range(len(borns)):
+        count = 0
+        for r, t in zip(rotations, translations):
+            count += 1
+            diff = np.dot(positions, r.T) + t - positions[i]
+            diff -= np.rint(diff)
+            dist = np.sqrt(np.sum(np.dot(diff, lattice) ** 2, axis=1))
+            j = np.nonzero(dist < symprec)[0][0]
+            r_cart = similarity_transformation(lattice.T, r)
+            borns_[i] += similarity_transformation(r_cart, borns[j])
+        borns_[i] /= count
+    return borns_
+
+def symmetrize_borns_batched(borns, lattice, positions, rotations,
+                             translations, symprec=1e-5):
+    # Same as in symmetrize_borns_and_epsilon
+    perms = get_atom_permutations(positions,
+                                  rotations,
+                                  translations,
+                                  lattice,
+                                  symprec=symprec)
+    r_carts = get_cartesian_rotations(rotations, lattice)
+    r_carts_inv = np.linalg.inv(r_carts)
+    return np.matmul(np.matmul(r_carts[:, None], borns[perms]),
+                     r_carts_inv[:, None]).sum(axis=0) / len(rotations)
+
+def main():
+    parser = OptionParser()
+    parser.set_defaults(sizes="1,2,3", json_filename=None)
+    parser.add_option("--sizes", dest="sizes", type="string",
+                      help="Comma separated supercell sizes n (n x n x n)")
+    parser.add_option("--json", dest="json_filename", type="string",
+                      help="Write results to this file")
+    (options, args) = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    results = []
+    print("%6s %6s %12s %12s %8s %10s" %
+          ('atoms', 'ops', 'loop [s]', 'batched [s]', 'speedup', 'max diff'))
+    for n in [int(x) for x in options.sizes.split(',')]:
+        lattice, positions, rotations, translations = build_supercell(n)
+        borns = rng.normal(size=(len(positions), 3, 3))
+
+        t0 = time.time()
+        borns_loop = symmetrize_borns_loop(
+            borns, lattice, positions, rotations, translations)
+        t1 = time.time()
+        borns_batched = symmetrize_borns_batched(
+            borns, lattice, positions, rotations, translations)
+        t2 = time.time()
+
+        max_diff = np.abs(borns_loop - borns_batched).max()
+        r = {'natom': len(positions),
+             'num_operations': len(rotations),
+             'loop': t1 - t0,
+             'batched': t2 - t1,
+             'max_diff': max_diff}
+        results.append(r)
+        print("%6d %6d %12.4f %12.4f %8.1f %10.2e" %
+              (r['natom'], r['num_operations'], r['loop'], r['batched'],
+               r['loop'] / r['batched'], max_diff))
+
+    # Dielectric constant by the point group operations
+    lattice = build_supercell(1)[0]
+    epsilon = rng.normal(size=(3, 3))
+    epsilon_loop = np.zeros_like(epsilon)
+    for r in get_cubic_rotations():
+        epsilon_loop += similarity_transformation(
+            similarity_transformation(lattice.T, r), epsilon)
+    epsilon_loop /= 48
+    eps_diff = np.abs(symmetrize_2nd_rank_tensor(
+        epsilon, get_cubic_rotations(), lattice) - epsilon_loop).max()
+    print("Dielectric constant, max diff: %.2e" % eps_diff)
+
+    if options.json_filename is not None:
+        with open(options.json_filename, 'w') as w:
+            json.dump({'borns': results, 'epsilon_max_diff': eps_diff},
+                      w, indent=2)
+
+    if eps_diff > 1e-10 or any([r['max_diff'] > 1e-10 for r in results]):
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+"""Dynamical matrices: batched vs. one q-point at a time
+
+Supercells of the 2-atom Si primitive cell are built with random force
+constants, and the dynamical matrices of random q-points are built by
+pwmat2phonopy.dynamical_matrix.DynamicalMatrixBatch and one q-point at a
+time. The per-q reference is phonopy's DynamicalMatrix when phonopy is
+installed (C implementation if compiled), otherwise the python loop of
+DynamicalMatrix._set_py_dynamical_matrix, which is kept here together
+with the shortest vectors between the primitive cell and the supercell.
+The exit status is 1 if the matrices differ.
+
+Usage:
+    python benchmarks/dynamical_matrix.py [--sizes 2,3,4] [--nq N]
+                                          [--json FILE]
+
+"""
+
+import os
+import sys
+import json
+import time
+import itertools
+from optparse import OptionParser
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pwmat2phonopy.dynamical_matrix import (DynamicalMatrixBatch,
+                                            get_dynamical_matrix_batch)
+
+A = 5.43
+LATTICE = np.array([[0.0, 0.5, 0.5],
+                    [0.5, 0.0, 0.5],
+                    [0.5, 0.5, 0.0]]) * A
+POSITIONS = np.array([[0.0, 0.0, 0.0],
+                      [0.25, 0.25, 0.25]])
+MASS = 28.0855
+
+def get_random_force_constants(num_satom, rng):
+    fc = rng.normal(size=(num_satom, num_satom, 3, 3))
+    return (fc + fc.transpose(1, 0, 3, 2)) / 2
+
+def get_smallest_vectors(n, symprec=1e-5):
+    """Shortest vectors of the n x n x n supercell as phonopy's Primitive
+
+    Supercell atoms are ordered cell by cell, so that the atoms of the
+    primitive cell come first.
+
+    """
+    grid = np.array(list(itertools.product(range(n), repeat=3)))
+    positions = ((POSITIONS[None, :, :] + grid[:, None, :]) /
+                 float(n)).reshape(-1, 3)
+    num_satom = len(positions)
+    num_patom = len(POSITIONS)
+    p2s_map = np.arange(num_patom)
+    s2p_map = np.tile(p2s_map, len(grid))
+    images = np.array(list(itertools.product([-1, 0, 1], repeat=3)))
+    vectors = np.zeros((num_satom, num_patom, 27, 3), dtype='double')
+    multiplicity = np.zeros((num_satom, num_patom), dtype='intc')
+    for k, i in itertools.product(range(num_satom), range(num_patom)):
+        diff = positions[k] - positions[p2s_map[i]]
+        diff = diff - np.rint(diff) + images
+        lengths = np.sqrt((np.dot(diff, LATTICE * n) ** 2).sum(axis=1))
+        shortest = diff[lengths < lengths.min() + symprec]
+        multiplicity[k, i] = len(shortest)
+        vectors[k, i, :len(shortest)] = shortest * n
+    return vectors, multiplicity, p2s_map, s2p_map
+
+def get_dynamical_matrix_loop(fc, vectors, multiplicity, masses, p2s_map,
+                              s2p_map, q):
+    # Same as DynamicalMatrix._set_py_dynamical_matrix of phonopy
+    num_atom = len(p2s_map)
+    dm = np.zeros((3 * num_atom, 3 * num_atom), dtype='c16')
+    for i, s_i in enumerate(p2s_map):
+        for j, s_j in enumerate(p2s_map):
+            sqrt_mm = np.sqrt(masses[i] * masses[j])
+            dm_local = np.zeros((3, 3), dtype='c16')
+            for k in range(len(s2p_map)):
+                if s_j == s2p_map[k]:
+                    multi = multiplicity[k][i]
+                    phase = []
+                    for l in range(multi):
+                        vec = vectors[k][i][l]
+                        phase.append(np.vdot(vec, q) * 2j * np.pi)
+                    phase_factor = np.exp(phase).sum()
+                    dm_local += fc[s_i, k] * phase_factor / sqrt_mm / multi
+            dm[(i*3):(i*3+3), (j*3):(j*3+3)] += dm_local
+    return (dm + dm.conj().transpose()) / 2
+
+def get_phonopy_dynamical_matrix(n, fc):
+    # None if phonopy is not installed
+    try:
+        from phonopy import Phonopy
+        from phonopy.structure.atoms import PhonopyAtoms
+    except ImportError:
+        return None
+    unitcell = PhonopyAtoms(symbols=['Si', 'Si'],
+                            cell=LATTICE,
+                            scaled_positions=POSITIONS)
+    phonon = Phonopy(unitcell, np.eye(3, dtype='intc') * n)
+    phonon.set_force_constants(fc)
+    return phonon.get_dynamical_matrix()
+
+def run_case(n, num_qpoints, rng):
+    vectors, multiplicity, p2s_map, s2p_map = get_smallest_vectors(n)
+    num_satom = len(s2p_map)
+    fc = get_random_force_constants(num_satom, rng)
+    masses = [MASS] * len(p2s_map)
+    qpoints = rng.uniform(-0.5, 0.5, size=(num_qpoints, 3))
+
+    dynamical_matrix = get_phonopy_dynamical_matrix(n, fc)
+    t0 = time.time()
+    if dynamical_matrix is None:
+        reference = 'python loop'
+        dms_ref = np.array([get_dynamical_matrix_loop(fc,
+                                                      vectors,
+                                                      multiplicity,
+                                                      masses,
+                                                      p2s_map,
+                                                      s2p_map,
+                                                      q)
+                            for q in qpoints])
+    else:
+        reference = 'phonopy'
+        dms_ref = []
+        for q in qpoints:
+            dynamical_matrix.set_dynamical_matrix(q)
+            dms_ref.append(dynamical_matrix.get_dynamical_matrix())
+        dms_ref = np.array(dms_ref)
+    t1 = time.time()
+
+    if dynamical_matrix is None:
+        dm_batch = DynamicalMatrixBatch(fc,
+                                        vectors,
+                                        multiplicity,
+                                        masses,
+                                        p2s_map,
+                                        s2p_map)
+    else:
+        dm_batch = get_dynamical_matrix_batch(dynamical_matrix)
+    t2 = time.time()
+    batch_size = dm_batch.get_batch_size()
+    dms = np.concatenate(
+        [dm_batch.get_dynamical_matrices(qpoints[i:i + batch_size])
+         for i in range(0, num_qpoints, batch_size)])
+    t3 = time.time()
+
+    return {'natom': num_satom,
+            'num_qpoints': num_qpoints,
+            'reference': reference,
+            'per_q': t1 - t0,
+            'setup': t2 - t1,
+            'batched': t3 - t2,
+            'num_lattice_points': dm_batch.get_number_of_lattice_points(),
+            'max_diff': np.abs(dms - dms_ref).max()}
+
+def main():
+    parser = OptionParser()
+    parser.set_defaults(sizes="2,3,4", num_qpoints=200, json_filename=None)
+    parser.add_option("--sizes", dest="sizes", type="string",
+                      help="Comma separated supercell sizes n (n x n x n)")
+    parser.add_option("--nq", dest="num_qpoints", type="int",
+                      help="Number of random q-points")
+    parser.add_option("--json", dest="json_filename", type="string",
+                      help="Write results to this file")
+    (options, args) = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    results = []
+    print("%6s %6s %12s %12s %10s %12s %8s %10s" %
+          ('atoms', 'q', 'reference', 'per-q [s]', 'setup [s]',
+           'batched [s]', 'speedup', 'max diff'))
+    for n in [int(x) for x in options.sizes.split(',')]:
+        r = run_case(n, options.num_qpoints, rng)
+        results.append(r)
+        print("%6d %6d %12s %12.4f %10.4f %12.4f %8.1f %10.2e" %
+              (r['natom'], r['num_qpoints'], r['reference'], r['per_q'],
+               r['setup'], r['batched'], r['per_q'] / r['batched'],
+               r['max_diff']))
+
+    if options.json_filename is not None:
+        with open(options.json_filename, 'w') as w:
+            json.dump({'dynamical_matrix': results}, w, indent=2)
+
+    if any([r['max_diff'] > 1e-10 for r in results]):
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
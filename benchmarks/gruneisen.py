@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""Mode Gruneisen parameters: batched vs. one q-point at a time
+
+Dynamical matrices of the original, expanded and compressed volumes are
+made up as random Hermitian matrices, a part of them with degenerate
+eigenvalues as at high symmetry q-points. The Gruneisen parameters are
+calculated by pwmat2phonopy.gruneisen.get_gruneisen_parameters for
+blocks of q-points and q-point by q-point as phonopy's Gruneisen does.
+The q-point by q-point reference uses phonopy's rotate_eigenvectors when
+phonopy is installed, otherwise the copy of phonopy 1.12's
+degenerate_sets and rotate_eigenvectors kept here; the reference column
+tells which one was used. The exit status is 1 if the Gruneisen
+parameters differ.
+
+Usage:
+    python benchmarks/gruneisen.py [--bands 6,24,96] [--nq N]
+                                   [--degenerate 0.2] [--json FILE]
+
+"""
+
+import os
+import sys
+import json
+import time
+from optparse import OptionParser
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pwmat2phonopy.gruneisen import get_gruneisen_parameters
+
+VOLUMES = (40.0, 40.4, 39.6)
+
+def degenerate_sets(freqs, cutoff=1e-4):
+    # Copy of phonopy.phonon.degeneracy.degenerate_sets of phonopy 1.12
+    indices = []
+    done = []
+    for i in range(len(freqs)):
+        if i in done:
+            continue
+        else:
+            f_set = [i]
+            done.append(i)
+        for j in range(i + 1, len(freqs)):
+            if (np.abs(freqs[f_set] - freqs[j]) < cutoff).any():
+                f_set.append(j)
+                done.append(j)
+        indices.append(f_set[:])
+    return indices
+
+def rotate_eigenvectors(eigvals, eigvecs, dD):
+    # Copy of phonopy.phonon.degeneracy.rotate_eigenvectors of phonopy 1.12
+    rot_eigvecs = np.zeros_like(eigvecs)
+    eigvals_dD = np.zeros_like(eigvals)
+    for deg in degenerate_sets(eigvals):
+        dD_part = np.dot(eigvecs[:, deg].T.conj(),
+                         np.dot(dD, eigvecs[:, deg]))
+        eigvals_dD[deg], eigvecs_dD = np.linalg.eigh(dD_part)
+        rot_eigvecs[:, deg] = np.dot(eigvecs[:, deg], eigvecs_dD)
+    return rot_eigvecs, eigvals_dD
+
+def get_random_matrices(num_qpoints, num_band, degenerate_ratio, rng):
+    # Hermitian matrices with eigenvalues 1..10, pairs of them degenerate
+    # at a part of the q-points
+    eigenvalues = np.sort(rng.uniform(1, 10, size=(num_qpoints, num_band)),
+                          axis=1)
+    num_degenerate = int(num_qpoints * degenerate_ratio)
+    eigenvalues[:num_degenerate, 1::2] = eigenvalues[:num_degenerate, 0::2]
+    a = (rng.normal(size=(num_qpoints, num_band, num_band)) +
+         1j * rng.normal(size=(num_qpoints, num_band, num_band)))
+    u = np.linalg.qr(a)[0]
+    dms = np.matmul(u * eigenvalues[:, None, :], u.conj().transpose(0, 2, 1))
+    return (dms + dms.conj().transpose(0, 2, 1)) / 2
+
+def get_gruneisen_per_q(dms, dms_plus, dms_minus):
+    # Loop of phonopy's Gruneisen._set_gruneisen
+    try:
+        from phonopy.phonon.degeneracy import rotate_eigenvectors as rotate
+        reference = 'phonopy'
+    except ImportError:
+        rotate = rotate_eigenvectors
+        reference = 'copy-1.12'
+    volume, volume_plus, volume_minus = VOLUMES
+    dV = volume_plus - volume_minus
+    edDe = []
+    eigvals = []
+    for dm, dm_plus, dm_minus in zip(dms, dms_plus, dms_minus):
+        evals, evecs = np.linalg.eigh(dm)
+        evals_at_q = evals.real
+        evecs_at_q, edDe_at_q = rotate(evals_at_q, evecs, dm_plus - dm_minus)
+        eigvals.append(evals_at_q)
+        edDe.append(edDe_at_q)
+    edDe = np.array(edDe, dtype='double', order='C')
+    eigenvalues = np.array(eigvals, dtype='double', order='C')
+    return -edDe / dV / eigenvalues * volume / 2, reference
+
+def run_case(num_band, num_qpoints, degenerate_ratio, rng):
+    dms = get_random_matrices(num_qpoints, num_band, degenerate_ratio, rng)
+    dms_plus = dms * 0.98 + get_random_matrices(num_qpoints, num_band, 0,
+                                                rng) * 0.01
+    dms_minus = dms * 1.02 - get_random_matrices(num_qpoints, num_band, 0,
+                                                 rng) * 0.01
+
+    t0 = time.time()
+    gruneisen_ref, reference = get_gruneisen_per_q(dms, dms_plus, dms_minus)
+    t1 = time.time()
+    gruneisen = get_gruneisen_parameters(dms, dms_plus, dms_minus,
+                                         *VOLUMES)[0]
+    t2 = time.time()
+
+    return {'num_band': num_band,
+            'num_qpoints': num_qpoints,
+            'degenerate_ratio': degenerate_ratio,
+            'reference': reference,
+            'per_q': t1 - t0,
+            'batched': t2 - t1,
+            'max_diff': np.abs(gruneisen - gruneisen_ref).max()}
+
+def main():
+    parser = OptionParser()
+    parser.set_defaults(bands="6,24,96", num_qpoints=1000,
+                        degenerate_ratio=0.2, json_filename=None)
+    parser.add_option("--bands", dest="bands", type="string",
+                      help="Comma separated numbers of bands")
+    parser.add_option("--nq", dest="num_qpoints", type="int",
+                      help="Number of q-points")
+    parser.add_option("--degenerate", dest="degenerate_ratio", type="float",
+                      help="Ratio of q-points with degenerate eigenvalues")
+    parser.add_option("--json", dest="json_filename", type="string",
+                      help="Write results to this file")
+    (options, args) = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    results = []
+    print("%6s %6s %12s %12s %12s %8s %10s" %
+          ('bands', 'q', 'reference', 'per-q [s]', 'batched [s]', 'speedup',
+           'max diff'))
+    for num_band in [int(x) for x in options.bands.split(',')]:
+        r = run_case(num_band,
+                     options.num_qpoints,
+                     options.degenerate_ratio,
+                     rng)
+        results.append(r)
+        print("%6d %6d %12s %12.4f %12.4f %8.1f %10.2e" %
+              (r['num_band'], r['num_qpoints'], r['reference'], r['per_q'],
+               r['batched'], r['per_q'] / r['batched'], r['max_diff']))
+
+    if options.json_filename is not None:
+        with open(options.json_filename, 'w') as w:
+            json.dump({'gruneisen': results}, w, indent=2)
+
+    if any([r['max_diff'] > 1e-8 for r in results]):
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,442 @@
+#!/usr/bin/env python
+"""Timings of the hot paths of PWmat2Phonopy
+
+The cases are taken from the bundled examples (examples/Si, examples/NaCl
+and examples/CaTiO3 with their phonon_ref directories) and from synthetic
+supercells of the Si unit cell built here, which go up to several
+thousand atoms:
+
+    read_pwmat                          atom.config
+    parse_set_of_forces                 OUT.FORCE
+    write_supercells_with_displacements phonon/forces-XXX/atom.config
+    parse_FORCE_SETS                    FORCE_SETS
+    parse_FORCE_CONSTANTS               FORCE_CONSTANTS
+    produce_force_constants             FORCE_SETS -> force constants
+    band                                band structure of band_dos.conf
+    mesh                                sampling mesh of band_dos.conf
+
+Every case is run --repeat times and the best and the mean wall times are
+reported. Results are written as JSON with --json, and --compare reads a
+JSON file of an earlier run (e.g. of the last release) and marks cases
+that became slower than --threshold times. Cases needing a package that
+is not installed (phonopy, h5py) are reported as skipped.
+
+Usage:
+    python benchmarks/hot_paths.py [--repeat N] [--max_atoms N]
+                                   [--max_fc_atoms N] [--only NAME,...]
+                                   [--json FILE] [--compare FILE]
+                                   [--threshold X]
+
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+from optparse import OptionParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+EXAMPLES = [('Si', os.path.join(ROOT, 'examples', 'Si')),
+            ('NaCl', os.path.join(ROOT, 'examples', 'NaCl')),
+            ('CaTiO3', os.path.join(ROOT, 'examples', 'CaTiO3'))]
+
+# Supercells of the 2-atom Si unit cell: 16 to 4394 atoms
+SUPERCELL_SIZES = [2, 4, 6, 8, 10, 13]
+
+# FORCE_CONSTANTS grows with the square of the number of atoms, so the
+# synthetic files are limited to this number of atoms by default.
+MAX_FC_ATOMS = 432
+
+# Mesh used for the mesh benchmark of the examples
+MESH = [20, 20, 20]
+
+try:
+    _clock = time.perf_counter
+except AttributeError: # python 2
+    _clock = time.time
+
+#####################
+# Synthetic inputs  #
+#####################
+def read_atom_config_arrays(filename):
+    """Lattice, atomic numbers and fractional positions of atom.config"""
+    import numpy as np
+
+    with open(filename) as f:
+        lines = f.readlines()
+    num_atoms = int(lines[0].split()[0])
+    lattice = np.array([[float(x) for x in lines[i].split()[:3]]
+                        for i in range(2, 5)])
+    numbers = []
+    positions = []
+    for line in lines[6:6 + num_atoms]:
+        data = line.split()
+        numbers.append(int(data[0]))
+        positions.append([float(x) for x in data[1:4]])
+    return lattice, np.array(numbers), np.array(positions)
+
+def build_supercell(lattice, numbers, positions, n):
+    import numpy as np
+
+    grid = np.array([[i, j, k]
+                     for i in range(n) for j in range(n) for k in range(n)])
+    s_positions = ((positions[None, :, :] + grid[:, None, :]) / float(n))
+    s_numbers = np.tile(numbers, len(grid))
+    return lattice * n, s_numbers, s_positions.reshape(-1, 3)
+
+def write_atom_config(filename, lattice, numbers, positions):
+    with open(filename, 'w') as w:
+        w.write("%d atoms\n" % len(numbers))
+        w.write(" Lattice vector\n")
+        for v in lattice:
+            w.write("  %21.16f %21.16f %21.16f\n" % tuple(v))
+        w.write(" Position, move_x, move_y, move_z\n")
+        for z, p in zip(numbers, positions):
+            w.write("%4d %20.16f %20.16f %20.16f  1  1  1\n" % ((z,) + tuple(p)))
+
+def write_out_force(filename, numbers, forces):
+    with open(filename, 'w') as w:
+        w.write(" %d atoms, force (eV/A)\n" % len(numbers))
+        for z, f in zip(numbers, forces):
+            w.write("%4d %18.10E %18.10E %18.10E\n" % ((z,) + tuple(f)))
+
+def write_force_sets(filename, natom, num_displacements, rng):
+    with open(filename, 'w') as w:
+        w.write("%-5d\n" % natom)
+        w.write("%-5d\n" % num_displacements)
+        for i in range(num_displacements):
+            w.write("\n%-5d\n" % (i + 1))
+            w.write("%20.16f %20.16f %20.16f\n" % (0.01, 0.0, 0.0))
+            for f in rng.normal(scale=0.01, size=(natom, 3)):
+                w.write("%15.10f %15.10f %15.10f\n" % tuple(f))
+
+def write_force_constants(filename, natom, rng):
+    fc = rng.normal(size=(natom, 3, 3))
+    with open(filename, 'w') as w:
+        w.write("%4d\n" % natom)
+        for i in range(natom):
+            for j in range(natom):
+                w.write("%4d%4d\n" % (i + 1, j + 1))
+                for vec in fc[j]:
+                    w.write(("%22.15f" * 3 + "\n") % tuple(vec))
+
+class Inputs(object):
+    """Example and synthetic input files in a temporary directory"""
+    def __init__(self, workdir, max_atoms, max_fc_atoms=MAX_FC_ATOMS):
+        import numpy as np
+
+        self.workdir = workdir
+        self.cells = []        # (case, atom.config)
+        self.force_files = []  # (case, natom, [OUT.FORCE, ...])
+        self.force_sets = []   # (case, natom, FORCE_SETS)
+        self.fc_files = []     # (case, natom, FORCE_CONSTANTS)
+        self.phonon_dirs = []  # (case, directory with FORCE_SETS and conf)
+        self.supercells = []   # (case, n, natom, FORCE_SETS)
+        rng = np.random.RandomState(0)
+
+        for name, path in EXAMPLES:
+            phonon_ref = os.path.join(path, 'phonon_ref')
+            self.cells.append((name, os.path.join(path, 'atom.config')))
+            if not os.path.isdir(phonon_ref):
+                continue
+            out_forces = sorted(
+                [os.path.join(phonon_ref, d, 'OUT.FORCE')
+                 for d in os.listdir(phonon_ref)
+                 if os.path.exists(os.path.join(phonon_ref, d, 'OUT.FORCE'))])
+            with open(os.path.join(phonon_ref, 'FORCE_SETS')) as f:
+                natom = int(f.readline().split()[0])
+            if out_forces:
+                self.force_files.append((name, natom, out_forces))
+            self.force_sets.append(
+                (name, natom, os.path.join(phonon_ref, 'FORCE_SETS')))
+            self.phonon_dirs.append((name, phonon_ref))
+
+        lattice, numbers, positions = read_atom_config_arrays(
+            os.path.join(ROOT, 'examples', 'Si', 'atom.config'))
+        for n in SUPERCELL_SIZES:
+            natom = len(numbers) * n ** 3
+            if natom > max_atoms:
+                break
+            case = "Si-%dx%dx%d" % (n, n, n)
+            s_lattice, s_numbers, s_positions = build_supercell(
+                lattice, numbers, positions, n)
+            filename = os.path.join(workdir, "atom-%d.config" % natom)
+            write_atom_config(filename, s_lattice, s_numbers, s_positions)
+            self.cells.append((case, filename))
+
+            filenames = []
+            for i in range(2):
+                filename = os.path.join(workdir,
+                                        "OUT.FORCE-%d-%d" % (natom, i + 1))
+                write_out_force(filename,
+                                s_numbers,
+                                rng.normal(scale=0.01, size=(natom, 3)))
+                filenames.append(filename)
+            self.force_files.append((case, natom, filenames))
+
+            filename = os.path.join(workdir, "FORCE_SETS-%d" % natom)
+            write_force_sets(filename, natom, 2, rng)
+            self.force_sets.append((case, natom, filename))
+            self.supercells.append((case, n, natom, filename))
+
+            if natom <= max_fc_atoms:
+                filename = os.path.join(workdir, "FORCE_CONSTANTS-%d" % natom)
+                write_force_constants(filename, natom, rng)
+                self.fc_files.append((case, natom, filename))
+
+##############
+# Benchmarks #
+##############
+# Every benchmark yields (case, number of atoms, function to be timed).
+
+def bench_read_pwmat(inputs):
+    from pwmat2phonopy.interface.pwmat import read_pwmat
+    # PhonopyAtoms is imported on the first call
+    import phonopy
+    for case, filename in inputs.cells:
+        with open(filename) as f:
+            natom = int(f.readline().split()[0])
+        yield case, natom, (lambda filename=filename: read_pwmat(filename))
+
+def bench_parse_set_of_forces(inputs):
+    from pwmat2phonopy.interface.pwmat import parse_set_of_forces
+    for case, natom, filenames in inputs.force_files:
+        yield case, natom, (
+            lambda natom=natom, filenames=filenames:
+            parse_set_of_forces(natom, filenames, verbose=False))
+
+def bench_write_supercells_with_displacements(inputs):
+    from phonopy import Phonopy
+    from pwmat2phonopy.interface.pwmat import (
+        read_pwmat, write_supercells_with_displacements)
+
+    unitcell = read_pwmat(os.path.join(ROOT, 'examples', 'Si', 'atom.config'))
+    for case, n, natom, _ in inputs.supercells:
+        phonon = Phonopy(unitcell, [[n, 0, 0], [0, n, 0], [0, 0, n]])
+        phonon.generate_displacements(distance=0.01)
+        supercell = phonon.get_supercell()
+        cells = phonon.get_supercells_with_displacements()
+        workdir = os.path.join(inputs.workdir, "disp-%d" % natom)
+
+        def run(supercell=supercell, cells=cells, workdir=workdir, n=n):
+            if os.path.exists(workdir):
+                shutil.rmtree(workdir)
+            os.makedirs(os.path.join(workdir, 'phonon'))
+            cwd = os.getcwd()
+            os.chdir(workdir)
+            try:
+                write_supercells_with_displacements(
+                    supercell, cells, supercell_dimension="%dx%dx%d" % (n, n, n))
+            finally:
+                os.chdir(cwd)
+
+        yield case, natom, run
+
+def bench_parse_FORCE_SETS(inputs):
+    from pwmat2phonopy.file_IO import parse_FORCE_SETS
+    for case, natom, filename in inputs.force_sets:
+        yield case, natom, (lambda filename=filename:
+                            parse_FORCE_SETS(filename=filename))
+
+def bench_parse_FORCE_CONSTANTS(inputs):
+    from pwmat2phonopy.file_IO import parse_FORCE_CONSTANTS
+    for case, natom, filename in inputs.fc_files:
+        yield case, natom, (lambda filename=filename:
+                            parse_FORCE_CONSTANTS(filename=filename))
+
+def _load_example(phonon_dir, log_level=0):
+    import pwmat2phonopy.driver as driver
+    from pwmat2phonopy.file_IO import parse_FORCE_SETS
+
+    settings, confs = driver.load_settings(
+        filename=os.path.join(phonon_dir, 'band_dos.conf'))
+    settings.set_calculator('pwmat')
+    settings.set_cell_filename(
+        os.path.join(os.path.dirname(phonon_dir), 'atom.config'))
+    unitcell = driver.read_cell(settings)[0]
+    phonon = driver.init_phonopy(unitcell, settings)
+    force_sets = parse_FORCE_SETS(
+        filename=os.path.join(phonon_dir, 'FORCE_SETS'))
+    return settings, phonon, force_sets
+
+def bench_produce_force_constants(inputs):
+    from pwmat2phonopy.file_IO import parse_FORCE_SETS
+    from pwmat2phonopy.interface.pwmat import read_pwmat
+    from phonopy import Phonopy
+
+    for case, phonon_dir in inputs.phonon_dirs:
+        settings, phonon, force_sets = _load_example(phonon_dir)
+        phonon.set_displacement_dataset(force_sets)
+        yield case, force_sets['natom'], phonon.produce_force_constants
+
+    unitcell = read_pwmat(os.path.join(ROOT, 'examples', 'Si', 'atom.config'))
+    for case, n, natom, filename in inputs.supercells:
+        phonon = Phonopy(unitcell, [[n, 0, 0], [0, n, 0], [0, 0, n]])
+        force_sets = parse_FORCE_SETS(filename=filename)
+        phonon.set_displacement_dataset(force_sets)
+        # Full force constants of thousands of atoms do not fit in memory.
+        yield case, natom, (
+            lambda phonon=phonon: phonon.produce_force_constants(
+                calculate_full_force_constants=False))
+
+def bench_band(inputs):
+    import phonopy
+    for case, phonon_dir in inputs.phonon_dirs:
+        settings, phonon, force_sets = _load_example(phonon_dir)
+        phonon.set_displacement_dataset(force_sets)
+        phonon.produce_force_constants()
+        yield case, force_sets['natom'], (
+            lambda phonon=phonon, settings=settings:
+            phonon.set_band_structure(settings.get_bands()))
+
+def bench_mesh(inputs):
+    import phonopy
+    for case, phonon_dir in inputs.phonon_dirs:
+        settings, phonon, force_sets = _load_example(phonon_dir)
+        phonon.set_displacement_dataset(force_sets)
+        phonon.produce_force_constants()
+        case = "%s-%dx%dx%d" % ((case,) + tuple(MESH))
+        yield case, force_sets['natom'], (
+            lambda phonon=phonon: phonon.set_mesh(MESH))
+
+BENCHMARKS = [
+    ('read_pwmat', bench_read_pwmat),
+    ('parse_set_of_forces', bench_parse_set_of_forces),
+    ('write_supercells_with_displacements',
+     bench_write_supercells_with_displacements),
+    ('parse_FORCE_SETS', bench_parse_FORCE_SETS),
+    ('parse_FORCE_CONSTANTS', bench_parse_FORCE_CONSTANTS),
+    ('produce_force_constants', bench_produce_force_constants),
+    ('band', bench_band),
+    ('mesh', bench_mesh),
+]
+
+##########
+# Runner #
+##########
+def time_function(function, repeat):
+    times = []
+    for i in range(repeat):
+        t0 = _clock()
+        function()
+        times.append(_clock() - t0)
+    return {'best': min(times), 'mean': sum(times) / len(times)}
+
+def run_benchmarks(inputs, names, repeat):
+    results = {}
+    for name, benchmark in BENCHMARKS:
+        if names and name not in names:
+            continue
+        cases = {}
+        try:
+            for case, natom, function in benchmark(inputs):
+                r = time_function(function, repeat)
+                r['natom'] = natom
+                cases[case] = r
+                print("%-36s %-16s %6d %10.4f %10.4f" %
+                      (name, case, natom, r['best'], r['mean']))
+                sys.stdout.flush()
+            results[name] = {'status': 'ok', 'cases': cases}
+        except ImportError as e:
+            print("%-36s skipped (%s)" % (name, e))
+            results[name] = {'status': 'skipped', 'reason': str(e),
+                             'cases': cases}
+    return results
+
+def compare(results, reference, threshold):
+    """Print ratios to the reference run and return number of regressions"""
+    num_regressions = 0
+    print('')
+    print("%-36s %-16s %10s %10s %7s" %
+          ('benchmark', 'case', 'ref [s]', 'now [s]', 'ratio'))
+    for name, r in results.items():
+        ref = reference.get('benchmarks', {}).get(name)
+        if ref is None:
+            continue
+        for case, c in r['cases'].items():
+            if case not in ref['cases']:
+                continue
+            t_ref = ref['cases'][case]['best']
+            ratio = c['best'] / t_ref if t_ref > 0 else float('inf')
+            mark = ''
+            if ratio > threshold:
+                mark = ' SLOWER'
+                num_regressions += 1
+            print("%-36s %-16s %10.4f %10.4f %7.2f%s" %
+                  (name, case, t_ref, c['best'], ratio, mark))
+    return num_regressions
+
+def get_environment():
+    env = {'python': platform.python_version(),
+           'platform': platform.platform(),
+           'machine': platform.machine(),
+           'date': time.strftime("%Y-%m-%d %H:%M:%S")}
+    try:
+        import numpy
+        env['numpy'] = numpy.__version__
+    except ImportError:
+        pass
+    try:
+        from phonopy import __version__
+        env['phonopy'] = __version__
+    except ImportError:
+        pass
+    return env
+
+def main():
+    parser = OptionParser()
+    parser.set_defaults(repeat=3,
+                        max_atoms=4394,
+                        max_fc_atoms=MAX_FC_ATOMS,
+                        only=None,
+                        json_filename=None,
+                        compare_filename=None,
+                        threshold=1.2)
+    parser.add_option("--repeat", dest="repeat", type="int",
+                      help="Number of runs per case (best and mean are shown)")
+    parser.add_option("--max_atoms", dest="max_atoms", type="int",
+                      help="Largest synthetic supercell in number of atoms")
+    parser.add_option("--max_fc_atoms", dest="max_fc_atoms", type="int",
+                      help="Largest synthetic FORCE_CONSTANTS in number of atoms")
+    parser.add_option("--only", dest="only", type="string",
+                      help="Comma separated names of benchmarks to run")
+    parser.add_option("--json", dest="json_filename", type="string",
+                      help="Write results to this file")
+    parser.add_option("--compare", dest="compare_filename", type="string",
+                      help="JSON file of an earlier run to compare with")
+    parser.add_option("--threshold", dest="threshold", type="float",
+                      help="Ratio to the earlier run counted as regression")
+    (options, args) = parser.parse_args()
+
+    names = None
+    if options.only:
+        names = [x.strip() for x in options.only.split(',')]
+
+    workdir = tempfile.mkdtemp(prefix='pwmat2phonopy_bench_')
+    try:
+        inputs = Inputs(workdir, options.max_atoms, options.max_fc_atoms)
+        print("%-36s %-16s %6s %10s %10s" %
+              ('benchmark', 'case', 'atoms', 'best [s]', 'mean [s]'))
+        results = run_benchmarks(inputs, names, options.repeat)
+    finally:
+        shutil.rmtree(workdir)
+
+    if options.json_filename is not None:
+        with open(options.json_filename, 'w') as w:
+            json.dump({'environment': get_environment(),
+                       'repeat': options.repeat,
+                       'benchmarks': results}, w, indent=2)
+
+    if options.compare_filename is not None:
+        with open(options.compare_filename) as f:
+            reference = json.load(f)
+        if compare(results, reference, options.threshold) > 0:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
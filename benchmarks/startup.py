@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""Startup time of the PWmat2Phonopy command line
+
+Every subcommand is run in a fresh interpreter with ``python -X importtime``
+so that the time spent on imports is measured separately from the wall
+time. The slowest top-level imports are listed to show what a subcommand
+pulls in. The exit status is 1 when a subcommand exceeds its time budget.
+
+Usage:
+    python benchmarks/startup.py [--repeat N] [--json FILE]
+
+"""
+
+import os
+import sys
+import re
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, 'bin', 'PWmat2Phonopy')
+EXAMPLE = os.path.join(ROOT, 'examples', 'Si')
+
+# name: (arguments, budget of wall time in seconds)
+SUBCOMMANDS = [
+    ('help', (['--help'], 0.5)),
+    ('force_sets', (['--pwmat', '-f',
+                     'forces-001/OUT.FORCE',
+                     'forces-002/OUT.FORCE'], 1.5)),
+    ('symmetry', (['--pwmat', '--symmetry', '-c', 'atom.config'], 5.0)),
+]
+
+_IMPORTTIME = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+def prepare_workdir(workdir):
+    shutil.copy(os.path.join(EXAMPLE, 'atom.config'), workdir)
+    phonon_ref = os.path.join(EXAMPLE, 'phonon_ref')
+    shutil.copy(os.path.join(phonon_ref, 'disp.yaml'), workdir)
+    for name in ('forces-001', 'forces-002'):
+        os.mkdir(os.path.join(workdir, name))
+        shutil.copy(os.path.join(phonon_ref, name, 'OUT.FORCE'),
+                    os.path.join(workdir, name))
+
+def parse_importtime(stderr):
+    """Return total import time and top-level imports in seconds"""
+    top_level = []
+    for line in stderr.splitlines():
+        m = _IMPORTTIME.match(line)
+        if m is None:
+            continue
+        # Top-level imports are indented by a single space
+        if len(m.group(3)) == 1:
+            top_level.append((int(m.group(2)) * 1e-6, m.group(4)))
+    total = sum([t for t, _ in top_level])
+    top_level.sort(reverse=True)
+    return total, top_level
+
+def run_subcommand(args, workdir):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [x for x in [env.get('PYTHONPATH')] if x])
+    cmd = [sys.executable, '-X', 'importtime', SCRIPT] + args
+    t0 = time.time()
+    proc = subprocess.Popen(cmd,
+                            cwd=workdir,
+                            env=env,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    stdout, stderr = proc.communicate()
+    wall_time = time.time() - t0
+    import_time, top_level = parse_importtime(stderr)
+    return {'wall_time': wall_time,
+            'import_time': import_time,
+            'returncode': proc.returncode,
+            'slowest_imports': top_level[:5]}
+
+def main():
+    parser = OptionParser()
+    parser.set_defaults(repeat=3, json_filename=None)
+    parser.add_option("--repeat", dest="repeat", type="int",
+                      help="Number of runs per subcommand (best is taken)")
+    parser.add_option("--json", dest="json_filename", type="string",
+                      help="Write results to this file")
+    (options, args) = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='pwmat2phonopy_startup_')
+    results = {}
+    try:
+        prepare_workdir(workdir)
+        for name, (cmd_args, budget) in SUBCOMMANDS:
+            runs = [run_subcommand(cmd_args, workdir)
+                    for i in range(options.repeat)]
+            best = min(runs, key=lambda x: x['wall_time'])
+            best['budget'] = budget
+            best['within_budget'] = (best['returncode'] == 0 and
+                                     best['wall_time'] < budget)
+            results[name] = best
+    finally:
+        shutil.rmtree(workdir)
+
+    print("%-12s %10s %10s %10s  %s" %
+          ('subcommand', 'wall [s]', 'import [s]', 'budget [s]', 'status'))
+    for name, _ in SUBCOMMANDS:
+        r = results[name]
+        if r['returncode'] != 0:
+            status = "FAILED (exit status %d)" % r['returncode']
+        elif r['within_budget']:
+            status = "ok"
+        else:
+            status = "OVER BUDGET"
+        print("%-12s %10.3f %10.3f %10.3f  %s" %
+              (name, r['wall_time'], r['import_time'], r['budget'], status))
+        for t, module in r['slowest_imports']:
+            print("%14s %8.3f  %s" % ('', t, module))
+
+    if options.json_filename is not None:
+        with open(options.json_filename, 'w') as w:
+            json.dump(results, w, indent=2)
+
+    if all([r['within_budget'] for r in results.values()]):
+        return 0
+    else:
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
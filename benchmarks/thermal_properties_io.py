@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""QHA input loading: thermal_properties.yaml vs. the binary files
+
+Thermal properties of a set of volumes are calculated by
+pwmat2phonopy.thermal_properties.ThermalPropertiesGrid from random
+frequencies scaled with the volume, and written to
+thermal_properties.yaml and thermal_properties.hdf5 (.npz without h5py)
+in one directory per volume. They are then loaded by
+file_IO.read_thermal_properties_yaml, and by file_IO.read_thermal_properties
+from the binary files and from the yaml files only (parallel parsing).
+The exit status is 1 if the loaded arrays differ.
+
+Usage:
+    python benchmarks/thermal_properties_io.py [--volumes 30] [--tmax 2000]
+                                               [--tstep 1] [--json FILE]
+
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+from optparse import OptionParser
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pwmat2phonopy.file_IO import (read_thermal_properties,
+                                   read_thermal_properties_yaml)
+from pwmat2phonopy.mesh_chunks import get_temperatures
+from pwmat2phonopy.thermal_properties import (ThermalPropertiesGrid,
+                                              get_binary_filename)
+
+def write_volumes(directory, num_volumes, temperatures, rng):
+    frequencies = rng.uniform(0.5, 15, size=(500, 6))
+    weights = rng.randint(1, 48, size=500)
+    yaml_filenames = []
+    for i, scale in enumerate(np.linspace(1.05, 0.95, num_volumes)):
+        volume_dir = os.path.join(directory, "%03d" % i)
+        os.mkdir(volume_dir)
+        filename = os.path.join(volume_dir, "thermal_properties.yaml")
+        tp = ThermalPropertiesGrid(frequencies * scale, weights=weights)
+        tp.run(temperatures)
+        tp.write_yaml(filename)
+        tp.write_hdf5(get_binary_filename(filename))
+        yaml_filenames.append(filename)
+    return yaml_filenames
+
+def get_max_diff(data, reference):
+    diffs = [np.abs(np.array(x) - np.array(y)).max()
+             for x, y in zip(data[:4], reference[:4])]
+    if list(data[4]) != list(reference[4]):
+        diffs.append(np.inf)
+    return max(diffs)
+
+def main():
+    parser = OptionParser()
+    parser.set_defaults(num_volumes=30, t_max=2000.0, t_step=1.0,
+                        json_filename=None)
+    parser.add_option("--volumes", dest="num_volumes", type="int",
+                      help="Number of volumes")
+    parser.add_option("--tmax", dest="t_max", type="float",
+                      help="Maximum temperature")
+    parser.add_option("--tstep", dest="t_step", type="float",
+                      help="Temperature step")
+    parser.add_option("--json", dest="json_filename", type="string",
+                      help="Write results to this file")
+    (options, args) = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    temperatures = get_temperatures(t_min=0,
+                                    t_max=options.t_max,
+                                    t_step=options.t_step)
+    directory = tempfile.mkdtemp()
+    try:
+        filenames = write_volumes(directory,
+                                  options.num_volumes,
+                                  temperatures,
+                                  rng)
+
+        t0 = time.time()
+        reference = read_thermal_properties_yaml(filenames)
+        t1 = time.time()
+        binary = read_thermal_properties(filenames)
+        t2 = time.time()
+        for filename in filenames:
+            os.remove(get_binary_filename(filename))
+        fallback = read_thermal_properties(filenames)
+        t3 = time.time()
+    finally:
+        shutil.rmtree(directory)
+
+    result = {'num_volumes': options.num_volumes,
+              'num_temperatures': len(temperatures),
+              'binary_format': os.path.splitext(
+                  get_binary_filename())[1][1:],
+              'yaml': t1 - t0,
+              'binary': t2 - t1,
+              'yaml_parallel': t3 - t2,
+              'max_diff_binary': get_max_diff(binary, reference),
+              'max_diff_yaml_parallel': get_max_diff(fallback, reference)}
+
+    print("%8s %8s %10s %12s %12s %14s %10s" %
+          ('volumes', 'temps', 'yaml [s]', 'binary [s]', 'speedup',
+           'yaml par. [s]', 'max diff'))
+    print("%8d %8d %10.4f %12.4f %12.1f %14.4f %10.2e" %
+          (result['num_volumes'], result['num_temperatures'],
+           result['yaml'], result['binary'],
+           result['yaml'] / result['binary'], result['yaml_parallel'],
+           max(result['max_diff_binary'],
+               result['max_diff_yaml_parallel'])))
+
+    if options.json_filename is not None:
+        with open(options.json_filename, 'w') as w:
+            json.dump({'thermal_properties_io': result}, w, indent=2)
+
+    # The yaml has 7 decimals
+    if max(result['max_diff_binary'],
+           result['max_diff_yaml_parallel']) > 1e-6:
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+"""Time and peak memory of reading large vasprun.xml files
+
+Synthetic vasprun.xml files of the given sizes are written (an MD-like
+run of many ionic steps, each with structure, forces, stress and
+energies, followed by a calculation with a Hessian), and every reader is
+run in a fresh process so that its peak RSS can be measured:
+
+    etree-forces   Vasprun(f).read_forces()
+    expat-forces   Vasprun(f, use_expat=True).read_forces()
+    etree-fc       Vasprun(f).read_force_constants()
+
+The peak RSS should not depend on the file size, except for that of
+etree-forces, which returns the forces of all ionic steps.
+
+Usage:
+    python benchmarks/vasprun_memory.py [--sizes 100,500] [--natom 64]
+        [--hessian_natom 32] [--dir /tmp] [--keep] [--json FILE]
+
+Sizes are in MB, e.g. --sizes 1024,5120 for 1 and 5 GB.
+
+"""
+
+import os
+import sys
+import json
+import time
+import subprocess
+from optparse import OptionParser
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+READERS = ('etree-forces', 'expat-forces', 'etree-fc')
+
+def _write_varray(w, name, values, indent="   "):
+    w.write('%s<varray name="%s" >\n' % (indent, name))
+    for row in values:
+        w.write("%s <v>%s </v>\n" % (indent,
+                                     "".join(["%16.8f" % x for x in row])))
+    w.write("%s</varray>\n" % indent)
+
+def _write_structure(w, lattice, positions, name=None):
+    if name is None:
+        w.write("  <structure>\n")
+    else:
+        w.write('  <structure name="%s" >\n' % name)
+    w.write("   <crystal>\n")
+    _write_varray(w, "basis", lattice, indent="    ")
+    w.write("   </crystal>\n")
+    _write_varray(w, "positions", positions)
+    w.write("  </structure>\n")
+
+def write_vasprun(filename, size_mb, natom=64, hessian_natom=32, seed=0):
+    """Write a synthetic vasprun.xml of about size_mb MB
+
+    Ionic steps are appended until the size is reached. The Hessian of
+    the last calculation is of hessian_natom atoms, whose atomtypes are
+    those of the file. Returns the number of ionic steps.
+
+    """
+    rng = np.random.RandomState(seed)
+    lattice = np.eye(3) * 10.0
+    natoms = [hessian_natom // 2, hessian_natom - hessian_natom // 2]
+    size = size_mb * 1024 ** 2
+    num_steps = 0
+    with open(filename, 'w') as w:
+        w.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n')
+        w.write("<modeling>\n <generator>\n")
+        w.write('  <i name="program" type="string">vasp </i>\n')
+        w.write('  <i name="version" type="string">5.4.4  </i>\n')
+        w.write(" </generator>\n")
+        w.write(" <atominfo>\n  <atoms>  %d </atoms>\n" % hessian_natom)
+        w.write('  <array name="atomtypes" >\n   <set>\n')
+        for n, (s, m) in zip(natoms, (('Si', 28.085), ('O', 16.0))):
+            w.write("    <rc><c>%4d</c><c>%-2s</c><c>%16.8f</c>"
+                    "<c>%16.8f</c><c>PAW_PBE %s</c></rc>\n" %
+                    (n, s, m, 4.0, s))
+        w.write("   </set>\n  </array>\n </atominfo>\n")
+        _write_structure(w, lattice, rng.rand(natom, 3), name="initialpos")
+        while w.tell() < size:
+            w.write(" <calculation>\n")
+            for i in range(3):
+                w.write("  <scstep>\n   <energy>\n")
+                w.write('    <i name="e_fr_energy"> %16.8f </i>\n' %
+                        rng.rand())
+                w.write("   </energy>\n  </scstep>\n")
+            _write_structure(w, lattice, rng.rand(natom, 3))
+            _write_varray(w, "forces", rng.normal(size=(natom, 3)), "  ")
+            _write_varray(w, "stress", rng.normal(size=(3, 3)), "  ")
+            w.write("  <energy>\n")
+            for name in ("e_fr_energy", "e_wo_entrp", "e_0_energy"):
+                w.write('   <i name="%s"> %16.8f </i>\n' %
+                        (name, rng.rand()))
+            w.write("  </energy>\n </calculation>\n")
+            num_steps += 1
+        w.write(" <calculation>\n  <dynmat>\n")
+        hessian = rng.normal(size=(hessian_natom * 3, hessian_natom * 3))
+        _write_varray(w, "hessian", (hessian + hessian.T) / 2, "   ")
+        w.write("  </dynmat>\n </calculation>\n")
+        _write_structure(w, lattice, rng.rand(natom, 3), name="finalpos")
+        w.write("</modeling>\n")
+    return num_steps
+
+def run_reader(reader, filename):
+    """Run in a child process, prints JSON of time and peak RSS"""
+    import io
+    import resource
+    from pwmat2phonopy.interface.pwmat import Vasprun
+
+    t0 = time.time()
+    with io.open(filename, "rb") as f:
+        if reader == 'etree-forces':
+            shape = Vasprun(f).read_forces().shape
+        elif reader == 'expat-forces':
+            shape = Vasprun(f, use_expat=True).read_forces().shape
+        else:
+            shape = Vasprun(f).read_force_constants()[0].shape
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    if sys.platform == 'darwin':
+        max_rss //= 1024
+    print(json.dumps({'time': time.time() - t0,
+                      'max_rss': max_rss,
+                      'shape': list(shape)}))
+
+def main():
+    parser = OptionParser()
+    parser.set_defaults(sizes="100,500",
+                        natom=64,
+                        hessian_natom=32,
+                        directory=None,
+                        keep=False,
+                        json_filename=None,
+                        child=None)
+    parser.add_option("--sizes", dest="sizes", type="string",
+                      help="Comma separated file sizes in MB")
+    parser.add_option("--natom", dest="natom", type="int",
+                      help="Number of atoms of the ionic steps")
+    parser.add_option("--hessian_natom", dest="hessian_natom", type="int",
+                      help="Number of atoms of the Hessian")
+    parser.add_option("--dir", dest="directory", type="string",
+                      help="Directory of the synthetic files")
+    parser.add_option("--keep", dest="keep", action="store_true",
+                      help="Do not remove the synthetic files")
+    parser.add_option("--json", dest="json_filename", type="string",
+                      help="Write results to this file")
+    parser.add_option("--child", dest="child", type="string",
+                      help="(internal) run READER:FILENAME and exit")
+    (options, args) = parser.parse_args()
+
+    if options.child is not None:
+        reader, filename = options.child.split(':', 1)
+        run_reader(reader, filename)
+        return 0
+
+    directory = options.directory
+    if directory is None:
+        import tempfile
+        directory = tempfile.gettempdir()
+
+    results = []
+    print("%10s %8s %-14s %10s %12s" %
+          ('size [MB]', 'steps', 'reader', 'time [s]', 'peak [MB]'))
+    for size_mb in [int(x) for x in options.sizes.split(',')]:
+        filename = os.path.join(directory, "vasprun-%dMB.xml" % size_mb)
+        num_steps = write_vasprun(filename,
+                                  size_mb,
+                                  natom=options.natom,
+                                  hessian_natom=options.hessian_natom)
+        try:
+            for reader in READERS:
+                out = subprocess.check_output(
+                    [sys.executable, os.path.abspath(__file__),
+                     "--child", "%s:%s" % (reader, filename)])
+                r = json.loads(out.decode('utf-8').splitlines()[-1])
+                r.update({'size_mb': size_mb,
+                          'num_steps': num_steps,
+                          'reader': reader})
+                results.append(r)
+                print("%10d %8d %-14s %10.2f %12.1f" %
+                      (size_mb, num_steps, reader, r['time'],
+                       r['max_rss'] / 1024.0 ** 2))
+                sys.stdout.flush()
+        finally:
+            if not options.keep:
+                os.remove(filename)
+
+    if options.json_filename is not None:
+        with open(options.json_filename, 'w') as w:
+            json.dump(results, w, indent=2)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 import os
+import sys
+import shutil
 import subprocess
 
 try:
@@ -13,6 +15,16 @@ __licence__ = "GPL"
 __date__    = "Nov. 2017"
 
 if __name__ == "__main__":
+    # Quasi-harmonic volume sweep (PWmatRunPhonopy.py qha [options])
+    if len(sys.argv) > 1 and sys.argv[1] == 'qha':
+        from pwmat2phonopy.interface.pwmat_qha import main as qha_main
+        sys.exit(qha_main(sys.argv[2:]))
+    # Mode Gruneisen parameters (PWmatRunPhonopy.py gruneisen [options])
+    if len(sys.argv) > 1 and sys.argv[1] == 'gruneisen':
+        from pwmat2phonopy.interface.pwmat_gruneisen import (
+            main as gruneisen_main)
+        sys.exit(gruneisen_main(sys.argv[2:]))
+
     pwmat_run.print_phononpy()
 ############################
 # initiallize calculations #
@@ -37,7 +49,10 @@ if __name__ == "__main__":
 # produce displacements #
 #########################
     DIM = pwmat2phonopy.get_configures('dim')['val'].strip()
-    print(subprocess.Popen('PWmat2Phonopy --pwmat -d --dim="'+DIM+'" -c atom.config', shell=True, stdout=subprocess.PIPE).stdout.read())
+    displacement_option = '-d'
+    if pwmat2phonopy.get_random_displacements() > 0:
+        displacement_option += ' --rd=%d' % pwmat2phonopy.get_random_displacements()
+    print(subprocess.Popen('PWmat2Phonopy --pwmat '+displacement_option+' --dim="'+DIM+'" -c atom.config', shell=True, stdout=subprocess.PIPE).stdout.read())
 
 #######################
 # initiallize phonopy #
@@ -49,6 +64,8 @@ if __name__ == "__main__":
     EtotInput.set_configures('nodes', nodes.strip())
 
 # prepare new k-points for supercell
+    mp_n123_unitcell = EtotInput.get_configures().get('mp_n123')
+    atom_config_unitcell = EtotInput.get_configures().get('in.atom', 'atom.config')
     mp_n123 = pwmat2phonopy.get_configures('mp_n123')['val']
     EtotInput.set_configures('mp_n123', mp_n123.strip())
 # prepare input files in the forces directory
@@ -64,8 +81,31 @@ if __name__ == "__main__":
         EtotInput.write_input('./'+force+'/etot.input')
     os.chdir(dir0+'/phonon')
 
+# prepare the unit cell run for Born effective charges and dielectric constant
+    is_born = pwmat2phonopy.get_is_born()
+    jobs = ["{pre_filename}-{0:0{width}}".format(i + 1, pre_filename='forces', width=3) for i in range(num_forces)]
+    if is_born:
+        if not os.path.exists('born'):
+            os.mkdir('born')
+        shutil.copy('../'+atom_config_unitcell, './born')
+        for tag in confs_scf.keys():
+            if 'in.psp' in tag:
+                shutil.copy('../'+confs_scf[tag], './born')
+        # k-mesh of etot.input, or PWmat's default when it has none
+        if mp_n123_unitcell is None:
+            EtotInput.get_configures().pop('mp_n123', None)
+        else:
+            EtotInput.set_configures('mp_n123', mp_n123_unitcell)
+        EtotInput.set_configures('in.atom', os.path.basename(atom_config_unitcell))
+        EtotInput.set_configures('job', pwmat2phonopy.get_configures('born_job')['val'].strip())
+        EtotInput.write_input('./born/etot.input')
+        jobs.append('born')
+
 # prepare postprocess script
-    pwmat_run.creat_post_process_script(num_forces=num_forces)
+    pwmat_run.creat_post_process_script(num_forces=num_forces,
+                                        is_born=is_born,
+                                        dim=DIM,
+                                        primitive_axis=pwmat2phonopy.get_configures('primitive_axis')['val'].strip())
 
     pwmat2phonopy.creat_phonopy_conf()
 
@@ -77,12 +117,14 @@ if __name__ == "__main__":
     ppn = node1*node2
     queue = 'test'
     wall_time = pwmat2phonopy.get_configures('wall_time')['val'].strip()
-    for i in range(num_forces):
-        force = "{pre_filename}-{0:0{width}}".format(i + 1, pre_filename='forces', width=3)
-        os.chdir(dir0+'/phonon/'+force)
-        pwmat_run.creat_pbs(ppn=ppn, queue=queue, wall_time=wall_time, job_name=force)
-        subprocess.Popen('chmod +x '+force+'.pbs', shell=True)
-        subprocess.Popen('qsub '+force+'.pbs', shell=True)
+    for job in jobs:
+        os.chdir(dir0+'/phonon/'+job)
+        pwmat_run.creat_pbs(ppn=ppn, queue=queue, wall_time=wall_time, job_name=job)
+        subprocess.Popen('chmod +x '+job+'.pbs', shell=True)
+        subprocess.Popen('qsub '+job+'.pbs', shell=True)
     os.chdir(dir0+'/phonon')
 
-    print("\033[93m\n Please run ./plot_phonon.sh to get the plot and data, when the forces calculations are finished! \n\033[0m")
+    if is_born:
+        print("\033[93m\n Please run ./plot_phonon.sh to get the plot and data, when the forces and born calculations are finished! \n\033[0m")
+    else:
+        print("\033[93m\n Please run ./plot_phonon.sh to get the plot and data, when the forces calculations are finished! \n\033[0m")
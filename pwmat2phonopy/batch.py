@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+
+"""Post-processing of many material directories across a process pool
+
+Every material directory has to contain FORCE_SETS and the phonopy
+configuration file (band_dos.conf by default). The unit cell (atom.config
+by default) is looked up in the directory and then in its parent, which is
+the layout created by PWmatRunPhonopy.py (phonon/ next to atom.config).
+
+Each directory is processed by pwmat2phonopy.driver.run_phonopy in a
+worker process with the directory as working directory, and the log is
+written to PWmat2Phonopy.log there. A failure in one directory is recorded
+in the summary and does not stop the others.
+
+The workers are started once and process one directory after another,
+with numpy, phonopy and the driver imported by their initializer. The
+number of BLAS/OpenMP threads is limited in each worker (the environment
+of the calling process is left as it is), and the number of workers is
+chosen so that workers x threads does not exceed the number of cores.
+
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import traceback
+from optparse import OptionParser
+
+__author__  = "Paul Chern"
+__email__   = "peng.chen.iphy@gmail.com"
+__licence__ = "GPL"
+__date__    = "Nov. 2017"
+
+BLAS_THREAD_VARIABLES = ('OMP_NUM_THREADS',
+                         'OPENBLAS_NUM_THREADS',
+                         'MKL_NUM_THREADS',
+                         'VECLIB_MAXIMUM_THREADS',
+                         'NUMEXPR_NUM_THREADS')
+
+def get_batch_parser():
+    parser = OptionParser(
+        usage="PWmat2Phonopy batch [options] DIRECTORY_OR_GLOB ...")
+    parser.set_defaults(conf_filename="band_dos.conf",
+                        cell_filename="atom.config",
+                        calculator="pwmat",
+                        num_workers=None,
+                        blas_threads=None,
+                        is_graph_plot=False,
+                        summary_filename="batch_summary.json",
+                        log_filename="PWmat2Phonopy.log",
+                        list_filename=None)
+    parser.add_option(
+        "--conf", dest="conf_filename", type="string",
+        help="Phonopy configuration file in each directory")
+    parser.add_option(
+        "-c", "--cell", dest="cell_filename", type="string",
+        help="Unit cell file in each directory or in its parent")
+    parser.add_option(
+        "--calculator", dest="calculator", type="string",
+        help="Calculator interface of the unit cell file")
+    parser.add_option(
+        "-j", "--jobs", dest="num_workers", type="int",
+        help="Number of worker processes (default: cores / BLAS threads)")
+    parser.add_option(
+        "--blas_threads", dest="blas_threads", type="int",
+        help=("Number of BLAS/OpenMP threads per worker (default: "
+              "OMP_NUM_THREADS or 1)"))
+    parser.add_option(
+        "-p", "--plot", dest="is_graph_plot", action="store_true",
+        help="Save plots as pdf in each directory")
+    parser.add_option(
+        "--summary", dest="summary_filename", type="string",
+        help="File name of the status/timing summary")
+    parser.add_option(
+        "--log", dest="log_filename", type="string",
+        help="File name of the log written in each directory")
+    parser.add_option(
+        "--list", dest="list_filename", type="string",
+        help="File listing material directories, one per line")
+    return parser
+
+def get_directories(patterns, list_filename=None):
+    """Expand globs and the list file into existing directories
+
+    The order of the arguments is kept and duplicates are removed.
+
+    """
+    patterns = list(patterns)
+    if list_filename is not None:
+        with open(list_filename) as f:
+            for line in f:
+                line = line.split('#')[0].strip()
+                if line:
+                    patterns.append(line)
+
+    directories = []
+    for pattern in patterns:
+        matched = sorted(glob.glob(pattern))
+        if not matched:
+            matched = [pattern]
+        for path in matched:
+            path = os.path.normpath(path)
+            if path not in directories:
+                directories.append(path)
+    return directories
+
+def get_blas_threads(blas_threads=None):
+    if blas_threads is not None:
+        return max(1, blas_threads)
+    for name in BLAS_THREAD_VARIABLES:
+        if name in os.environ:
+            try:
+                return max(1, int(os.environ[name]))
+            except ValueError:
+                pass
+    return 1
+
+def get_num_workers(num_directories, blas_threads, num_workers=None):
+    if num_workers is None:
+        try:
+            num_cores = len(os.sched_getaffinity(0))
+        except AttributeError:
+            import multiprocessing
+            num_cores = multiprocessing.cpu_count()
+        num_workers = max(1, num_cores // blas_threads)
+    return max(1, min(num_workers, num_directories))
+
+def limit_blas_threads(blas_threads):
+    """Limit the BLAS/OpenMP threads of the calling process
+
+    Meant for worker processes. The thread variables are set for
+    libraries loaded later. Libraries already loaded, e.g. in a process
+    forked after numpy was imported, are limited by threadpoolctl if it
+    is installed, otherwise by their own set_num_threads functions.
+
+    """
+    for name in BLAS_THREAD_VARIABLES:
+        os.environ[name] = "%d" % blas_threads
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        _set_loaded_blas_threads(blas_threads)
+    else:
+        threadpool_limits(limits=blas_threads)
+
+def _set_loaded_blas_threads(blas_threads):
+    # OpenBLAS (also as bundled with numpy), MKL and OpenMP runtimes
+    # mapped in this process (Linux only).
+    import ctypes
+
+    functions = (('openblas', ('openblas_set_num_threads',
+                               'openblas_set_num_threads64_',
+                               'scipy_openblas_set_num_threads',
+                               'scipy_openblas_set_num_threads64_')),
+                 ('mkl_rt', ('MKL_Set_Num_Threads',)),
+                 ('omp', ('omp_set_num_threads',)))
+    try:
+        with open('/proc/self/maps') as f:
+            paths = set([line.split()[-1] for line in f
+                         if line.rstrip().endswith('.so') or '.so.' in line])
+    except (IOError, OSError):
+        return
+    for path in paths:
+        name = os.path.basename(path).lower()
+        for key, function_names in functions:
+            if key not in name:
+                continue
+            try:
+                library = ctypes.CDLL(path)
+            except OSError:
+                break
+            for function_name in function_names:
+                function = getattr(library, function_name, None)
+                if function is not None:
+                    function(int(blas_threads))
+                    break
+            break
+
+def _init_batch_worker(blas_threads):
+    # Imported once per worker instead of once per material
+    limit_blas_threads(blas_threads)
+    import numpy
+    import pwmat2phonopy.driver
+    try:
+        import phonopy
+    except ImportError: # Reported by run_material of each directory
+        pass
+
+def _find_cell_filename(cell_filename):
+    if os.path.isabs(cell_filename) or os.path.exists(cell_filename):
+        return cell_filename
+    parent_cell_filename = os.path.join(os.pardir, cell_filename)
+    if os.path.exists(parent_cell_filename):
+        return parent_cell_filename
+    return cell_filename
+
+def run_material(directory,
+                 conf_filename="band_dos.conf",
+                 cell_filename="atom.config",
+                 calculator="pwmat",
+                 is_graph_plot=False,
+                 log_filename="PWmat2Phonopy.log"):
+    """Post-process one material directory
+
+    Returns a dictionary with the directory, status ('ok' or 'failed'),
+    wall time in seconds and the error message of a failure.
+
+    """
+    result = {'directory': directory,
+              'status': 'failed',
+              'time': 0.0,
+              'error': None}
+    t0 = time.time()
+    cwd = os.getcwd()
+    stdout = sys.stdout
+    log = None
+    try:
+        os.chdir(directory)
+        log = open(log_filename, 'w')
+        sys.stdout = log
+
+        import pwmat2phonopy.driver as driver
+
+        settings, confs = driver.load_settings(filename=conf_filename)
+        settings.set_calculator(calculator)
+        settings.set_cell_filename(_find_cell_filename(cell_filename))
+        # Nobody is looking at the plots of a batch run.
+        settings.set_is_graph_plot(is_graph_plot)
+        settings.set_is_graph_save(True)
+        driver.run_phonopy(settings, confs=confs, log_level=1)
+        result['status'] = 'ok'
+    except SystemExit as e:
+        # Configuration errors of PhonopyConfParser call sys.exit.
+        result['error'] = "Exit with status %s" % e.code
+    except Exception as e:
+        result['error'] = "%s: %s" % (e.__class__.__name__, e)
+        if log is not None:
+            traceback.print_exc(file=log)
+    finally:
+        sys.stdout = stdout
+        if log is not None:
+            log.close()
+        os.chdir(cwd)
+        result['time'] = time.time() - t0
+    return result
+
+def _run_material(args):
+    return run_material(*args)
+
+def run_batch(directories,
+              conf_filename="band_dos.conf",
+              cell_filename="atom.config",
+              calculator="pwmat",
+              num_workers=None,
+              blas_threads=None,
+              is_graph_plot=False,
+              log_filename="PWmat2Phonopy.log",
+              log_level=1):
+    """Post-process material directories across a process pool
+
+    Returns the list of results of run_material in the order of
+    directories.
+
+    """
+    import multiprocessing
+
+    blas_threads = get_blas_threads(blas_threads)
+    num_workers = get_num_workers(len(directories), blas_threads, num_workers)
+    if log_level > 0:
+        print("Number of material directories: %d" % len(directories))
+        print("Worker processes: %d, BLAS threads per worker: %d" %
+              (num_workers, blas_threads))
+
+    tasks = [(os.path.abspath(d),
+              conf_filename,
+              cell_filename,
+              calculator,
+              is_graph_plot,
+              log_filename) for d in directories]
+
+    results = {}
+    pool = multiprocessing.Pool(num_workers,
+                                initializer=_init_batch_worker,
+                                initargs=(blas_threads,))
+    try:
+        for i, result in enumerate(pool.imap_unordered(_run_material, tasks)):
+            results[result['directory']] = result
+            if log_level > 0:
+                print("[%*d/%d] %-6s %9.2f s  %s" %
+                      (len(str(len(tasks))), i + 1, len(tasks),
+                       result['status'], result['time'],
+                       result['directory']))
+                sys.stdout.flush()
+    finally:
+        pool.close()
+        pool.join()
+
+    return [results[task[0]] for task in tasks]
+
+def write_summary(results, filename="batch_summary.json", wall_time=None):
+    summary = {'num_materials': len(results),
+               'num_failed': len([r for r in results if r['status'] != 'ok']),
+               'wall_time': wall_time,
+               'materials': results}
+    with open(filename, 'w') as w:
+        json.dump(summary, w, indent=2)
+
+def print_summary(results, wall_time=None):
+    print('')
+    print("%-8s %10s  %s" % ('status', 'time [s]', 'directory'))
+    for r in results:
+        print("%-8s %10.2f  %s" % (r['status'], r['time'], r['directory']))
+        if r['error'] is not None:
+            print("%-8s %10s  %s" % ('', '', r['error']))
+    num_failed = len([r for r in results if r['status'] != 'ok'])
+    print("%d materials, %d failed." % (len(results), num_failed))
+    if wall_time is not None:
+        cpu_time = sum([r['time'] for r in results])
+        print("Wall time %.2f s, sum of times of materials %.2f s" %
+              (wall_time, cpu_time))
+
+def main(argv=None):
+    parser = get_batch_parser()
+    (options, args) = parser.parse_args(argv)
+    directories = get_directories(args, list_filename=options.list_filename)
+    if not directories:
+        parser.error("No material directory is given.")
+
+    t0 = time.time()
+    results = run_batch(directories,
+                        conf_filename=options.conf_filename,
+                        cell_filename=options.cell_filename,
+                        calculator=options.calculator,
+                        num_workers=options.num_workers,
+                        blas_threads=options.blas_threads,
+                        is_graph_plot=options.is_graph_plot,
+                        log_filename=options.log_filename)
+    wall_time = time.time() - t0
+    print_summary(results, wall_time=wall_time)
+    if options.summary_filename:
+        write_summary(results,
+                      filename=options.summary_filename,
+                      wall_time=wall_time)
+        print("Summary is written into %s." % options.summary_filename)
+
+    if all([r['status'] == 'ok' for r in results]):
+        return 0
+    else:
+        return 1
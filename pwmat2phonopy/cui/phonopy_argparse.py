@@ -43,6 +43,7 @@ def get_parser():
         band_labels=None,
         band_paths=None,
         band_points=None,
+        born_mode=False,
         cell_filename=None,
         crystal_mode=False,
         cutoff_frequency=None,
@@ -64,6 +65,7 @@ def get_parser():
         frequency_conversion_factor=None,
         fpitch=None,
         gv_delta_q=None,
+        hdf5_compression=None,
         is_band_connection=False,
         is_check_symmetry=False,
         is_displacement=False,
@@ -74,6 +76,7 @@ def get_parser():
         is_graph_save=False,
         is_group_velocity=False,
         is_hdf5=False,
+        is_hdf5_float32=False,
         is_legend=False,
         is_little_cogroup=False,
         is_moment=False,
@@ -96,16 +99,28 @@ def get_parser():
         loglevel=None,
         masses=None,
         magmom=None,
+        md_fc_mode=False,
+        md_skip=0,
+        md_step=1,
+        mesh_chunk_size=None,
         mesh_numbers=None,
+        mesh_num_workers=None,
+        mesh_observables=None,
         modulation=None,
         moment_order=None,
         pretend_real=False,
         primitive_axis=None,
+        is_profile=False,
+        is_cprofile=False,
         projection_direction=None,
         pwscf_mode=False,
         qpoints=None,
+        qpoints_chunk_size=None,
+        qpoints_filename=None,
         quiet=False,
         q_direction=None,
+        random_displacements=None,
+        random_seed=None,
         show_irreps=False,
         sigma=None,
         supercell_dimension=None,
@@ -177,6 +192,10 @@ def get_parser():
         "--eigvecs", "--eigenvectors", dest="is_eigenvectors",
         action="store_true",
         help="Output eigenvectors")
+    parser.add_option(
+        "--born", dest="born_mode", action="store_true",
+        help=("Create BORN from the output of a PWmat DFPT or finite-field "
+              "run. The output file has to be passed as argument."))
     parser.add_option(
         "--elk", dest="elk_mode", action="store_true",
         help="Invoke elk mode")
@@ -236,6 +255,14 @@ def get_parser():
     parser.add_option(
         "--hdf5", dest="is_hdf5", action="store_true",
         help="Use hdf5 for force constants")
+    parser.add_option(
+        "--hdf5_compression", dest="hdf5_compression", type="string",
+        help=("Compression of eigenvectors in hdf5 files, gzip or lzf "
+              "(same as HDF5_COMPRESSION tag)"))
+    parser.add_option(
+        "--hdf5_float32", dest="is_hdf5_float32", action="store_true",
+        help=("Store eigenvectors in hdf5 files in single precision "
+              "(same as HDF5_FLOAT32 tag)"))
     parser.add_option(
         "--irreps", "--irreps_qpoint", dest="irreps_qpoint",
         action="store", type="string",
@@ -262,12 +289,30 @@ def get_parser():
     parser.add_option(
         "--magmom", dest="magmoms", action="store", type="string",
         help="Same as MAGMOM tag")
+    parser.add_option(
+        "--md_fc", dest="md_fc_mode", action="store_true",
+        help=("Fit FORCE_CONSTANTS to the frames of a PWmat MD run. "
+              "MOVEMENT has to be passed as argument."))
+    parser.add_option(
+        "--md_skip", dest="md_skip", type="int",
+        help="Number of MD frames skipped at the beginning with --md_fc")
+    parser.add_option(
+        "--md_step", dest="md_step", type="int",
+        help="Every md_step-th MD frame is used with --md_fc")
     parser.add_option(
         "--modulation", dest="modulation", action="store", type="string",
         help="Same as MODULATION tag")
     parser.add_option(
         "--mp", "--mesh", dest="mesh_numbers", action="store", type="string",
         help="Same behavior as MP tag")
+    parser.add_option(
+        "--mesh_chunk", dest="mesh_chunk_size", type="int",
+        help=("Solve mesh in chunks of this number of q-points "
+              "(same as MESH_CHUNK tag)"))
+    parser.add_option(
+        "--mesh_jobs", dest="mesh_num_workers", type="int",
+        help=("Number of processes solving chunks of mesh "
+              "(same as MESH_JOBS tag)"))
     parser.add_option(
         "--moment", dest="is_moment", action="store_true",
         help="Calculate moment of phonon states distribution")
@@ -289,6 +334,10 @@ def get_parser():
     parser.add_option(
         "--nosym", dest="is_nosym", action="store_true",
         help="Symmetry is not imposed.")
+    parser.add_option(
+        "--observables", dest="mesh_observables", type="string",
+        help=("Observables calculated from one mesh calculation, e.g. "
+              "\"tprop dos pdos\" (same as MESH_OBSERVABLES tag)"))
     parser.add_option(
         "-p", "--plot", dest="is_graph_plot", action="store_true",
         help="Plot data")
@@ -296,6 +345,14 @@ def get_parser():
         "--pa", "--primitive_axis", dest="primitive_axis",
         action="store", type="string",
         help="Same as PRIMITIVE_AXIS tag")
+    parser.add_option(
+        "--profile", dest="is_profile", action="store_true",
+        help=("Show wall time and peak memory of each stage and write "
+              "them into profile.json"))
+    parser.add_option(
+        "--cprofile", dest="is_cprofile", action="store_true",
+        help=("With --profile, dump cProfile statistics of each stage "
+              "into profile-<stage>.prof"))
     parser.add_option(
         "--pd", "--projection_direction", dest="projection_direction",
         action="store", type="string",
@@ -321,6 +378,14 @@ def get_parser():
     parser.add_option(
         "--qpoints", dest="qpoints", type="string",
         help="Calculate at specified q-points")
+    parser.add_option(
+        "--qpoints_chunk", dest="qpoints_chunk_size", type="int",
+        help=("Solve and write q-points of QPOINTS in chunks of this number "
+              "of q-points (same as QPOINTS_CHUNK tag)"))
+    parser.add_option(
+        "--qpoints_file", dest="qpoints_filename", type="string",
+        help=("Q-points file in QPOINTS format or .npy "
+              "(same as QPOINTS_FILE tag)"))
     parser.add_option(
         "--q_direction", dest="q_direction", type="string",
         help=("Direction of q-vector perturbation used for NAC at "
@@ -329,6 +394,14 @@ def get_parser():
     parser.add_option(
         "-q", "--quiet", dest="quiet", action="store_true",
         help="Print out smallest information")
+    parser.add_option(
+        "--rd", "--random_displacements", dest="random_displacements",
+        type="int",
+        help=("Number of supercells in which all atoms are displaced "
+              "randomly by the displacement distance"))
+    parser.add_option(
+        "--random_seed", dest="random_seed", type="int",
+        help="Seed of the random displacements")
     parser.add_option(
         "--readfc", dest="is_read_force_constants", action="store_true",
         help="Read FORCE_CONSTANTS")
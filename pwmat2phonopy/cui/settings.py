@@ -75,8 +75,11 @@ class Settings(object):
         self._primitive_matrix = None
         self._qpoints = None
         self._q_direction = None
+        self._random_displacements = None
+        self._random_seed = None
         self._sigma = None
         self._supercell_matrix = None
+        self._symmetry_tolerance = 1e-5
         self._tmax = 1000
         self._tmin = 0
         self._tstep = 10
@@ -268,6 +271,18 @@ class Settings(object):
 
     def get_primitive_matrix(self):
         return self._primitive_matrix
+
+    def set_random_displacements(self, num_supercells):
+        self._random_displacements = num_supercells
+
+    def get_random_displacements(self):
+        return self._random_displacements
+
+    def set_random_seed(self, random_seed):
+        self._random_seed = random_seed
+
+    def get_random_seed(self):
+        return self._random_seed
         
     def set_qpoints(self, qpoints):
         self._qpoints = qpoints
@@ -287,6 +302,12 @@ class Settings(object):
     def get_supercell_matrix(self):
         return self._supercell_matrix
 
+    def set_symmetry_tolerance(self, symmetry_tolerance):
+        self._symmetry_tolerance = symmetry_tolerance
+
+    def get_symmetry_tolerance(self):
+        return self._symmetry_tolerance
+
     def set_temperature_step(self, tstep):
         self._tstep = tstep
 
@@ -460,6 +481,15 @@ class ConfParser(object):
             if params['qpoints'] is not True:
                 self._settings.set_qpoints(params['qpoints'])
 
+        # Number of supercells with random displacements of all atoms
+        if 'random_displacements' in params:
+            self._settings.set_random_displacements(
+                params['random_displacements'])
+
+        # Seed of the random displacements
+        if 'random_seed' in params:
+            self._settings.set_random_seed(params['random_seed'])
+
         # q-direction for non analytical term correction
         if 'q_direction' in params:
             self._settings.set_nac_q_direction(params['q_direction'])
@@ -472,6 +502,10 @@ class ConfParser(object):
         if 'supercell_matrix' in params:
             self._settings.set_supercell_matrix(params['supercell_matrix'])
 
+        # Tolerance used to search crystal symmetry
+        if 'symmetry_tolerance' in params:
+            self._settings.set_symmetry_tolerance(params['symmetry_tolerance'])
+
         # Temerature range
         if 'tmax' in params:
             self._settings.set_max_temperature(params['tmax'])
@@ -650,10 +684,23 @@ class ConfParser(object):
                 if self._options.primitive_axis:
                     self._confs['primitive_axis'] = self._options.primitive_axis
                     
+            if opt.dest == 'random_displacements':
+                if self._options.random_displacements:
+                    self._confs['random_displacements'] = \
+                        self._options.random_displacements
+
+            if opt.dest == 'random_seed':
+                if self._options.random_seed is not None:
+                    self._confs['random_seed'] = self._options.random_seed
+
             if opt.dest == 'supercell_dimension':
                 if self._options.supercell_dimension:
                     self._confs['dim'] = self._options.supercell_dimension
 
+            if opt.dest == 'symprec':
+                if self._options.symprec is not None:
+                    self._confs['symmetry_tolerance'] = self._options.symprec
+
             if opt.dest == 'qpoints':
                 if self._options.qpoints is not None:
                     self._confs['qpoints'] = self._options.qpoints
@@ -712,6 +759,10 @@ class ConfParser(object):
                     else:
                         self.set_parameter('supercell_matrix', matrix)
 
+            if conf_key == 'symmetry_tolerance':
+                self.set_parameter('symmetry_tolerance',
+                                   float(confs['symmetry_tolerance']))
+
             if conf_key in ('primitive_axis', 'primitive_axes'):
                 if not len(confs[conf_key].split()) == 9:
                     self.setting_error("Number of elements in %s has to be 9." %
@@ -819,6 +870,13 @@ class ConfParser(object):
                     bands.append(np.array(points).reshape(-1, 3))
                 self.set_parameter('band_paths', bands)
 
+            if conf_key == 'random_displacements':
+                self.set_parameter('random_displacements',
+                                   int(confs['random_displacements']))
+
+            if conf_key == 'random_seed':
+                self.set_parameter('random_seed', int(confs['random_seed']))
+
             if conf_key == 'qpoints':
                 if confs['qpoints'].lower() == '.true.':
                     self.set_parameter('qpoints', True)
@@ -907,6 +965,7 @@ class PhonopySettings(Settings):
         self._anime_type = 'v_sim'
         self._band_labels = None
         self._band_connection = False
+        self._calculator = None
         self._cutoff_radius = None
         self._dos = None
         self._dos_range = {'min':  None,
@@ -916,13 +975,18 @@ class PhonopySettings(Settings):
         self._fits_Debye_model = False
         self._fmax = None
         self._fmin = None
+        self._hdf5_compression = None
+        self._hdf5_float32 = False
         self._irreps_q_point = None
         self._irreps_tolerance = 1e-5
         self._is_dos_mode = False
         self._is_force_constants = False
         self._is_group_velocity = False
         self._is_gamma_center = False
+        self._is_graph_plot = False
+        self._is_graph_save = False
         self._is_hdf5 = False
+        self._is_legend = False
         self._is_little_cogroup = False
         self._is_moment = False
         self._is_plusminus_displacement = 'auto'
@@ -932,11 +996,16 @@ class PhonopySettings(Settings):
         self._is_thermal_properties = False
         self._is_projected_thermal_properties = False
         self._lapack_solver = False
+        self._mesh_chunk_size = None
+        self._mesh_num_workers = None
+        self._mesh_observables = None
         self._modulation = None
         self._moment_order = None
         self._pdos_indices = None
         self._pretend_real = False
         self._projection_direction = None
+        self._qpoints_chunk_size = None
+        self._qpoints_filename = None
         self._run_mode = None
         self._show_irreps = False
         self._thermal_atom_pairs = None
@@ -987,6 +1056,12 @@ class PhonopySettings(Settings):
     def get_band_labels(self):
         return self._band_labels
 
+    def set_calculator(self, calculator):
+        self._calculator = calculator
+
+    def get_calculator(self):
+        return self._calculator
+
     def set_cutoff_radius(self, cutoff_radius):
         self._cutoff_radius = cutoff_radius
 
@@ -1058,12 +1133,36 @@ class PhonopySettings(Settings):
     def get_is_dos_mode(self):
         return self._is_dos_mode
 
+    def set_is_graph_plot(self, is_graph_plot):
+        self._is_graph_plot = is_graph_plot
+
+    def get_is_graph_plot(self):
+        return self._is_graph_plot
+
+    def set_is_graph_save(self, is_graph_save):
+        self._is_graph_save = is_graph_save
+
+    def get_is_graph_save(self):
+        return self._is_graph_save
+
     def set_is_hdf5(self, is_hdf5):
         self._is_hdf5 = is_hdf5
 
     def get_is_hdf5(self):
         return self._is_hdf5
 
+    def set_hdf5_compression(self, hdf5_compression):
+        self._hdf5_compression = hdf5_compression
+
+    def get_hdf5_compression(self):
+        return self._hdf5_compression
+
+    def set_hdf5_float32(self, hdf5_float32):
+        self._hdf5_float32 = hdf5_float32
+
+    def get_hdf5_float32(self):
+        return self._hdf5_float32
+
     def set_is_force_constants(self, is_force_constants):
         self._is_force_constants = is_force_constants
 
@@ -1082,6 +1181,12 @@ class PhonopySettings(Settings):
     def get_is_group_velocity(self):
         return self._is_group_velocity
 
+    def set_is_legend(self, is_legend):
+        self._is_legend = is_legend
+
+    def get_is_legend(self):
+        return self._is_legend
+
     def set_is_little_cogroup(self, is_little_cogroup):
         self._is_little_cogroup = is_little_cogroup
 
@@ -1175,6 +1280,18 @@ class PhonopySettings(Settings):
     def get_pretend_real(self):
         return self._pretend_real
 
+    def set_qpoints_chunk_size(self, qpoints_chunk_size):
+        self._qpoints_chunk_size = qpoints_chunk_size
+
+    def get_qpoints_chunk_size(self):
+        return self._qpoints_chunk_size
+
+    def set_qpoints_filename(self, qpoints_filename):
+        self._qpoints_filename = qpoints_filename
+
+    def get_qpoints_filename(self):
+        return self._qpoints_filename
+
     def set_projection_direction(self, direction):
         self._projection_direction = direction
 
@@ -1231,6 +1348,24 @@ class PhonopySettings(Settings):
     def get_write_dynamical_matrices(self):
         return self._write_dynamical_matrices
 
+    def set_mesh_chunk_size(self, mesh_chunk_size):
+        self._mesh_chunk_size = mesh_chunk_size
+
+    def get_mesh_chunk_size(self):
+        return self._mesh_chunk_size
+
+    def set_mesh_num_workers(self, mesh_num_workers):
+        self._mesh_num_workers = mesh_num_workers
+
+    def get_mesh_num_workers(self):
+        return self._mesh_num_workers
+
+    def set_mesh_observables(self, observables):
+        self._mesh_observables = observables
+
+    def get_mesh_observables(self):
+        return self._mesh_observables
+
     def set_write_mesh(self, write_mesh):
         self._write_mesh = write_mesh
 
@@ -1252,6 +1387,9 @@ class PhonopyConfParser(ConfParser):
         self._set_settings()
 
     def _read_options(self):
+        if self._options is None or self._option_list is None:
+            return
+
         for opt in self._option_list:
             if opt.dest == 'band_labels':
                 if self._options.band_labels:
@@ -1305,6 +1443,16 @@ class PhonopyConfParser(ConfParser):
                 if self._options.pretend_real:
                     self._confs['pretend_real'] = '.true.'
 
+            if opt.dest == 'qpoints_chunk_size':
+                if self._options.qpoints_chunk_size is not None:
+                    self._confs['qpoints_chunk'] = \
+                        self._options.qpoints_chunk_size
+
+            if opt.dest == 'qpoints_filename':
+                if self._options.qpoints_filename is not None:
+                    self._confs['qpoints_file'] = \
+                        self._options.qpoints_filename
+
             if opt.dest == 'is_projected_thermal_properties':
                 if self._options.is_projected_thermal_properties:
                     self._confs['ptprop'] = '.true.'
@@ -1338,6 +1486,15 @@ class PhonopyConfParser(ConfParser):
             if opt.dest == 'is_hdf5':
                 if self._options.is_hdf5:
                     self._confs['hdf5'] = '.true.'
+
+            if opt.dest == 'hdf5_compression':
+                if self._options.hdf5_compression:
+                    self._confs['hdf5_compression'] = \
+                        self._options.hdf5_compression
+
+            if opt.dest == 'is_hdf5_float32':
+                if self._options.is_hdf5_float32:
+                    self._confs['hdf5_float32'] = '.true.'
     
             if opt.dest == 'write_dynamical_matrices':
                 if self._options.write_dynamical_matrices:
@@ -1383,6 +1540,19 @@ class PhonopyConfParser(ConfParser):
                 if self._options.is_moment:
                     self._confs['moment'] = '.true.'
 
+            if opt.dest == 'mesh_chunk_size':
+                if self._options.mesh_chunk_size is not None:
+                    self._confs['mesh_chunk'] = self._options.mesh_chunk_size
+
+            if opt.dest == 'mesh_num_workers':
+                if self._options.mesh_num_workers is not None:
+                    self._confs['mesh_jobs'] = self._options.mesh_num_workers
+
+            if opt.dest == 'mesh_observables':
+                if self._options.mesh_observables:
+                    self._confs['mesh_observables'] = \
+                        self._options.mesh_observables
+
             if opt.dest == 'moment_order':
                 if self._options.moment_order:
                     self._confs['moment_order'] = self._options.moment_order
@@ -1397,6 +1567,32 @@ class PhonopyConfParser(ConfParser):
                 if self._options.lapack_solver:
                     self._confs['lapack_solver'] = '.true.'
 
+            if opt.dest == 'is_graph_plot':
+                if self._options.is_graph_plot:
+                    self._confs['plot_graph'] = '.true.'
+
+            if opt.dest == 'is_graph_save':
+                if self._options.is_graph_save:
+                    self._confs['save_graph'] = '.true.'
+
+            if opt.dest == 'is_legend':
+                if self._options.is_legend:
+                    self._confs['legend'] = '.true.'
+
+        # Calculator interface. The order gives the priority when more
+        # than one interface option is given.
+        for dest, calculator in (('wien2k_mode', 'wien2k'),
+                                 ('abinit_mode', 'abinit'),
+                                 ('pwscf_mode', 'pwscf'),
+                                 ('elk_mode', 'elk'),
+                                 ('siesta_mode', 'siesta'),
+                                 ('crystal_mode', 'crystal'),
+                                 ('pwmat_mode', 'pwmat'),
+                                 ('vasp_mode', 'vasp')):
+            if getattr(self._options, dest, False):
+                self._confs['calculator'] = calculator
+                break
+
     def _parse_conf(self):
         confs = self._confs
 
@@ -1433,6 +1629,34 @@ class PhonopyConfParser(ConfParser):
                 if confs['hdf5'].lower() == '.true.':
                     self.set_parameter('hdf5', True)
 
+            # Compression and precision of eigenvectors in hdf5 files
+            if conf_key == 'hdf5_compression':
+                compression = confs['hdf5_compression'].lower()
+                if compression not in ('gzip', 'lzf', 'none'):
+                    self.setting_error(
+                        "HDF5_COMPRESSION has to be gzip, lzf or none.")
+                if compression != 'none':
+                    self.set_parameter('hdf5_compression', compression)
+
+            if conf_key == 'hdf5_float32':
+                if confs['hdf5_float32'].lower() == '.true.':
+                    self.set_parameter('hdf5_float32', True)
+
+            if conf_key == 'calculator':
+                self.set_parameter('calculator', confs['calculator'].lower())
+
+            if conf_key == 'plot_graph':
+                if confs['plot_graph'].lower() == '.true.':
+                    self.set_parameter('plot_graph', True)
+
+            if conf_key == 'save_graph':
+                if confs['save_graph'].lower() == '.true.':
+                    self.set_parameter('save_graph', True)
+
+            if conf_key == 'legend':
+                if confs['legend'].lower() == '.true.':
+                    self.set_parameter('legend', True)
+
             if conf_key == 'mp_shift':
                 vals = [fracval(x) for x in confs['mp_shift'].split()]
                 if len(vals) < 3:
@@ -1585,7 +1809,37 @@ class PhonopyConfParser(ConfParser):
 
             if conf_key == 'moment_order':
                 self.set_parameter('moment_order', int(confs['moment_order']))
+
+            # Observables calculated from one mesh calculation
+            if conf_key == 'mesh_observables':
+                observables = confs['mesh_observables'].replace(',', ' ')
+                observables = [x.lower() for x in observables.split()]
+                for x in observables:
+                    if x not in ('tprop', 'ptprop', 'tdisp', 'tdispmat',
+                                 'tdistance', 'pdos', 'dos', 'moment'):
+                        self.setting_error(
+                            "%s in MESH_OBSERVABLES is unknown." % x)
+                    if x == 'pdos':
+                        if 'pdos' not in self._parameters:
+                            self.set_parameter('pdos', [])
+                    elif x != 'tdistance':
+                        self.set_parameter(x, True)
+                self.set_parameter('mesh_observables', observables)
                     
+            # Mesh solved in chunks of q-points across processes
+            if conf_key == 'mesh_chunk':
+                self.set_parameter('mesh_chunk', int(confs['mesh_chunk']))
+
+            if conf_key == 'mesh_jobs':
+                self.set_parameter('mesh_jobs', int(confs['mesh_jobs']))
+
+            # QPOINTS read from a file and solved in chunks
+            if conf_key == 'qpoints_chunk':
+                self.set_parameter('qpoints_chunk', int(confs['qpoints_chunk']))
+
+            if conf_key == 'qpoints_file':
+                self.set_parameter('qpoints_file', confs['qpoints_file'])
+
             # Use Lapack solver via Lapacke
             if conf_key == 'lapack_solver':
                 if confs['lapack_solver'].lower() == '.true.':
@@ -1671,6 +1925,24 @@ class PhonopyConfParser(ConfParser):
         if 'hdf5' in params:
             self._settings.set_is_hdf5(params['hdf5'])
 
+        if 'hdf5_compression' in params:
+            self._settings.set_hdf5_compression(params['hdf5_compression'])
+
+        if 'hdf5_float32' in params:
+            self._settings.set_hdf5_float32(params['hdf5_float32'])
+
+        # Calculator interface
+        if 'calculator' in params:
+            self._settings.set_calculator(params['calculator'])
+
+        # Plot and save graphs
+        if 'plot_graph' in params:
+            self._settings.set_is_graph_plot(params['plot_graph'])
+        if 'save_graph' in params:
+            self._settings.set_is_graph_save(params['save_graph'])
+        if 'legend' in params:
+            self._settings.set_is_legend(params['legend'])
+
         # Cutoff radius of force constants
         if 'cutoff_radius' in params:
             self._settings.set_cutoff_radius(params['cutoff_radius'])
@@ -1709,9 +1981,18 @@ class PhonopyConfParser(ConfParser):
             self._settings.set_run_mode('band_mesh')
     
         # Q-points mode
-        if 'qpoints' in params:
+        if 'qpoints' in params or 'qpoints_file' in params:
             self._settings.set_run_mode('qpoints')
 
+        if 'qpoints_file' in params:
+            self._settings.set_qpoints_filename(params['qpoints_file'])
+
+        if 'qpoints_chunk' in params:
+            if params['qpoints_chunk'] < 1:
+                self.setting_error(
+                    "QPOINTS_CHUNK has to be a positive integer.")
+            self._settings.set_qpoints_chunk_size(params['qpoints_chunk'])
+
         # Whether write out dynamical matrices or not
         if 'write_dynamical_matrices' in params:
             if params['write_dynamical_matrices']:
@@ -1855,6 +2136,25 @@ class PhonopyConfParser(ConfParser):
         if 'is_group_velocity' in params:
             self._settings.set_is_group_velocity(params['is_group_velocity'])
 
+        # Several observables from one mesh calculation
+        if 'mesh_observables' in params:
+            if ('tdistance' in params['mesh_observables'] and
+                'tdistance' not in params):
+                self.setting_error("TDISTANCE has to be set for tdistance "
+                                   "in MESH_OBSERVABLES.")
+            self._settings.set_mesh_observables(params['mesh_observables'])
+
+        # Mesh in chunks of q-points
+        if 'mesh_chunk' in params:
+            if params['mesh_chunk'] < 1:
+                self.setting_error("MESH_CHUNK has to be a positive integer.")
+            self._settings.set_mesh_chunk_size(params['mesh_chunk'])
+
+        if 'mesh_jobs' in params:
+            if params['mesh_jobs'] < 1:
+                self.setting_error("MESH_JOBS has to be a positive integer.")
+            self._settings.set_mesh_num_workers(params['mesh_jobs'])
+
         # Moment mode
         if 'moment' in params:
             self._settings.set_is_moment(params['moment'])
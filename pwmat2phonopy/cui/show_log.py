@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+__author__  = "Paul Chern"
+__email__   = "peng.chen.iphy@gmail.com"
+__licence__ = "GPL"
+__date__    = "Nov. 2017"
+
+def print_phononpy():
+    print("                                                                          ")
+    print(" -------------------------------------------------------------------------")
+    print("                        Welcome to PWmat.                                 ")
+    print("                        Phonopy Interface to PWmat                        ")
+    print("                        Enjoy it and good luck                            ")
+    print("                        Author : Peng Chen                                ")
+    print("                        Email : peng.chen.iphy@gmail.com                  ")
+    print(" =========================================================================")
+    print("                                                                          ")
+    print("""        _
+  _ __ | |__   ___  _ __   ___   _ __  _   _
+ | '_ \| '_ \ / _ \| '_ \ / _ \ | '_ \| | | |
+ | |_) | | | | (_) | | | | (_) || |_) | |_| |
+ | .__/|_| |_|\___/|_| |_|\___(_) .__/ \__, |
+ |_|                            |_|    |___/  interface to PWmat""")
+
+def get_phonopy_version():
+    # Read the version from the package metadata first. Importing phonopy
+    # itself pulls in the whole phonopy API and is only done as a fallback.
+    try:
+        from importlib.metadata import version
+        return version("phonopy")
+    except Exception:
+        pass
+    try:
+        import pkg_resources
+        return pkg_resources.require("phonopy")[0].version
+    except Exception:
+        from phonopy import __version__
+        return __version__
+
+def print_version(version):
+    ver = version.split('.')
+    if len(ver) > 3:
+        rev = ver[3]
+        print(('%s-r%s' % ('.'.join(ver[:3]), rev)).rjust(44))
+    else:
+        print(('%s' % version).rjust(44))
+    print('')
+
+def print_end():
+    print("""                 _
+   ___ _ __   __| |
+  / _ \ '_ \ / _` |
+ |  __/ | | | (_| |
+  \___|_| |_|\__,_|
+""")
+
+def print_error():
+    print("""  ___ _ __ _ __ ___  _ __
+ / _ \ '__| '__/ _ \| '__|
+|  __/ |  | | | (_) | |
+ \___|_|  |_|  \___/|_|
+""")
+
+def print_attention(attention_text):
+    print("*" * 67)
+    print(attention_text)
+    print("*" * 67)
+    print('')
+
+def print_error_message(message):
+    print('')
+    print(message)
+
+def print_cells(phonon, unitcell_filename):
+    import numpy as np
+    from phonopy.structure.cells import print_cell
+
+    print("Crsytal structure is read from \'%s\'." % unitcell_filename)
+    supercell = phonon.get_supercell()
+    unitcell = phonon.get_unitcell()
+    primitive = phonon.get_primitive()
+    p2p_map = primitive.get_primitive_to_primitive_map()
+    mapping = np.array(
+        [p2p_map[x] for x in primitive.get_supercell_to_primitive_map()],
+        dtype='intc')
+    s_indep_atoms = phonon.get_symmetry().get_independent_atoms()
+    p_indep_atoms = mapping[s_indep_atoms]
+    if unitcell.get_number_of_atoms() == primitive.get_number_of_atoms():
+        print("-" * 32 + " unit cell " + "-" * 33)
+        print_cell(primitive, stars=p_indep_atoms)
+    else:
+        u2s_map = supercell.get_unitcell_to_supercell_map()
+        print("-" * 30 + " primitive cell " + "-" * 30)
+        print_cell(primitive, stars=p_indep_atoms)
+        print("-" * 32 + " unit cell " +  "-" * 33) # 32 + 11 + 33 = 76
+        u2u_map = supercell.get_unitcell_to_unitcell_map()
+        u_indep_atoms = [u2u_map[x] for x in s_indep_atoms]
+        print_cell(unitcell, mapping=mapping[u2s_map], stars=u_indep_atoms)
+    print("-" * 32 + " super cell " + "-" * 32)
+    print_cell(supercell, mapping=mapping, stars=s_indep_atoms)
+    print("-" * 76)
+
+def print_settings(settings):
+    import numpy as np
+
+    run_mode = settings.get_run_mode()
+    if run_mode == 'band':
+        print("Band structure mode")
+    if run_mode == 'mesh':
+        print("Mesh sampling mode")
+    if run_mode == 'band_mesh':
+        print("Band structure and mesh sampling mode")
+    if run_mode == 'anime':
+        print("Animation mode")
+    if run_mode == 'modulation':
+        print("Modulation mode")
+    if run_mode == 'irreps':
+        print("Ir-representation mode")
+    if run_mode == 'qpoints':
+        if settings.get_write_dynamical_matrices():
+            print("QPOINTS mode (dynamical matrices written out)")
+        else:
+            print("QPOINTS mode")
+    if (run_mode == 'band' or
+        run_mode == 'mesh' or
+        run_mode == 'qpoints') and settings.get_is_group_velocity():
+        gv_delta_q = settings.get_group_velocity_delta_q()
+        if gv_delta_q is not None:
+            print("  With group velocity calculation (dq=%3.1e)" % gv_delta_q)
+        else:
+            print('')
+    if run_mode == 'displacements':
+        print("Creating displacements")
+        if not settings.get_is_plusminus_displacement() == 'auto':
+            if settings.get_is_plusminus_displacement():
+                print("  Plus Minus displacement: full plus minus directions")
+            else:
+                print("  Plus Minus displacement: only one direction")
+        if not settings.get_is_diagonal_displacement():
+            print("  Diagonal displacement: off")
+
+    print("Settings:")
+    if settings.get_is_nac():
+        print("  Non-analytical term correction: on")
+    if settings.get_fc_spg_symmetry():
+        print("  Enforce space group symmetry to force constants: on")
+    if settings.get_fc_symmetry_iteration() > 0:
+        print("  Force constants symmetrization: %d times" %
+              settings.get_fc_symmetry_iteration())
+    if settings.get_lapack_solver():
+        print("  Use Lapack solver via Lapacke: on")
+    if run_mode == 'mesh' or run_mode == 'band_mesh':
+        print("  Sampling mesh: %s" % np.array(settings.get_mesh()[0]))
+        if settings.get_is_thermal_properties():
+            cutoff_freq = settings.get_cutoff_frequency()
+            if cutoff_freq is None:
+                pass
+            elif cutoff_freq < 0:
+                print("  - Thermal properties are calculatd with "
+                      "absolute phonon frequnecy.")
+            else:
+                print("  - Phonon frequencies > %f are used to calculate "
+                      "thermal properties." % cutoff_freq)
+    if (np.diag(np.diag(settings.get_supercell_matrix())) \
+            - settings.get_supercell_matrix()).any():
+        print("  Supercell matrix:")
+        for v in settings.get_supercell_matrix():
+            print("    %s" % v)
+    else:
+        print("  Supercell: %s" % np.diag(settings.get_supercell_matrix()))
+    if settings.get_primitive_matrix() is not None:
+        print("  Primitive axis:")
+        for v in settings.get_primitive_matrix():
+            print("    %s" % v)
@@ -0,0 +1,2142 @@
+#!/usr/bin/env python
+
+"""Phonopy work flow of PWmat2Phonopy as importable functions
+
+Every step of the command line tools is available here as a function
+that takes a settings object (PhonopySettings of pwmat2phonopy.cui.settings)
+and returns its result, so that many material directories can be processed
+within one python process. Errors are raised as DriverError instead of
+terminating the interpreter; printing error messages and setting the exit
+status is left to the command line wrappers in bin/.
+
+Files (FORCE_SETS, FORCE_CONSTANTS, BORN, disp.yaml, ...) are read from and
+written to the current directory as done by the command line tools.
+
+"""
+
+import os
+import sys
+
+__author__  = "Paul Chern"
+__email__   = "peng.chen.iphy@gmail.com"
+__licence__ = "GPL"
+__date__    = "Nov. 2017"
+
+from pwmat2phonopy.cui.show_log import print_settings, print_cells
+from pwmat2phonopy.profiler import stage
+
+class DriverError(RuntimeError):
+    pass
+
+def get_log_level(options):
+    log_level = 1
+    if options.verbose:
+        log_level = 2
+    if options.quiet or options.is_check_symmetry:
+        log_level = 0
+    if options.loglevel is not None:
+        log_level = options.loglevel
+    return log_level
+
+def load_settings(filename=None, options=None, option_list=None):
+    """Read settings from a configuration file and/or command options
+
+    Returns the settings object and the raw configuration dictionary,
+    the latter being stored in phonopy.yaml.
+
+    """
+    from pwmat2phonopy.cui.settings import PhonopyConfParser
+
+    if filename is not None:
+        check_file_exists(filename)
+    phonopy_conf = PhonopyConfParser(filename=filename,
+                                     options=options,
+                                     option_list=option_list)
+    return phonopy_conf.get_settings(), phonopy_conf.get_configures()
+
+def check_file_exists(filename):
+    if not os.path.exists(filename):
+        raise DriverError("%s not found." % filename)
+
+def get_physical_units(settings):
+    from pwmat2phonopy.interface import get_default_physical_units
+
+    physical_units = get_default_physical_units(settings.get_calculator())
+    # Overwrite frequency unit conversion factor
+    if settings.get_frequency_conversion_factor() is not None:
+        physical_units['factor'] = settings.get_frequency_conversion_factor()
+    return physical_units
+
+###############
+# Unit cell   #
+###############
+def read_cell(settings):
+    """Read unit cell and apply magnetic moments
+
+    Returns the unit cell and the optional structure file information
+    given by read_crystal_structure. The first element of the latter is
+    the file name of the unit cell.
+
+    """
+    import numpy as np
+    from pwmat2phonopy.interface import read_crystal_structure
+
+    unitcell, optional_structure_file_information = read_crystal_structure(
+        filename=settings.get_cell_filename(),
+        interface_mode=settings.get_calculator(),
+        chemical_symbols=settings.get_chemical_symbols(),
+        yaml_mode=settings.get_yaml_mode())
+    unitcell_filename = optional_structure_file_information[0]
+
+    if unitcell is None:
+        raise DriverError("Crystal structure file of %s could not be found." %
+                          unitcell_filename)
+
+    # Check unit cell
+    if np.linalg.det(unitcell.get_cell()) < 0.0:
+        raise DriverError("Lattice vectors have to follow the right-hand rule.")
+
+    # Set magnetic moments
+    magmoms = settings.get_magnetic_moments()
+    if magmoms is not None:
+        if len(magmoms) == unitcell.get_number_of_atoms():
+            unitcell.set_magnetic_moments(magmoms)
+        else:
+            raise DriverError("Invalid MAGMOM setting")
+
+    return unitcell, optional_structure_file_information
+
+def check_symmetry(settings, phonopy_version=None, unitcell=None):
+    from phonopy.cui.show_symmetry import check_symmetry as show_symmetry
+
+    if unitcell is None:
+        with stage('read_cell'):
+            unitcell = read_cell(settings)[0]
+    if phonopy_version is None:
+        from pwmat2phonopy.cui.show_log import get_phonopy_version
+        phonopy_version = get_phonopy_version()
+    physical_units = get_physical_units(settings)
+    with stage('symmetry'):
+        show_symmetry(unitcell,
+                      primitive_axis=settings.get_primitive_matrix(),
+                      symprec=settings.get_symmetry_tolerance(),
+                      distance_to_A=physical_units['distance_to_A'],
+                      phonopy_version=phonopy_version)
+
+def convert_cell(settings, calculator):
+    """Convert the unit cell to the structure file format of calculator
+
+    The unit cell is read in the format of settings.get_calculator().
+    'pwmat' writes <cell_filename>.pwmat and 'vasp' writes
+    <cell_filename>.vasp. The name of the written file is returned.
+
+    """
+    unitcell = read_cell(settings)[0]
+    filename = settings.get_cell_filename()
+    if calculator == 'pwmat':
+        from pwmat2phonopy.interface.pwmat import write_unitcell
+        write_unitcell(unitcell, filename=filename)
+        return filename + ".pwmat"
+    elif calculator == 'vasp':
+        from pwmat2phonopy.interface.pwmat import write_poscar
+        write_poscar(unitcell, filename=filename)
+        return filename + ".vasp"
+    else:
+        raise DriverError("Conversion to %s is not supported." % calculator)
+
+#####################
+# Integrated tools  #
+#####################
+def create_force_sets(settings,
+                      force_filenames,
+                      is_wien2k_p1=False,
+                      force_sets_zero_mode=False,
+                      log_level=0):
+    """Create FORCE_SETS from disp.yaml and calculator force files
+
+    Returns the error number given by create_FORCE_SETS (0 on success).
+
+    """
+    from pwmat2phonopy.interface import create_FORCE_SETS
+
+    check_file_exists('disp.yaml')
+    for filename in force_filenames:
+        check_file_exists(filename)
+    with stage('create_force_sets'):
+        return create_FORCE_SETS(settings.get_calculator(),
+                                 force_filenames,
+                                 settings.get_symmetry_tolerance(),
+                                 is_wien2k_p1=is_wien2k_p1,
+                                 force_sets_zero_mode=force_sets_zero_mode,
+                                 log_level=log_level)
+
+def create_force_constants(settings, vasprun_filename, log_level=0):
+    from pwmat2phonopy.interface.pwmat import create_FORCE_CONSTANTS
+
+    check_file_exists(vasprun_filename)
+    return create_FORCE_CONSTANTS(vasprun_filename,
+                                  settings.get_is_hdf5(),
+                                  log_level)
+
+def create_force_constants_from_movement(settings,
+                                        movement_filename,
+                                        skip=0,
+                                        step=1,
+                                        batch_size=100,
+                                        log_level=0):
+    """Fit FORCE_CONSTANTS to the frames of a PWmat MD run
+
+    The MD has to be of the supercell of the unit cell (-c) given by DIM
+    with fixed lattice. Atoms of MOVEMENT are matched to those of the
+    supercell by their positions in the first used frame, and the
+    displacements are taken from the ideal supercell. Frames are read in
+    batches of batch_size and the force constants of the independent
+    atoms are fitted by least squares through all space group operations
+    of the supercell (pwmat2phonopy.fc_fit). force_constants.hdf5 is
+    written with --hdf5, FORCE_CONSTANTS otherwise.
+
+    """
+    import numpy as np
+    from phonopy.structure.cells import get_supercell
+    from phonopy.structure.symmetry import Symmetry
+    from pwmat2phonopy.interface.pwmat import Movement
+    from pwmat2phonopy.fc_fit import (ForceConstantsFit, get_displacements,
+                                      get_atom_mapping)
+    import pwmat2phonopy.file_IO as file_IO
+
+    if settings.get_is_hdf5():
+        try:
+            import h5py
+        except ImportError:
+            raise DriverError("You need to install python-h5py.")
+
+    check_file_exists(movement_filename)
+    symprec = settings.get_symmetry_tolerance()
+    with stage('read_cell'):
+        unitcell, optional_structure_file_information = read_cell(settings)
+    unitcell_filename = optional_structure_file_information[0]
+    supercell_matrix = settings.get_supercell_matrix()
+    if supercell_matrix is None:
+        supercell_matrix = np.eye(3, dtype='intc')
+    supercell = get_supercell(unitcell, supercell_matrix, symprec)
+    lattice = supercell.get_cell()
+    positions = supercell.get_scaled_positions()
+    num_atom = supercell.get_number_of_atoms()
+
+    with stage('symmetry'):
+        symmetry = Symmetry(supercell, symprec)
+        operations = symmetry.get_symmetry_operations()
+        fit = ForceConstantsFit(lattice,
+                                positions,
+                                operations['rotations'],
+                                operations['translations'],
+                                symprec=symprec)
+
+    movement = Movement(movement_filename)
+    try:
+        if movement.get_number_of_atoms() != num_atom:
+            raise DriverError(
+                "Number of atoms in %s (%d) is not that of the supercell "
+                "(%d).\nPlease carefully check DIM and %s." %
+                (movement_filename, movement.get_number_of_atoms(), num_atom,
+                 unitcell_filename))
+        frames = np.arange(len(movement))[skip::step]
+        if len(frames) == 0:
+            raise DriverError("No MD frames are left in %s." %
+                              movement_filename)
+        md_lattice = movement.get_lattice(frames[0])
+        if np.abs(md_lattice - lattice).max() > 1e-3:
+            raise DriverError("Lattice of %s is not that of the supercell.\n"
+                              "Please carefully check DIM and %s." %
+                              (movement_filename, unitcell_filename))
+        try:
+            mapping = get_atom_mapping(positions,
+                                       movement.get_positions(frames[0]),
+                                       lattice)
+        except ValueError as e:
+            raise DriverError("%s\nAtoms of %s could not be matched to the "
+                              "supercell." % (e, movement_filename))
+        numbers = movement.get_atomic_numbers()[mapping]
+        if (numbers != supercell.get_atomic_numbers()).any():
+            raise DriverError("Atomic species of %s are not those of the "
+                              "supercell." % movement_filename)
+
+        with stage('fit_force_constants'):
+            for i in range(0, len(frames), batch_size):
+                indices = frames[i:i + batch_size].tolist()
+                displacements = get_displacements(
+                    positions,
+                    movement.get_positions(indices)[:, mapping],
+                    lattice)
+                forces = movement.get_forces(indices)[:, mapping]
+                # Drift of the MD cell and residual total force
+                displacements -= displacements.mean(axis=1)[:, None, :]
+                forces -= forces.mean(axis=1)[:, None, :]
+                fit.add(displacements, forces)
+            force_constants = fit.solve()
+    finally:
+        movement.close()
+
+    if settings.get_is_hdf5():
+        fc_filename = "force_constants.hdf5"
+        file_IO.write_force_constants_to_hdf5(force_constants,
+                                              filename=fc_filename)
+    else:
+        fc_filename = "FORCE_CONSTANTS"
+        file_IO.write_FORCE_CONSTANTS(force_constants, filename=fc_filename)
+
+    if log_level > 0:
+        print("%s has been created from %d frames of %s." %
+              (fc_filename, len(frames), movement_filename))
+        print("Independent atoms: %s, symmetry operations: %d" %
+              (" ".join(["%d" % (i + 1)
+                         for i in fit.get_independent_atoms()]),
+               fit.get_number_of_operations()))
+    return 0
+
+def create_born(settings, born_filename, log_level=0, filename="BORN"):
+    """Create BORN from the output of a PWmat DFPT or finite-field run
+
+    The unit cell is the one of -c (atom.config by default). Born
+    effective charges and dielectric constant are symmetrized and those
+    of the independent atoms of the primitive cell given by DIM and
+    PRIMITIVE_AXIS are written.
+
+    """
+    from pwmat2phonopy.interface.pwmat import get_born_pwmat
+    from pwmat2phonopy.file_IO import write_BORN
+
+    cell_filename = settings.get_cell_filename()
+    if cell_filename is None:
+        cell_filename = "atom.config"
+    check_file_exists(born_filename)
+    check_file_exists(cell_filename)
+    with stage('create_born'):
+        try:
+            born_params = get_born_pwmat(
+                born_filename=born_filename,
+                cell_filename=cell_filename,
+                primitive_matrix=settings.get_primitive_matrix(),
+                supercell_matrix=settings.get_supercell_matrix(),
+                symprec=settings.get_symmetry_tolerance())
+        except ValueError as e:
+            raise DriverError(str(e))
+    if born_params is None:
+        raise DriverError("Dielectric constant or Born effective charges "
+                          "were not found in %s." % born_filename)
+
+    borns, epsilon, atom_indices = born_params
+    write_BORN(borns,
+               epsilon,
+               atom_indices=atom_indices,
+               factor=get_physical_units(settings)['nac_factor'],
+               filename=filename)
+    if log_level > 0:
+        print("%s has been created from %s." % (filename, born_filename))
+    return 0
+
+##########################
+# Phonopy initialization #
+##########################
+def read_force_constants(settings, num_satom, unitcell_filename):
+    import pwmat2phonopy.file_IO as file_IO
+
+    if settings.get_is_hdf5():
+        try:
+            import h5py
+        except ImportError:
+            raise DriverError("You need to install python-h5py.")
+        fc_filename = "force_constants.hdf5"
+        check_file_exists(fc_filename)
+        fc = file_IO.read_force_constants_hdf5(fc_filename)
+    else:
+        fc_filename = "FORCE_CONSTANTS"
+        check_file_exists(fc_filename)
+        fc = file_IO.parse_FORCE_CONSTANTS(filename=fc_filename)
+
+    if fc.shape[0] != num_satom:
+        error_text = ("Number of atoms in supercell is not consistent with "
+                      "the matrix shape of\nforce constants read from ")
+        error_text += "%s.\n" % fc_filename
+        error_text += ("Please carefully check DIM, FORCE_CONSTANTS, "
+                       "and %s.") % unitcell_filename
+        raise DriverError(error_text)
+
+    return fc, fc_filename
+
+def read_force_sets(num_satom, unitcell_filename, filename="FORCE_SETS"):
+    import pwmat2phonopy.file_IO as file_IO
+
+    check_file_exists(filename)
+    force_sets = file_IO.parse_FORCE_SETS(filename=filename)
+    if force_sets['natom'] != num_satom:
+        error_text = "Number of atoms in supercell is not consistent with "
+        error_text += "the data in FORCE_SETS.\n"
+        error_text += ("Please carefully check DIM, FORCE_SETS,"
+                       " and %s") % unitcell_filename
+        raise DriverError(error_text)
+    return force_sets
+
+def init_phonopy(unitcell, settings, log_level=0):
+    """Create Phonopy object
+
+    In the displacements mode, only the supercell matrix and symmetry
+    settings are used.
+
+    """
+    from phonopy import Phonopy
+
+    if settings.get_supercell_matrix() is None:
+        raise DriverError("Supercell matrix (DIM or --dim) is not found.")
+
+    if settings.get_run_mode() == 'displacements':
+        phonon = Phonopy(unitcell,
+                         settings.get_supercell_matrix(),
+                         symprec=settings.get_symmetry_tolerance(),
+                         is_symmetry=settings.get_is_symmetry(),
+                         log_level=log_level)
+    else:
+        physical_units = get_physical_units(settings)
+        phonon = Phonopy(unitcell,
+                         settings.get_supercell_matrix(),
+                         primitive_matrix=settings.get_primitive_matrix(),
+                         factor=physical_units['factor'],
+                         dynamical_matrix_decimals=settings.get_dm_decimals(),
+                         force_constants_decimals=settings.get_fc_decimals(),
+                         symprec=settings.get_symmetry_tolerance(),
+                         is_symmetry=settings.get_is_symmetry(),
+                         use_lapack_solver=settings.get_lapack_solver(),
+                         log_level=log_level)
+
+    # Set atomic masses of primitive cell
+    if settings.get_masses() is not None:
+        phonon.set_masses(settings.get_masses())
+
+    return phonon
+
+def show_phonopy_info(phonon, settings, unitcell_filename, log_level=0):
+    if log_level > 0:
+        print("Python version %d.%d.%d" % sys.version_info[:3])
+        import phonopy.structure.spglib as spglib
+        print("Spglib version %d.%d.%d" % spglib.get_version())
+        if settings.get_calculator():
+            print("Calculator interface: %s" % settings.get_calculator())
+        print_settings(settings)
+        if settings.get_magnetic_moments() is None:
+            print("Spacegroup: %s" %
+                  phonon.get_symmetry().get_international_table())
+
+    if log_level > 1:
+        print_cells(phonon, unitcell_filename)
+
+#########################
+# Create displacements  #
+#########################
+def get_displacement_distance(settings):
+    if settings.get_displacement_distance() is not None:
+        return settings.get_displacement_distance()
+    if settings.get_calculator() in ('wien2k', 'abinit', 'elk', 'pwscf',
+                                     'siesta'):
+        return 0.02
+    else: # crystal, pwmat, default or vasp
+        return 0.01
+
+def get_supercell_dimension(settings):
+    """Supercell dimension as used in names of PWmat files, e.g. '2x2x2'"""
+    import numpy as np
+
+    smat = np.array(settings.get_supercell_matrix())
+    if (np.diag(np.diag(smat)) - smat).any():
+        dim = smat.ravel()
+    else:
+        dim = np.diag(smat)
+    return 'x'.join(["%d" % x for x in dim])
+
+def create_displacements(phonon,
+                         settings,
+                         optional_structure_file_information,
+                         log_level=0,
+                         displacement_dataset=None):
+    """Write disp.yaml and supercells with displacements
+
+    With RANDOM_DISPLACEMENTS (--rd), all atoms of every supercell are
+    displaced by the displacement distance in random directions, and the
+    force constants are later fitted by least squares (fc_fit). Returns
+    the displacements.
+
+    displacement_dataset is used in place of generated displacements,
+    e.g. those of a cell of the same symmetry at another volume: phonopy's
+    displacement dataset, or {'displacements': displacements} as returned
+    here with RANDOM_DISPLACEMENTS.
+
+    """
+    import pwmat2phonopy.file_IO as file_IO
+
+    interface_mode = settings.get_calculator()
+    unitcell_filename = optional_structure_file_information[0]
+    supercell = phonon.get_supercell()
+
+    num_random = settings.get_random_displacements()
+    if num_random:
+        from pwmat2phonopy.fc_fit import get_random_displacements
+
+        if displacement_dataset is not None:
+            displacements = displacement_dataset['displacements']
+        else:
+            displacements = get_random_displacements(
+                num_random,
+                supercell.get_number_of_atoms(),
+                get_displacement_distance(settings),
+                seed=settings.get_random_seed())
+        cells_with_disps = []
+        for disps in displacements:
+            cell = supercell.copy()
+            cell.set_positions(supercell.get_positions() + disps)
+            cells_with_disps.append(cell)
+    elif displacement_dataset is not None:
+        import copy
+        phonon.set_displacement_dataset(copy.deepcopy(displacement_dataset))
+    else:
+        phonon.generate_displacements(
+            distance=get_displacement_distance(settings),
+            is_plusminus=settings.get_is_plusminus_displacement(),
+            is_diagonal=settings.get_is_diagonal_displacement(),
+            is_trigonal=settings.get_is_trigonal_displacement())
+    if interface_mode == 'wien2k':
+        from phonopy.interface.wien2k import write_supercells_with_displacements
+    elif interface_mode == 'abinit':
+        from phonopy.interface.abinit import write_supercells_with_displacements
+    elif interface_mode == 'pwscf':
+        from phonopy.interface.pwscf import write_supercells_with_displacements
+    elif interface_mode == 'elk':
+        from phonopy.interface.elk import write_supercells_with_displacements
+    elif interface_mode == 'siesta':
+        from phonopy.interface.siesta import write_supercells_with_displacements
+    elif interface_mode == 'crystal':
+        from phonopy.interface.crystal import write_supercells_with_displacements
+    elif interface_mode == 'pwmat':
+        from pwmat2phonopy.interface.pwmat import (
+            write_supercells_with_displacements)
+    else: # default or vasp
+        from phonopy.interface.vasp import write_supercells_with_displacements
+
+    if num_random:
+        file_IO.write_random_disp_yaml(displacements, supercell)
+    else:
+        displacements = phonon.get_displacements()
+        directions = phonon.get_displacement_directions()
+        file_IO.write_disp_yaml(displacements,
+                                supercell,
+                                directions=directions)
+        cells_with_disps = phonon.get_supercells_with_displacements()
+
+    # Write supercells with displacements
+    if interface_mode == 'wien2k':
+        npts, r0s, rmts = optional_structure_file_information[1:4]
+        write_supercells_with_displacements(
+            supercell,
+            cells_with_disps,
+            npts,
+            r0s,
+            rmts,
+            settings.get_supercell_matrix(),
+            filename=unitcell_filename)
+    elif interface_mode == 'abinit':
+        write_supercells_with_displacements(supercell, cells_with_disps)
+    elif (interface_mode == 'pwscf' or
+          interface_mode == 'elk' or
+          interface_mode == 'siesta'):
+        write_supercells_with_displacements(
+            supercell,
+            cells_with_disps,
+            optional_structure_file_information[1])
+    elif interface_mode == 'crystal':
+        conv_numbers = optional_structure_file_information[1]
+        write_supercells_with_displacements(supercell,
+                                            cells_with_disps,
+                                            conv_numbers,
+                                            settings.get_supercell_matrix(),
+                                            template_file="TEMPLATE")
+    elif interface_mode == 'pwmat':
+        write_supercells_with_displacements(
+            supercell,
+            cells_with_disps,
+            supercell_dimension=get_supercell_dimension(settings))
+    else: # default or vasp
+        write_supercells_with_displacements(supercell, cells_with_disps)
+
+    if log_level > 0:
+        print('')
+        print("disp.yaml and supercells have been created.")
+
+    return displacements
+
+###################
+# Force constants #
+###################
+def set_force_constants(phonon,
+                        settings,
+                        force_constants=None,
+                        force_sets=None,
+                        log_level=0):
+    """Set or produce force constants and post-process them
+
+    Either force_constants or force_sets (dataset of FORCE_SETS) has to be
+    given. Cutoff radius, space group symmetrization, symmetrization of
+    translational invariance and index permutation, writing out and the
+    rotational invariance condition are handled as set in settings.
+
+    """
+    import pwmat2phonopy.file_IO as file_IO
+
+    if force_constants is not None:
+        phonon.set_force_constants(force_constants)
+    elif force_sets is not None and 'displacements' in force_sets:
+        # All atoms displaced (RANDOM_DISPLACEMENTS)
+        if log_level > 0:
+            print("Fitting force constants to %d supercells..." %
+                  len(force_sets['displacements']))
+        with stage('fit_force_constants'):
+            phonon.set_force_constants(
+                fit_force_constants(phonon, force_sets))
+    elif force_sets is not None:
+        phonon.set_displacement_dataset(force_sets)
+        if log_level > 0:
+            print("Computing force constants...")
+
+        with stage('produce_force_constants'):
+            if (settings.get_is_force_constants() == "write" or
+                settings.get_fc_symmetry_iteration() > 0 or
+                settings.get_fc_spg_symmetry()):
+                # Need to calculate full force constant tensors
+                phonon.produce_force_constants(
+                    computation_algorithm=(
+                        settings.get_fc_computation_algorithm()))
+            else: # Only force constants between atoms in primitive cell and in supercell
+                phonon.produce_force_constants(
+                    calculate_full_force_constants=False,
+                    computation_algorithm=(
+                        settings.get_fc_computation_algorithm()))
+    else:
+        raise DriverError("Neither force constants nor force sets are given.")
+
+    # Impose cutoff radius on force constants
+    cutoff_radius = settings.get_cutoff_radius()
+    if cutoff_radius:
+        phonon.set_force_constants_zero_with_radius(cutoff_radius)
+
+    # Enforce space group symmetry to force constants
+    if settings.get_fc_spg_symmetry():
+        if log_level > 0:
+            print('')
+            print("Force constants are symmetrized by space group operations.")
+            print("This may take some time...")
+        with stage('symmetrize_force_constants_by_space_group'):
+            phonon.symmetrize_force_constants_by_space_group()
+        with stage('write_force_constants'):
+            file_IO.write_FORCE_CONSTANTS(phonon.get_force_constants(),
+                                          filename='FORCE_CONSTANTS_SPG')
+        if log_level > 0:
+            print("Symmetrized force constants are written into "
+                  "FORCE_CONSTANTS_SPG.")
+
+    # Imporse translational invariance and index permulation symmetry to
+    # force constants
+    if settings.get_fc_symmetry_iteration() > 0:
+        with stage('symmetrize_force_constants'):
+            phonon.symmetrize_force_constants(
+                settings.get_fc_symmetry_iteration())
+
+    # Write FORCE_CONSTANTS
+    if settings.get_is_force_constants() == "write":
+        with stage('write_force_constants'):
+            if settings.get_is_hdf5():
+                file_IO.write_force_constants_to_hdf5(
+                    phonon.get_force_constants())
+            else:
+                file_IO.write_FORCE_CONSTANTS(phonon.get_force_constants())
+        if log_level > 0:
+            if settings.get_is_hdf5():
+                print("Force constants are written into force_constants.hdf5.")
+            else:
+                print("Force constants are written into FORCE_CONSTANTS.")
+
+    # Show the rotational invariance condition (just show!)
+    if settings.get_is_rotational_invariance():
+        phonon.get_rotational_condition_of_fc()
+
+    return phonon.get_force_constants()
+
+def fit_force_constants(phonon, force_sets):
+    """Force constants fitted to supercells with all atoms displaced
+
+    force_sets has 'displacements' and 'forces' of shape
+    (num_supercells, num_atom, 3). Uniform translations and residual
+    total forces are removed, so the fitted force constants satisfy the
+    acoustic sum rule.
+
+    """
+    import numpy as np
+    from pwmat2phonopy.fc_fit import ForceConstantsFit
+
+    supercell = phonon.get_supercell()
+    symmetry = phonon.get_symmetry()
+    operations = symmetry.get_symmetry_operations()
+    displacements = np.array(force_sets['displacements'], dtype='double')
+    forces = np.array(force_sets['forces'], dtype='double')
+    displacements -= displacements.mean(axis=1)[:, None, :]
+    forces -= forces.mean(axis=1)[:, None, :]
+
+    fit = ForceConstantsFit(supercell.get_cell(),
+                            supercell.get_scaled_positions(),
+                            operations['rotations'],
+                            operations['translations'],
+                            symprec=symmetry.get_symmetry_tolerance())
+    fit.add(displacements, forces)
+    return fit.solve()
+
+def set_nac(phonon, settings, log_level=0, filename="BORN"):
+    """Non-analytical term correction (LO-TO splitting)
+
+    Returns the parameters read from BORN.
+
+    """
+    import pwmat2phonopy.file_IO as file_IO
+
+    primitive = phonon.get_primitive()
+    check_file_exists(filename)
+    with open(filename) as f:
+        nac_params = file_IO.get_born_parameters(
+            f,
+            primitive,
+            phonon.get_primitive_symmetry())
+    if not nac_params:
+        raise DriverError("%s file could not be read correctly." % filename)
+    if nac_params['factor'] == None:
+        nac_params['factor'] = get_physical_units(settings)['nac_factor']
+    phonon.set_nac_params(nac_params=nac_params)
+
+    if log_level > 1:
+        print("-" * 27 + " Dielectric constant " + "-" * 28)
+        for v in nac_params['dielectric']:
+            print("         %12.7f %12.7f %12.7f" % tuple(v))
+        print("-" * 26 + " Born effective charges " + "-" * 26)
+        symbols = primitive.get_chemical_symbols()
+        for i, (z, s) in enumerate(zip(nac_params['born'], symbols)):
+            for j, v in enumerate(z):
+                if j == 0:
+                    text = "%5d %-2s" % (i + 1, s)
+                else:
+                    text = "        "
+                print("%s %12.7f %12.7f %12.7f" % ((text,) + tuple(v)))
+        print("-" * 76)
+
+    return nac_params
+
+def check_masses(primitive):
+    # Atomic species without mass case
+    if primitive.get_masses() is not None:
+        return
+
+    from phonopy.structure.atoms import atom_data, symbol_map
+
+    symbols_with_no_mass = []
+    for s in primitive.get_chemical_symbols():
+        if (atom_data[symbol_map[s]][3] is None and
+            s not in symbols_with_no_mass):
+            symbols_with_no_mass.append(s)
+
+    if symbols_with_no_mass:
+        error_text = "\n".join(
+            ["Atomic mass of \'%s\' is not implemented in phonopy." % s
+             for s in symbols_with_no_mass])
+        error_text += "\nMASS tag can be used to set atomic masses."
+        raise DriverError(error_text)
+
+#######################
+# Phonon calculations #
+#######################
+def _show_plot(plot, settings, filename):
+    if settings.get_is_graph_save():
+        plot.savefig(filename)
+    else:
+        plot.show()
+
+def _get_pdos_indices(settings, primitive):
+    import numpy as np
+
+    pdos_indices = settings.get_pdos_indices()
+    if not pdos_indices:
+        num_atom = primitive.get_number_of_atoms()
+        pdos_indices = [np.arange(num_atom) * 3 + i for i in range(3)]
+    return pdos_indices
+
+def _print_projection_direction(p_direction, primitive):
+    import numpy as np
+
+    c_direction = np.dot(p_direction, primitive.get_cell())
+    c_direction /= np.linalg.norm(c_direction)
+    print("Projection direction: [%6.3f %6.3f %6.3f] "
+          "(fractional)" % tuple(p_direction))
+    print("                      [%6.3f %6.3f %6.3f] "
+          "(Cartesian)" % tuple(c_direction))
+
+def run_qpoints(phonon, settings, log_level=0):
+    """Phonons at the q-points of QPOINTS or of settings
+
+    Without group velocities, the q-points are solved block by block
+    (see run_qpoints_batch). With QPOINTS_CHUNK, the q-points of QPOINTS
+    (or of QPOINTS_FILE) are read, solved and written chunk by chunk and
+    None is returned (see run_qpoints_streaming). Otherwise returns the
+    frequencies and eigenvectors given by Phonopy.get_qpoints_phonon().
+
+    """
+    import pwmat2phonopy.file_IO as file_IO
+
+    if settings.get_qpoints():
+        q_points = settings.get_qpoints()
+        if log_level > 0:
+            print("Q-points that will be calculated at:")
+            for q in q_points:
+                print("    %s" % q)
+    else:
+        filename = settings.get_qpoints_filename()
+        if filename is None:
+            filename = "QPOINTS"
+        if log_level > 0:
+            print("Frequencies at q-points given by %s:" % filename)
+        chunk_size = settings.get_qpoints_chunk_size()
+        if chunk_size is not None:
+            if not settings.get_is_group_velocity():
+                return run_qpoints_streaming(phonon,
+                                             settings,
+                                             filename,
+                                             chunk_size,
+                                             log_level=log_level)
+            elif log_level > 0:
+                print("QPOINTS_CHUNK is ignored: group velocities are "
+                      "calculated at all q-points at once.")
+        with stage('read_qpoints'):
+            q_points = file_IO.parse_QPOINTS(filename=filename)
+
+    if not settings.get_is_group_velocity():
+        return run_qpoints_batch(phonon, settings, q_points)
+
+    with stage('qpoints'):
+        phonon.set_qpoints_phonon(
+            q_points,
+            nac_q_direction=settings.get_nac_q_direction(),
+            is_eigenvectors=settings.get_is_eigenvectors(),
+            write_dynamical_matrices=settings.get_write_dynamical_matrices())
+
+    with stage('write_qpoints'):
+        if settings.get_is_hdf5():
+            phonon.write_hdf5_qpoints_phonon()
+        else:
+            phonon.write_yaml_qpoints_phonon()
+
+    return phonon.get_qpoints_phonon()
+
+def run_qpoints_batch(phonon, settings, q_points):
+    """Phonons at q-points solved block by block
+
+    qpoints.yaml (qpoints.hdf5 with --hdf5) is written as by phonopy's
+    QpointsPhonon. Returns the frequencies and eigenvectors (or None).
+
+    """
+    import numpy as np
+    from pwmat2phonopy.dynamical_matrix import get_dynamical_matrix_batch
+
+    q_points = np.reshape(q_points, (-1, 3))
+    dynamical_matrix_batch = get_dynamical_matrix_batch(
+        phonon.get_dynamical_matrix())
+    if dynamical_matrix_batch is None:
+        num_band = phonon.get_primitive().get_number_of_atoms() * 3
+        batch_size = max(1, 2 ** 26 // (num_band * num_band * 16))
+    else:
+        batch_size = dynamical_matrix_batch.get_batch_size()
+    chunks = (q_points[i:i + batch_size]
+              for i in range(0, len(q_points), batch_size))
+    return _solve_qpoints_chunks(phonon,
+                                 settings,
+                                 chunks,
+                                 len(q_points),
+                                 dynamical_matrix_batch=dynamical_matrix_batch)
+
+def run_qpoints_streaming(phonon, settings, filename, chunk_size, log_level=0):
+    """Phonons at q-points of a file read, solved and written in chunks
+
+    The file is QPOINTS format or .npy (memory-mapped). Only one chunk of
+    q-points and of their results is in memory at a time; qpoints.hdf5 is
+    appended chunk by chunk. Returns None.
+
+    """
+    import pwmat2phonopy.file_IO as file_IO
+    from pwmat2phonopy.dynamical_matrix import get_dynamical_matrix_batch
+
+    num_qpoints = file_IO.get_QPOINTS_size(filename=filename)
+    if log_level > 0:
+        print("%d q-points are solved in chunks of %d." %
+              (num_qpoints, chunk_size))
+    _solve_qpoints_chunks(
+        phonon,
+        settings,
+        file_IO.iter_QPOINTS(filename=filename, chunk_size=chunk_size),
+        num_qpoints,
+        dynamical_matrix_batch=get_dynamical_matrix_batch(
+            phonon.get_dynamical_matrix()),
+        is_kept=False)
+    return None
+
+def _solve_qpoints_chunks(phonon,
+                          settings,
+                          chunks,
+                          num_qpoints,
+                          dynamical_matrix_batch=None,
+                          is_kept=True):
+    # Solves and writes chunks of q-points. Returns the frequencies and
+    # eigenvectors (or None) of all of them if is_kept, else None.
+    import numpy as np
+    from pwmat2phonopy.dynamical_matrix import solve_dynamical_matrices
+    from pwmat2phonopy.stream_writer import (QpointsYamlWriter,
+                                             QpointsHdf5Writer)
+
+    is_eigenvectors = settings.get_is_eigenvectors()
+    is_dms = settings.get_write_dynamical_matrices()
+    if settings.get_is_hdf5():
+        writer = QpointsHdf5Writer(phonon.get_primitive(),
+                                   is_eigenvectors=is_eigenvectors,
+                                   is_dynamical_matrices=is_dms,
+                                   compression=settings.get_hdf5_compression(),
+                                   is_float32=settings.get_hdf5_float32())
+    else:
+        writer = QpointsYamlWriter(num_qpoints,
+                                   phonon.get_primitive(),
+                                   is_eigenvectors=is_eigenvectors,
+                                   is_dynamical_matrices=is_dms)
+
+    frequencies = []
+    eigenvectors = []
+    try:
+        for q_points in chunks:
+            with stage('qpoints'):
+                dms = _get_qpoints_dynamical_matrices(
+                    phonon.get_dynamical_matrix(),
+                    q_points,
+                    nac_q_direction=settings.get_nac_q_direction(),
+                    dynamical_matrix_batch=dynamical_matrix_batch)
+                freqs, eigvecs = solve_dynamical_matrices(
+                    dms,
+                    phonon.get_unit_conversion_factor(),
+                    is_eigenvectors=is_eigenvectors)
+            with stage('write_qpoints'):
+                writer.write(q_points, freqs, eigvecs, dms)
+            if is_kept:
+                frequencies.append(freqs)
+                if is_eigenvectors:
+                    eigenvectors.append(eigvecs)
+    finally:
+        writer.close()
+
+    if not is_kept:
+        return None
+    num_band = phonon.get_primitive().get_number_of_atoms() * 3
+    frequencies = np.concatenate([np.zeros((0, num_band))] + frequencies)
+    if is_eigenvectors:
+        return frequencies, np.concatenate(eigenvectors)
+    else:
+        return frequencies, None
+
+def _get_qpoints_dynamical_matrices(dynamical_matrix,
+                                    q_points,
+                                    nac_q_direction=None,
+                                    dynamical_matrix_batch=None):
+    # As phonopy's QpointsPhonon._get_dynamical_matrix for many q-points.
+    import numpy as np
+
+    if dynamical_matrix_batch is not None:
+        return dynamical_matrix_batch.get_dynamical_matrices(q_points)
+    dms = []
+    for q in q_points:
+        if nac_q_direction is not None and (np.abs(q) < 1e-5).all():
+            dynamical_matrix.set_dynamical_matrix(
+                q, q_direction=nac_q_direction)
+        else:
+            dynamical_matrix.set_dynamical_matrix(q)
+        dms.append(dynamical_matrix.get_dynamical_matrix())
+    return np.array(dms)
+
+def run_band(phonon, settings, log_level=0):
+    """Band structure along the paths of settings
+
+    Unless group velocities are calculated or the band structure is
+    plotted with DOS, the paths are solved and written one by one (see
+    run_band_streaming). Returns the band structure given by
+    Phonopy.get_band_structure().
+
+    """
+    bands = settings.get_bands()
+    if log_level > 0:
+        print("Reciprocal space paths in reduced coordinates:")
+        for band in bands:
+            print("[%5.2f %5.2f %5.2f] --> [%5.2f %5.2f %5.2f]" %
+                  (tuple(band[0]) + tuple(band[-1])))
+
+    if settings.get_calculator() is None:
+        comment = None
+    else:
+        comment = {'calculator': settings.get_calculator()}
+
+    if (not settings.get_is_group_velocity() and
+        not (settings.get_run_mode() == 'band_mesh' and
+             settings.get_is_graph_plot())):
+        with stage('band'):
+            band_structure = run_band_streaming(phonon,
+                                                settings,
+                                                comment=comment)
+        if settings.get_is_graph_plot():
+            with stage('plot'):
+                plot = _plot_band_structure(
+                    band_structure[1],
+                    band_structure[2],
+                    labels=settings.get_band_labels(),
+                    is_band_connection=settings.get_is_band_connection())
+                _show_plot(plot, settings, 'band.pdf')
+        return band_structure
+
+    with stage('band'):
+        phonon.set_band_structure(
+            bands,
+            is_eigenvectors=settings.get_is_eigenvectors(),
+            is_band_connection=settings.get_is_band_connection())
+
+    with stage('write_band'):
+        if settings.get_is_hdf5():
+            phonon.write_hdf5_band_structure(
+                labels=settings.get_band_labels(), comment=comment)
+        else:
+            phonon.write_yaml_band_structure(
+                labels=settings.get_band_labels(), comment=comment)
+
+    if (settings.get_is_graph_plot() and
+        settings.get_run_mode() != 'band_mesh'):
+        with stage('plot'):
+            plot = phonon.plot_band_structure(
+                labels=settings.get_band_labels())
+            _show_plot(plot, settings, 'band.pdf')
+
+    return phonon.get_band_structure()
+
+def run_band_streaming(phonon, settings, comment=None):
+    """Band structure solved and written path by path
+
+    band.yaml (band.hdf5 with --hdf5) is written with the eigenvectors of
+    one path in memory at a time. The dynamical matrices of a path are
+    built at once by DynamicalMatrixBatch unless non-analytical term
+    correction is used. Returns the q-points, distances and frequencies
+    of the paths and None in place of the eigenvectors, as
+    Phonopy.get_band_structure() is ordered.
+
+    """
+    import numpy as np
+    from pwmat2phonopy.stream_writer import BandYamlWriter, BandHdf5Writer
+    from pwmat2phonopy.dynamical_matrix import get_dynamical_matrix_batch
+
+    paths = [np.array(path, dtype='double') for path in settings.get_bands()]
+    labels = settings.get_band_labels()
+    primitive = phonon.get_primitive()
+    dynamical_matrix = phonon.get_dynamical_matrix()
+    dynamical_matrix_batch = get_dynamical_matrix_batch(dynamical_matrix)
+    # Eigenvectors needed only for band connection are not written.
+    is_eigenvectors = settings.get_is_eigenvectors()
+    if settings.get_is_hdf5():
+        writer = BandHdf5Writer(paths,
+                                primitive,
+                                labels=labels,
+                                comment=comment,
+                                is_eigenvectors=is_eigenvectors,
+                                compression=settings.get_hdf5_compression(),
+                                is_float32=settings.get_hdf5_float32())
+    else:
+        writer = BandYamlWriter(paths,
+                                primitive,
+                                phonon.get_supercell(),
+                                labels=labels,
+                                comment=comment)
+
+    rec_lattice = np.linalg.inv(primitive.get_cell())
+    distance = 0.0
+    distances = []
+    frequencies = []
+    band_order = None
+    try:
+        for path in paths:
+            dq = np.zeros_like(path)
+            dq[1:] = path[1:] - path[:-1]
+            distances_on_path = distance + np.cumsum(
+                np.sqrt((np.dot(dq, rec_lattice.T) ** 2).sum(axis=1)))
+            distance = distances_on_path[-1]
+            freqs, eigvecs, band_order = _solve_band_path(
+                dynamical_matrix,
+                path,
+                phonon.get_unit_conversion_factor(),
+                is_eigenvectors=is_eigenvectors,
+                is_band_connection=settings.get_is_band_connection(),
+                dynamical_matrix_batch=dynamical_matrix_batch,
+                band_order=band_order)
+            if is_eigenvectors:
+                writer.write(distances_on_path, freqs, eigvecs)
+            else:
+                writer.write(distances_on_path, freqs, None)
+            distances.append(distances_on_path)
+            frequencies.append(freqs)
+    finally:
+        writer.close()
+
+    return paths, distances, frequencies, None
+
+def _solve_band_path(dynamical_matrix,
+                     path,
+                     factor,
+                     is_eigenvectors=True,
+                     is_band_connection=False,
+                     dynamical_matrix_batch=None,
+                     band_order=None):
+    # Frequencies and eigenvectors along a path as phonopy's BandStructure,
+    # and the band order at the last q-point. With band connection, the
+    # band order of the previous path (band_order) is kept at the first
+    # q-point and the connection is followed from there.
+    import numpy as np
+    from pwmat2phonopy.dynamical_matrix import solve_dynamical_matrices
+
+    if dynamical_matrix_batch is not None:
+        dms = dynamical_matrix_batch.get_dynamical_matrices(path)
+    else:
+        dms = []
+        for q in path:
+            if dynamical_matrix.is_nac():
+                q_direction = None
+                if (np.abs(q) < 0.0001).all(): # For Gamma point
+                    q_direction = path[0] - path[-1]
+                dynamical_matrix.set_dynamical_matrix(
+                    q, q_direction=q_direction)
+            else:
+                dynamical_matrix.set_dynamical_matrix(q)
+            dms.append(dynamical_matrix.get_dynamical_matrix())
+        dms = np.array(dms)
+
+    frequencies, eigenvectors = solve_dynamical_matrices(
+        dms, factor, is_eigenvectors=(is_eigenvectors or is_band_connection))
+    if is_band_connection:
+        from phonopy.phonon.band_structure import estimate_band_connection
+        if band_order is None:
+            band_order = list(range(frequencies.shape[1]))
+        band_orders = [band_order]
+        for i in range(1, len(path)):
+            band_orders.append(estimate_band_connection(eigenvectors[i - 1],
+                                                        eigenvectors[i],
+                                                        band_orders[-1]))
+        for i, band_order in enumerate(band_orders):
+            frequencies[i] = frequencies[i][band_order]
+            eigenvectors[i] = eigenvectors[i][:, band_order]
+        band_order = band_orders[-1]
+    return frequencies, eigenvectors, band_order
+
+def _plot_band_structure(distances, frequencies, labels=None,
+                         is_band_connection=False):
+    # Same plot as Phonopy.plot_band_structure
+    import matplotlib.pyplot as plt
+    if labels:
+        from matplotlib import rc
+        rc('text', usetex=True)
+
+    fig, ax = plt.subplots()
+    ax.xaxis.set_ticks_position('both')
+    ax.yaxis.set_ticks_position('both')
+    ax.xaxis.set_tick_params(which='both', direction='in')
+    ax.yaxis.set_tick_params(which='both', direction='in')
+
+    for distances_on_path, freqs in zip(distances, frequencies):
+        for f in freqs.T:
+            if is_band_connection:
+                plt.plot(distances_on_path, f, '-')
+            else:
+                plt.plot(distances_on_path, f, 'r-')
+    special_points = [0.0] + [d[-1] for d in distances]
+    plt.ylabel('Frequency')
+    plt.xlabel('Wave vector')
+    if labels and len(labels) == len(special_points):
+        plt.xticks(special_points, labels)
+    else:
+        plt.xticks(special_points, [''] * len(special_points))
+    plt.xlim(0, special_points[-1])
+    plt.axhline(y=0, linestyle=':', linewidth=0.5, color='b')
+    return plt
+
+# Observables of the mesh mode in the order they are calculated. The
+# names are those of the setting tags (MESH_OBSERVABLES).
+MESH_OBSERVABLES = ('tprop', 'tdisp', 'tdispmat', 'tdistance', 'pdos', 'dos',
+                    'moment')
+
+def get_mesh_observables(settings):
+    """Observables calculated from the phonons on the sampling mesh
+
+    With MESH_OBSERVABLES (--observables) all those listed are returned.
+    Otherwise only the first one set among thermal properties, thermal
+    displacements (matrices), thermal distances, partial DOS, total DOS
+    and moment is, as done by the phonopy command.
+
+    """
+    observables = settings.get_mesh_observables()
+    if observables is not None:
+        observables = ['tprop' if x == 'ptprop' else x for x in observables]
+        return [x for x in MESH_OBSERVABLES if x in observables]
+
+    if settings.get_is_thermal_properties():
+        return ['tprop']
+    elif settings.get_is_thermal_displacements():
+        return ['tdisp']
+    elif settings.get_is_thermal_displacement_matrices():
+        return ['tdispmat']
+    elif settings.get_is_thermal_distances():
+        return ['tdistance']
+    elif settings.get_pdos_indices() is not None:
+        return ['pdos']
+    elif settings.get_is_graph_plot() or settings.get_is_dos_mode():
+        return ['dos']
+    elif settings.get_is_moment():
+        return ['moment']
+    return []
+
+def run_mesh(phonon, settings, log_level=0):
+    """Phonons on sampling mesh and properties derived from them
+
+    Thermal properties, thermal displacements (matrices), thermal
+    distances, partial DOS, total DOS or moment are calculated as set in
+    settings. With MESH_OBSERVABLES, several of them are calculated from
+    one mesh calculation (see get_mesh_observables). When only thermal
+    properties and total DOS are calculated, eigenvectors are not
+    (see run_frequency_mesh). With MESH_CHUNK, the q-points are solved in
+    chunks (see run_chunked_mesh). Returns the mesh data given by
+    Phonopy.get_mesh(), or None when the iterative or the chunked mesh is
+    used.
+
+    """
+    import time
+    import numpy as np
+
+    (mesh,
+     mesh_shift,
+     t_symmetry,
+     q_symmetry,
+     is_gamma_center) =  settings.get_mesh()
+    observables = get_mesh_observables(settings)
+    is_chunked = False
+    if settings.get_mesh_chunk_size() is not None:
+        reason = _check_chunked_mesh(settings, observables)
+        if reason is None:
+            is_chunked = True
+        elif log_level > 0:
+            print("MESH_CHUNK is ignored: %s." % reason)
+    is_frequency_only = (
+        not is_chunked and
+        not (settings.get_write_mesh() and settings.get_is_eigenvectors()) and
+        _check_frequency_only_mesh(settings, observables) is None)
+
+    mesh_data = None
+    if (settings.get_mesh_observables() is None and
+        (settings.get_is_thermal_displacements() or
+         settings.get_is_thermal_displacement_matrices())):
+        phonon.set_iter_mesh(mesh,
+                             mesh_shift,
+                             is_time_reversal=t_symmetry,
+                             is_mesh_symmetry=q_symmetry,
+                             is_eigenvectors=settings.get_is_eigenvectors(),
+                             is_gamma_center=settings.get_is_gamma_center())
+    else:
+        phonon.set_mesh(mesh,
+                        mesh_shift,
+                        is_time_reversal=t_symmetry,
+                        is_mesh_symmetry=q_symmetry,
+                        is_eigenvectors=settings.get_is_eigenvectors(),
+                        is_gamma_center=settings.get_is_gamma_center(),
+                        run_immediately=False)
+        weights = phonon.get_mesh()[1]
+        if log_level > 0:
+            if q_symmetry:
+                print("Number of irreducible q-points on sampling mesh: "
+                      "%d/%d" % (weights.shape[0], np.prod(mesh)))
+            else:
+                print("Number of q-points on sampling mesh: %d" %
+                      weights.shape[0])
+            print("Calculating phonons on sampling mesh...")
+
+        if is_chunked:
+            run_chunked_mesh(phonon, settings, observables, log_level=log_level)
+            return None
+        if is_frequency_only:
+            return run_frequency_mesh(phonon,
+                                      settings,
+                                      observables,
+                                      log_level=log_level)
+
+        t_mesh = time.time()
+        with stage('mesh'):
+            phonon.run_mesh()
+        t_mesh = time.time() - t_mesh
+
+        if settings.get_write_mesh():
+            with stage('write_mesh'):
+                if (settings.get_is_hdf5() and
+                    not settings.get_is_group_velocity()):
+                    _write_hdf5_mesh(phonon, settings)
+                elif settings.get_is_hdf5():
+                    phonon.write_hdf5_mesh()
+                else:
+                    phonon.write_yaml_mesh()
+        mesh_data = phonon.get_mesh()
+
+    for observable in observables:
+        if observable == 'tprop':
+            _run_thermal_properties(phonon, settings, log_level=log_level)
+        elif observable == 'tdisp':
+            _run_thermal_displacements(phonon, settings, log_level=log_level)
+        elif observable == 'tdispmat':
+            _run_thermal_displacement_matrices(phonon,
+                                               settings,
+                                               log_level=log_level)
+        elif observable == 'tdistance':
+            _run_thermal_distances(phonon, settings, log_level=log_level)
+        elif observable == 'pdos':
+            _run_partial_dos(phonon, settings, log_level=log_level)
+        elif observable == 'dos':
+            _run_total_dos(phonon, settings, log_level=log_level)
+        elif observable == 'moment':
+            with stage('moment'):
+                run_moment(phonon, settings, log_level=log_level)
+
+    if (log_level > 0 and
+        mesh_data is not None and
+        len(observables) > 1):
+        print('')
+        print("Phonons on sampling mesh were calculated once for %d "
+              "observables (%s) in %.2f s;" %
+              (len(observables), ", ".join(observables), t_mesh))
+        print("at least %.2f s were saved compared to one run per "
+              "observable." % ((len(observables) - 1) * t_mesh))
+
+    return mesh_data
+
+def _write_hdf5_mesh(phonon, settings):
+    # mesh.hdf5 with the eigenvectors compressed as set in settings
+    from pwmat2phonopy.stream_writer import MeshHdf5Writer
+
+    qpoints, weights, frequencies, eigenvectors = phonon.get_mesh()
+    with MeshHdf5Writer(settings.get_mesh()[0],
+                        qpoints,
+                        weights,
+                        phonon.get_primitive(),
+                        is_eigenvectors=(eigenvectors is not None),
+                        compression=settings.get_hdf5_compression(),
+                        is_float32=settings.get_hdf5_float32()) as w:
+        w.write(frequencies, eigenvectors)
+
+def _check_frequency_only_mesh(settings, observables):
+    # Returns why the observables need more than the frequencies of the
+    # irreducible q-points, None if they do not.
+    for observable in observables:
+        if observable not in ('tprop', 'dos'):
+            return "%s needs phonons of all q-points at once" % observable
+    if 'tprop' in observables:
+        if settings.get_is_projected_thermal_properties():
+            return "projected thermal properties need eigenvectors"
+    if 'dos' in observables:
+        if settings.get_is_tetrahedron_method():
+            return "tetrahedron method needs phonons of all q-points at once"
+    if settings.get_is_group_velocity():
+        return "group velocities are calculated with the mesh"
+    if (settings.get_run_mode() == 'band_mesh' and
+        settings.get_is_graph_plot()):
+        return "band structure and DOS are plotted together"
+    return None
+
+def _check_chunked_mesh(settings, observables):
+    # Returns why the mesh can not be solved in chunks, None if it can.
+    reason = _check_frequency_only_mesh(settings, observables)
+    if reason is not None:
+        return reason
+    if 'dos' in observables:
+        if settings.get_fits_Debye_model():
+            return "Debye model is not fitted to the DOS summed up in chunks"
+        if settings.get_sigma() is not None:
+            try:
+                float(settings.get_sigma())
+            except TypeError:
+                return "DOS is summed up with one SIGMA only"
+    return None
+
+def run_frequency_mesh(phonon, settings, observables, log_level=0):
+    """Phonons on sampling mesh without eigenvectors
+
+    Used when only thermal properties and total DOS are calculated. The
+    dynamical matrices are solved in batches for eigenvalues only, and
+    the thermal properties and total DOS are those of
+    ThermalPropertiesGrid and phonopy's TotalDos. Returns the mesh data
+    ordered as Phonopy.get_mesh() with None in place of the eigenvectors.
+
+    """
+    from pwmat2phonopy.mesh_chunks import get_frequencies
+
+    qpoints, weights = phonon.get_mesh()[:2]
+    with stage('mesh'):
+        frequencies, _ = get_frequencies(phonon.get_dynamical_matrix(),
+                                         qpoints,
+                                         phonon.get_unit_conversion_factor())
+
+    if settings.get_write_mesh():
+        from pwmat2phonopy.stream_writer import MeshYamlWriter, MeshHdf5Writer
+        if settings.get_is_hdf5():
+            writer_class = MeshHdf5Writer
+        else:
+            writer_class = MeshYamlWriter
+        with stage('write_mesh'):
+            with writer_class(settings.get_mesh()[0],
+                              qpoints,
+                              weights,
+                              phonon.get_primitive()) as w:
+                w.write(frequencies)
+
+    for observable in observables:
+        if observable == 'tprop':
+            _run_frequency_thermal_properties(frequencies,
+                                              weights,
+                                              settings,
+                                              log_level=log_level)
+        elif observable == 'dos':
+            _run_frequency_total_dos(frequencies,
+                                     weights,
+                                     phonon.get_primitive(),
+                                     settings,
+                                     log_level=log_level)
+
+    return qpoints, weights, frequencies, None
+
+def _run_frequency_thermal_properties(frequencies,
+                                      weights,
+                                      settings,
+                                      log_level=0):
+    # Thermal properties of all temperatures at once by
+    # ThermalPropertiesGrid, same thermal_properties.yaml as phonopy.
+    from pwmat2phonopy.mesh_chunks import get_temperatures
+    from pwmat2phonopy.thermal_properties import (ThermalPropertiesGrid,
+                                                  get_binary_filename)
+
+    if log_level > 0:
+        print("Calculating thermal properties...")
+    tprop_range = settings.get_thermal_property_range()
+    with stage('thermal_properties'):
+        tp = ThermalPropertiesGrid(
+            frequencies,
+            weights=weights,
+            band_indices=settings.get_band_indices(),
+            cutoff_frequency=settings.get_cutoff_frequency(),
+            pretend_real=settings.get_pretend_real())
+        tp.run(get_temperatures(t_min=tprop_range['min'],
+                                t_max=tprop_range['max'],
+                                t_step=tprop_range['step']))
+    with stage('write_thermal_properties'):
+        tp.write_yaml()
+        tp.write_hdf5(get_binary_filename())
+
+    if log_level > 0:
+        _print_thermal_properties(*tp.get_thermal_properties())
+
+    if settings.get_is_graph_plot():
+        with stage('plot'):
+            plot = _plot_thermal_properties(*tp.get_thermal_properties())
+            _show_plot(plot, settings, 'thermal_properties.pdf')
+
+class _FrequencyMesh(object):
+    # What phonopy's TotalDos takes from a Mesh without tetrahedron method
+    def __init__(self, frequencies, weights):
+        self._frequencies = frequencies
+        self._weights = weights
+
+    def get_frequencies(self):
+        return self._frequencies
+
+    def get_weights(self):
+        return self._weights
+
+def _run_frequency_total_dos(frequencies,
+                             weights,
+                             primitive,
+                             settings,
+                             log_level=0):
+    from phonopy.phonon.dos import TotalDos
+
+    if log_level > 0:
+        print("Calculating DOS...")
+
+    dos_range = settings.get_dos_range()
+    with stage('total_dos'):
+        total_dos = TotalDos(_FrequencyMesh(frequencies, weights),
+                             sigma=settings.get_sigma())
+        total_dos.set_draw_area(dos_range['min'],
+                                dos_range['max'],
+                                dos_range['step'])
+        total_dos.run()
+
+    if settings.get_fits_Debye_model():
+        with stage('Debye_model'):
+            total_dos.set_Debye_frequency(primitive.get_number_of_atoms())
+        if log_level > 0:
+            print("Debye frequency: %10.5f" % total_dos.get_Debye_frequency())
+    with stage('write_total_dos'):
+        total_dos.write()
+
+    if (settings.get_is_graph_plot() and
+        settings.get_run_mode() != 'band_mesh'):
+        with stage('plot'):
+            plt, ax = _get_pyplot()
+            total_dos.plot(plt, draw_grid=False)
+            ax.set_ylim((0, None))
+            _show_plot(plt, settings, 'total_dos.pdf')
+
+def _print_thermal_properties(temps, fe, entropy, heat_capacity):
+    import numpy as np
+
+    print("#%11s %15s%15s%15s%15s" % ('T [K]',
+                                      'F [kJ/mol]',
+                                      'S [J/K/mol]',
+                                      'C_v [J/K/mol]',
+                                      'E [kJ/mol]'))
+    table = np.column_stack((temps, fe, entropy, heat_capacity,
+                             fe + temps * entropy / 1000))
+    print("\n".join([("%12.3f " + "%15.7f" * 4) % tuple(row)
+                     for row in table]))
+
+def _get_pyplot():
+    # Axes as those of the plots of Phonopy
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots()
+    ax.xaxis.set_ticks_position('both')
+    ax.yaxis.set_ticks_position('both')
+    ax.xaxis.set_tick_params(which='both', direction='in')
+    ax.yaxis.set_tick_params(which='both', direction='in')
+    return plt, ax
+
+def _plot_thermal_properties(temps, fe, entropy, heat_capacity):
+    # Same plot as Phonopy.plot_thermal_properties
+    plt, ax = _get_pyplot()
+
+    plt.plot(temps, fe, 'r-')
+    plt.plot(temps, entropy, 'b-')
+    plt.plot(temps, heat_capacity, 'g-')
+    plt.legend(('Free energy [kJ/mol]', 'Entropy [J/K/mol]',
+                r'C$_\mathrm{V}$ [J/K/mol]'),
+               loc='best')
+    plt.grid(True)
+    plt.xlabel('Temperature [K]')
+    ax.set_xlim((0, temps[-1]))
+    return plt
+
+def _plot_total_dos(frequency_points, total_dos):
+    # Same plot as Phonopy.plot_total_DOS
+    from phonopy.phonon.dos import plot_total_dos
+
+    plt, ax = _get_pyplot()
+    plot_total_dos(plt,
+                   frequency_points,
+                   total_dos,
+                   xlabel='Frequency',
+                   ylabel='Density of states',
+                   draw_grid=False)
+    ax.set_ylim((0, None))
+    return plt
+
+def run_chunked_mesh(phonon, settings, observables, log_level=0):
+    """Phonons on sampling mesh solved in chunks of q-points
+
+    The irreducible q-points of the mesh set by Phonopy.set_mesh are
+    solved in chunks of MESH_CHUNK q-points across MESH_JOBS worker
+    processes, each with OMP_NUM_THREADS (or one) BLAS threads (default:
+    number of cores / BLAS threads). Total DOS and thermal properties
+    are summed up chunk by chunk and mesh.yaml or mesh.hdf5 is written
+    chunk by chunk when WRITE_MESH is on, so that
+    frequencies and eigenvectors of all q-points are never held in
+    memory together. Returns a dictionary of the results keyed by the
+    observable.
+
+    """
+    from pwmat2phonopy.batch import get_blas_threads, get_num_workers
+    from pwmat2phonopy.mesh_chunks import (ChunkedMesh, TotalDosSum,
+                                           ThermalPropertiesSum,
+                                           get_temperatures)
+    from pwmat2phonopy.thermal_properties import get_binary_filename
+
+    mesh = settings.get_mesh()[0]
+    qpoints, weights = phonon.get_mesh()[:2]
+    chunk_size = settings.get_mesh_chunk_size()
+    num_chunks = -(-len(qpoints) // chunk_size)
+    blas_threads = get_blas_threads()
+    num_workers = get_num_workers(num_chunks,
+                                  blas_threads,
+                                  settings.get_mesh_num_workers())
+    is_eigenvectors = (settings.get_write_mesh() and
+                       settings.get_is_eigenvectors())
+    chunks = ChunkedMesh(phonon.get_dynamical_matrix(),
+                         qpoints,
+                         phonon.get_unit_conversion_factor(),
+                         chunk_size=chunk_size,
+                         num_workers=num_workers,
+                         is_eigenvectors=is_eigenvectors,
+                         blas_threads=blas_threads)
+    if log_level > 0:
+        print("Sampling mesh is solved in %d chunks of %d q-points by %d "
+              "processes." % (chunks.get_number_of_chunks(),
+                              chunk_size,
+                              chunks.get_number_of_workers()))
+
+    dos_sum = None
+    tp_sum = None
+    if 'dos' in observables:
+        dos_sum = TotalDosSum(sigma=settings.get_sigma())
+    if 'tprop' in observables:
+        tprop_range = settings.get_thermal_property_range()
+        tp_sum = ThermalPropertiesSum(
+            get_temperatures(t_min=tprop_range['min'],
+                             t_max=tprop_range['max'],
+                             t_step=tprop_range['step']),
+            band_indices=settings.get_band_indices(),
+            cutoff_frequency=settings.get_cutoff_frequency(),
+            pretend_real=settings.get_pretend_real())
+
+    writer = None
+    if settings.get_write_mesh():
+        from pwmat2phonopy.stream_writer import MeshYamlWriter, MeshHdf5Writer
+        if settings.get_is_hdf5():
+            writer = MeshHdf5Writer(
+                mesh,
+                qpoints,
+                weights,
+                phonon.get_primitive(),
+                is_eigenvectors=is_eigenvectors,
+                compression=settings.get_hdf5_compression(),
+                is_float32=settings.get_hdf5_float32())
+        else:
+            writer = MeshYamlWriter(mesh,
+                                    qpoints,
+                                    weights,
+                                    phonon.get_primitive(),
+                                    is_eigenvectors=is_eigenvectors)
+
+    try:
+        with stage('mesh'):
+            for start, frequencies, eigenvectors in chunks:
+                w = weights[start:start + len(frequencies)]
+                if dos_sum is not None:
+                    dos_sum.add(frequencies, w)
+                if tp_sum is not None:
+                    tp_sum.add(frequencies, w)
+                if writer is not None:
+                    writer.write(frequencies, eigenvectors)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    results = {}
+    if tp_sum is not None:
+        if log_level > 0:
+            print("Calculating thermal properties...")
+        with stage('write_thermal_properties'):
+            tp_sum.write_yaml()
+            tp_sum.write_hdf5(get_binary_filename())
+        temps, fe, entropy, heat_capacity = tp_sum.get_thermal_properties()
+        results['tprop'] = (temps, fe, entropy, heat_capacity)
+        if log_level > 0:
+            _print_thermal_properties(temps, fe, entropy, heat_capacity)
+        if settings.get_is_graph_plot():
+            with stage('plot'):
+                plot = _plot_thermal_properties(temps,
+                                                fe,
+                                                entropy,
+                                                heat_capacity)
+                _show_plot(plot, settings, 'thermal_properties.pdf')
+
+    if dos_sum is not None:
+        if log_level > 0:
+            print("Calculating DOS...")
+        dos_range = settings.get_dos_range()
+        frequency_points, total_dos = dos_sum.get_dos(
+            freq_min=dos_range['min'],
+            freq_max=dos_range['max'],
+            freq_pitch=dos_range['step'])
+        with stage('write_total_dos'):
+            dos_sum.write(frequency_points, total_dos)
+        results['dos'] = (frequency_points, total_dos)
+        if (settings.get_is_graph_plot() and
+            settings.get_run_mode() != 'band_mesh'):
+            with stage('plot'):
+                plot = _plot_total_dos(frequency_points, total_dos)
+                _show_plot(plot, settings, 'total_dos.pdf')
+
+    return results
+
+def _run_thermal_properties(phonon, settings, log_level=0):
+    if not settings.get_is_projected_thermal_properties():
+        _, weights, frequencies = phonon.get_mesh()[:3]
+        _run_frequency_thermal_properties(frequencies,
+                                          weights,
+                                          settings,
+                                          log_level=log_level)
+        return
+
+    if log_level > 0:
+        print("Calculating projected thermal properties...")
+    tprop_range = settings.get_thermal_property_range()
+    with stage('thermal_properties'):
+        phonon.set_thermal_properties(
+            tprop_range['step'],
+            tprop_range['max'],
+            tprop_range['min'],
+            is_projection=True,
+            band_indices=settings.get_band_indices(),
+            cutoff_frequency=settings.get_cutoff_frequency(),
+            pretend_real=settings.get_pretend_real())
+    with stage('write_thermal_properties'):
+        phonon.write_yaml_thermal_properties()
+
+    if log_level > 0:
+        _print_thermal_properties(*phonon.get_thermal_properties())
+
+    if settings.get_is_graph_plot():
+        with stage('plot'):
+            plot = phonon.plot_thermal_properties()
+            _show_plot(plot, settings, 'thermal_properties.pdf')
+
+def _run_thermal_displacements(phonon, settings, log_level=0):
+    p_direction = settings.get_projection_direction()
+    if log_level > 0 and p_direction is not None:
+        _print_projection_direction(p_direction, phonon.get_primitive())
+    if log_level > 0:
+        print("Calculating thermal displacements...")
+    tprop_range = settings.get_thermal_property_range()
+    with stage('thermal_displacements'):
+        phonon.set_thermal_displacements(
+            tprop_range['step'],
+            tprop_range['max'],
+            tprop_range['min'],
+            direction=p_direction,
+            cutoff_frequency=settings.get_cutoff_frequency())
+    with stage('write_thermal_displacements'):
+        phonon.write_yaml_thermal_displacements()
+
+    if settings.get_is_graph_plot():
+        with stage('plot'):
+            plot = phonon.plot_thermal_displacements(settings.get_is_legend())
+            _show_plot(plot, settings, 'thermal_displacement.pdf')
+
+def _run_thermal_displacement_matrices(phonon, settings, log_level=0):
+    if log_level > 0:
+        print("Calculating thermal displacement matrices...")
+    tprop_range = settings.get_thermal_property_range()
+    t_cif = settings.get_thermal_displacement_matrix_temperature()
+    with stage('thermal_displacement_matrices'):
+        phonon.set_thermal_displacement_matrices(
+            t_step=tprop_range['step'],
+            t_max=tprop_range['max'],
+            t_min=tprop_range['min'],
+            cutoff_frequency=settings.get_cutoff_frequency(),
+            t_cif=t_cif)
+    with stage('write_thermal_displacement_matrices'):
+        phonon.write_yaml_thermal_displacement_matrices()
+        if t_cif is not None:
+            phonon.write_thermal_displacement_matrix_to_cif(0)
+
+def _run_thermal_distances(phonon, settings, log_level=0):
+    if log_level > 0:
+        print("Calculating thermal distances...")
+    tprop_range = settings.get_thermal_property_range()
+    with stage('thermal_distances'):
+        phonon.set_thermal_distances(
+            settings.get_thermal_atom_pairs(),
+            tprop_range['step'],
+            tprop_range['max'],
+            tprop_range['min'],
+            cutoff_frequency=settings.get_cutoff_frequency())
+    with stage('write_thermal_distances'):
+        phonon.write_yaml_thermal_distances()
+
+def _run_partial_dos(phonon, settings, log_level=0):
+    import numpy as np
+
+    primitive = phonon.get_primitive()
+    p_direction = settings.get_projection_direction()
+    if (log_level > 0 and
+        p_direction is not None and
+        not settings.get_xyz_projection()):
+        _print_projection_direction(p_direction, primitive)
+    if log_level > 0:
+        print("Calculating partial PDOS...")
+    dos_range = settings.get_dos_range()
+    with stage('partial_dos'):
+        phonon.set_partial_DOS(
+            sigma=settings.get_sigma(),
+            freq_min=dos_range['min'],
+            freq_max=dos_range['max'],
+            freq_pitch=dos_range['step'],
+            tetrahedron_method=settings.get_is_tetrahedron_method(),
+            direction=p_direction,
+            xyz_projection=settings.get_xyz_projection())
+    with stage('write_partial_dos'):
+        phonon.write_partial_DOS()
+
+    if (settings.get_is_graph_plot() and
+        settings.get_run_mode() != 'band_mesh'):
+        pdos_indices = _get_pdos_indices(settings, primitive)
+        with stage('plot'):
+            plot = phonon.plot_partial_DOS(
+                pdos_indices=pdos_indices,
+                legend=([np.array(x) + 1 for x in pdos_indices]))
+            _show_plot(plot, settings, 'partial_dos.pdf')
+
+def _run_total_dos(phonon, settings, log_level=0):
+    dos_range = settings.get_dos_range()
+
+    with stage('total_dos'):
+        phonon.set_total_DOS(
+            sigma=settings.get_sigma(),
+            freq_min=dos_range['min'],
+            freq_max=dos_range['max'],
+            freq_pitch=dos_range['step'],
+            tetrahedron_method=settings.get_is_tetrahedron_method())
+
+    if log_level > 0:
+        print("Calculating DOS...")
+
+    if settings.get_fits_Debye_model():
+        with stage('Debye_model'):
+            phonon.set_Debye_frequency()
+        if log_level > 0:
+            debye_freq = phonon.get_Debye_frequency()
+            print("Debye frequency: %10.5f" % debye_freq)
+    with stage('write_total_dos'):
+        phonon.write_total_DOS()
+
+    if (settings.get_is_graph_plot() and
+        settings.get_run_mode() != 'band_mesh'):
+        with stage('plot'):
+            plot = phonon.plot_total_DOS()
+            _show_plot(plot, settings, 'total_dos.pdf')
+
+def run_moment(phonon, settings, log_level=0):
+    dos_range = settings.get_dos_range()
+    freq_min = dos_range['min']
+    freq_max = dos_range['max']
+    if log_level > 0:
+        text = "Calculating moment of phonon states distribution"
+        if freq_min is None and freq_max is None:
+            text += "..."
+        elif freq_min is None and freq_max is not None:
+            text += "\nbelow frequency %.3f..." % freq_max
+        elif freq_min is not None and freq_max is None:
+            text += "\nabove frequency %.3f..." % freq_min
+        elif freq_min is not None and freq_max is not None:
+            text += ("\nbetween frequencies %.3f and %.3f..." %
+                     (freq_min, freq_max))
+        print(text)
+        print('')
+    print("Order|   Total   |   Projected to atoms")
+
+    if settings.get_moment_order() is not None:
+        orders = [settings.get_moment_order()]
+    else:
+        orders = range(3)
+
+    moments = []
+    for order in orders:
+        phonon.set_moment(order=order,
+                          freq_min=freq_min,
+                          freq_max=freq_max,
+                          is_projection=False)
+        total_moment = phonon.get_moment()
+        phonon.set_moment(order=order,
+                          freq_min=freq_min,
+                          freq_max=freq_max,
+                          is_projection=True)
+        projected_moment = phonon.get_moment()
+        text = " %3d |%10.5f | " % (order, total_moment)
+        for m in projected_moment:
+            text += "%10.5f " % m
+        print(text)
+        moments.append((order, total_moment, projected_moment))
+
+    return moments
+
+def plot_band_mesh(phonon, settings):
+    if settings.get_pdos_indices() is not None:
+        plot = phonon.plot_band_structure_and_dos(
+            pdos_indices=_get_pdos_indices(settings, phonon.get_primitive()),
+            labels=settings.get_band_labels())
+    else:
+        plot = phonon.plot_band_structure_and_dos(
+            labels=settings.get_band_labels())
+    _show_plot(plot, settings, 'band_dos.pdf')
+
+def run_anime(phonon, settings, log_level=0):
+    anime_type = settings.get_anime_type()
+    amplitude = settings.get_anime_amplitude()
+    if anime_type == "v_sim":
+        q_point = settings.get_anime_qpoint()
+        phonon.write_animation(q_point=q_point,
+                               anime_type='v_sim',
+                               amplitude=amplitude)
+        if log_level > 0:
+            print("Animation type: v_sim")
+            print("q-point: [%6.3f %6.3f %6.3f]" % tuple(q_point))
+    else:
+        band_index = settings.get_anime_band_index()
+        division = settings.get_anime_division()
+        shift = settings.get_anime_shift()
+        phonon.write_animation(anime_type=anime_type,
+                               band_index=band_index,
+                               amplitude=amplitude,
+                               num_div=division,
+                               shift=shift)
+
+        if log_level > 0:
+            print("Animation type: %s" % anime_type)
+            print("amplitude: %f" % amplitude)
+            if anime_type != "jmol":
+                print("band index: %d" % band_index)
+                print("Number of images: %d" % division)
+
+def run_modulation(phonon, settings, log_level=0):
+    mod_setting = settings.get_modulation()
+    phonon_modes = mod_setting['modulations']
+    dimension = mod_setting['dimension']
+    if 'delta_q' in mod_setting:
+        delta_q = mod_setting['delta_q']
+    else:
+        delta_q = None
+    derivative_order = mod_setting['order']
+
+    phonon.set_modulations(dimension,
+                           phonon_modes,
+                           delta_q=delta_q,
+                           derivative_order=derivative_order,
+                           nac_q_direction=settings.get_nac_q_direction())
+    phonon.write_modulations()
+    phonon.write_yaml_modulations()
+
+def run_irreps(phonon, settings, log_level=0):
+    if phonon.set_irreps(settings.get_irreps_q_point(),
+                         is_little_cogroup=settings.get_is_little_cogroup(),
+                         nac_q_direction=settings.get_nac_q_direction(),
+                         degeneracy_tolerance=settings.get_irreps_tolerance()):
+        show_irreps = settings.get_show_irreps()
+        phonon.show_irreps(show_irreps)
+        phonon.write_yaml_irreps(show_irreps)
+        return True
+    return False
+
+def run_phonon_calculations(phonon, settings, log_level=0):
+    """Run the calculation selected by settings.get_run_mode()
+
+    Returns a dictionary of the results keyed by the calculation.
+
+    """
+    run_mode = settings.get_run_mode()
+    results = {}
+
+    # matplotlib is only loaded when something is going to be plotted.
+    if settings.get_is_graph_plot() and settings.get_is_graph_save():
+        import matplotlib
+        matplotlib.use('pdf')
+
+    if run_mode == 'qpoints':
+        results['qpoints'] = run_qpoints(phonon, settings, log_level=log_level)
+
+    elif run_mode == 'band' or run_mode == 'mesh' or run_mode == 'band_mesh':
+        if run_mode == 'band' or run_mode == 'band_mesh':
+            results['band'] = run_band(phonon, settings, log_level=log_level)
+        if run_mode == 'mesh' or run_mode == 'band_mesh':
+            results['mesh'] = run_mesh(phonon, settings, log_level=log_level)
+        if (run_mode == 'band_mesh' and
+            settings.get_is_graph_plot() and
+            not settings.get_is_thermal_properties() and
+            not settings.get_is_thermal_displacements() and
+            not settings.get_is_thermal_displacement_matrices() and
+            not settings.get_is_thermal_distances()):
+            with stage('plot'):
+                plot_band_mesh(phonon, settings)
+
+    elif run_mode == 'anime':
+        with stage('anime'):
+            run_anime(phonon, settings, log_level=log_level)
+
+    elif run_mode == 'modulation':
+        with stage('modulation'):
+            run_modulation(phonon, settings, log_level=log_level)
+
+    elif run_mode == 'irreps':
+        with stage('irreps'):
+            results['irreps'] = run_irreps(phonon, settings,
+                                           log_level=log_level)
+
+    else:
+        print("-" * 76)
+        print(" One of the following run modes may be specified for phonon "
+              "calculations.")
+        for mode in ['Mesh sampling (MP, --mesh)',
+                     'Q-points (QPOINTS, --qpoints)',
+                     'Band structure (BAND, --band)',
+                     'Animation (ANIME, --anime)',
+                     'Modulation (MODULATION, --modulation)',
+                     'Characters of Irreps (IRREPS, --irreps)',
+                     'Create displacements (-d)']:
+            print(" - %s" % mode)
+        print("-" * 76)
+
+    return results
+
+def write_phonopy_yaml(phonon,
+                       settings,
+                       confs=None,
+                       filename="phonopy.yaml"):
+    from phonopy.interface.phonopy_yaml import PhonopyYaml
+
+    phpy_yaml = PhonopyYaml(configuration=confs,
+                            calculator=settings.get_calculator())
+    phpy_yaml.set_phonon_info(phonon)
+    with open(filename, 'w') as w:
+        w.write(str(phpy_yaml))
+
+############
+# Workflow #
+############
+def load_phonopy(settings, log_level=0):
+    """Phonopy object with force constants in the current directory
+
+    The unit cell, FORCE_SETS (or FORCE_CONSTANTS, force_constants.hdf5)
+    and BORN with non-analytical term correction are read as by
+    run_phonopy, but no phonon calculation is run.
+
+    """
+    with stage('read_cell'):
+        unitcell, optional_structure_file_information = read_cell(settings)
+    unitcell_filename = optional_structure_file_information[0]
+    if settings.get_supercell_matrix() is None:
+        raise DriverError("Supercell matrix (DIM or --dim) is not found.")
+    force_constants, force_sets = _read_forces(settings,
+                                               unitcell,
+                                               unitcell_filename,
+                                               log_level=log_level)
+    with stage('init_phonopy'):
+        phonon = init_phonopy(unitcell, settings, log_level=log_level)
+    show_phonopy_info(phonon, settings, unitcell_filename, log_level=log_level)
+    _set_forces(phonon,
+                settings,
+                force_constants=force_constants,
+                force_sets=force_sets,
+                log_level=log_level)
+    return phonon
+
+def _read_forces(settings, unitcell, unitcell_filename, log_level=0):
+    # Read FORCE_SETS, FORCE_CONSTANTS, or force_constants.hdf5
+    from phonopy.structure.cells import determinant
+
+    force_constants = None
+    force_sets = None
+    num_satom = (determinant(settings.get_supercell_matrix()) *
+                 unitcell.get_number_of_atoms())
+    if settings.get_is_force_constants() == 'read':
+        with stage('read_force_constants'):
+            force_constants, fc_filename = read_force_constants(
+                settings, num_satom, unitcell_filename)
+        if log_level > 0:
+            print("Force constants are read from %s." % fc_filename)
+    else:
+        with stage('read_force_sets'):
+            force_sets = read_force_sets(num_satom, unitcell_filename)
+    return force_constants, force_sets
+
+def _set_forces(phonon,
+                settings,
+                force_constants=None,
+                force_sets=None,
+                log_level=0):
+    set_force_constants(phonon,
+                        settings,
+                        force_constants=force_constants,
+                        force_sets=force_sets,
+                        log_level=log_level)
+    if settings.get_is_nac():
+        with stage('nac'):
+            set_nac(phonon, settings, log_level=log_level)
+    check_masses(phonon.get_primitive())
+
+def run_phonopy(settings, confs=None, log_level=0):
+    """Displacement generation or phonon calculation in one call
+
+    This is what PWmat2Phonopy does after parsing the command line, except
+    for the integrated helper tools (-f, --fc, --symmetry). Returns the
+    Phonopy object and a dictionary of the results.
+
+    """
+    with stage('read_cell'):
+        unitcell, optional_structure_file_information = read_cell(settings)
+    unitcell_filename = optional_structure_file_information[0]
+    run_mode = settings.get_run_mode()
+
+    if settings.get_supercell_matrix() is None:
+        raise DriverError("Supercell matrix (DIM or --dim) is not found.")
+
+    force_constants = None
+    force_sets = None
+    if run_mode != 'displacements':
+        force_constants, force_sets = _read_forces(settings,
+                                                   unitcell,
+                                                   unitcell_filename,
+                                                   log_level=log_level)
+
+    # Supercell, primitive cell and their symmetry
+    with stage('init_phonopy'):
+        phonon = init_phonopy(unitcell, settings, log_level=log_level)
+    show_phonopy_info(phonon, settings, unitcell_filename, log_level=log_level)
+
+    if run_mode == 'displacements':
+        with stage('displacements'):
+            displacements = create_displacements(
+                phonon,
+                settings,
+                optional_structure_file_information,
+                log_level=log_level)
+        if log_level > 0:
+            with stage('write_phonopy_yaml'):
+                write_phonopy_yaml(phonon,
+                                   settings,
+                                   confs=confs,
+                                   filename="phonon/phonopy_disp.yaml")
+        return phonon, {'displacements': displacements}
+
+    _set_forces(phonon,
+                settings,
+                force_constants=force_constants,
+                force_sets=force_sets,
+                log_level=log_level)
+
+    # Group velocity
+    if settings.get_is_group_velocity():
+        with stage('group_velocity'):
+            phonon.set_group_velocity(
+                q_length=settings.get_group_velocity_delta_q())
+
+    results = run_phonon_calculations(phonon, settings, log_level=log_level)
+    if log_level > 0:
+        with stage('write_phonopy_yaml'):
+            write_phonopy_yaml(phonon, settings, confs=confs)
+
+    return phonon, results
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+"""Dynamical matrices of many q-points at once
+
+phonopy's DynamicalMatrix builds the dynamical matrix of one q-point at a
+time, with a phase factor for every shortest vector between an atom of
+the primitive cell and an atom of the supercell. A shortest vector from
+atom i to an image of atom j is (x_j - x_i) + n with n a lattice vector
+of the primitive cell, so
+
+    D_ij(q) = exp(2 pi i q.(x_j - x_i)) sum_n exp(2 pi i q.n) C_ij(n)
+
+where C(n) collects the force constants divided by the masses and by the
+multiplicities of the vectors. The lattice vectors n and C(n) are
+tabulated once. The dynamical matrices of a block of q-points are then
+one product of the phase table exp(2 pi i q.n) with C, done by BLAS.
+
+    dm_batch = get_dynamical_matrix_batch(phonon.get_dynamical_matrix())
+    batch_size = dm_batch.get_batch_size()
+    for i in range(0, len(qpoints), batch_size):
+        dms = dm_batch.get_dynamical_matrices(qpoints[i:i + batch_size])
+        frequencies, eigenvectors = solve_dynamical_matrices(dms, factor)
+
+"""
+
+import numpy as np
+
+__author__  = "Paul Chern"
+__email__   = "peng.chen.iphy@gmail.com"
+__licence__ = "GPL"
+__date__    = "Nov. 2017"
+
+def get_dynamical_matrix_batch(dynamical_matrix):
+    """DynamicalMatrixBatch of a phonopy DynamicalMatrix
+
+    Returns None with non-analytical term correction, whose matrices
+    depend on the q-point other than by the phase factors.
+
+    """
+    if dynamical_matrix.is_nac():
+        return None
+    primitive = dynamical_matrix.get_primitive()
+    smallest_vectors, multiplicity = dynamical_matrix.get_shortest_vectors()
+    return DynamicalMatrixBatch(
+        dynamical_matrix.get_force_constants(),
+        smallest_vectors,
+        multiplicity,
+        primitive.get_masses(),
+        dynamical_matrix.get_primitive_to_supercell_map(),
+        dynamical_matrix.get_supercell_to_primitive_map(),
+        decimals=dynamical_matrix.get_decimals())
+
+def solve_dynamical_matrices(dynamical_matrices,
+                             factor,
+                             is_eigenvectors=False):
+    """Frequencies (and eigenvectors) of stacked dynamical matrices
+
+    The matrices are solved by one call of numpy.linalg.eigvalsh, or eigh
+    with is_eigenvectors. Returns frequencies of shape
+    (num_qpoints, num_band) and eigenvectors of shape
+    (num_qpoints, num_band, num_band), or None.
+
+    """
+    if is_eigenvectors:
+        eigenvalues, eigenvectors = np.linalg.eigh(dynamical_matrices)
+    else:
+        eigenvalues = np.linalg.eigvalsh(dynamical_matrices)
+        eigenvectors = None
+    eigenvalues = eigenvalues.real
+    frequencies = np.array(np.sqrt(abs(eigenvalues)) * np.sign(eigenvalues),
+                           dtype='double', order='C') * factor
+    return frequencies, eigenvectors
+
+class DynamicalMatrixBatch(object):
+    """Dynamical matrices as phonopy's DynamicalMatrix for blocks of q-points
+
+    Args:
+        force_constants: Full supercell force constants of shape
+            (num_satom, num_satom, 3, 3).
+        smallest_vectors, multiplicity: Shortest vectors from the atoms of
+            the primitive cell to the atoms of the supercell in fractional
+            coordinates of the primitive cell, of shape
+            (num_satom, num_patom, 27, 3), and their numbers, of shape
+            (num_satom, num_patom), as Primitive.get_smallest_vectors().
+        masses: Masses of the atoms of the primitive cell.
+        p2s_map, s2p_map: Primitive to supercell and supercell to
+            primitive atom maps (supercell indices).
+        decimals: Matrix elements are rounded as by DynamicalMatrix.
+        symprec: Tolerance to take a vector minus the offset of its pair
+            of atoms as a lattice vector.
+
+    """
+    def __init__(self,
+                 force_constants,
+                 smallest_vectors,
+                 multiplicity,
+                 masses,
+                 p2s_map,
+                 s2p_map,
+                 decimals=None,
+                 symprec=1e-5):
+        force_constants = np.asarray(force_constants, dtype='double')
+        smallest_vectors = np.asarray(smallest_vectors, dtype='double')
+        p2s_map = np.array(p2s_map, dtype='intc')
+        s2p_map = np.array(s2p_map, dtype='intc')
+        multiplicity = np.array(multiplicity, dtype='intc')
+        masses = np.array(masses, dtype='double')
+        num_patom = len(p2s_map)
+        num_satom = len(s2p_map)
+        self._num_patom = num_patom
+        self._decimals = decimals
+
+        # Index in the primitive cell of every supercell atom
+        p_index = np.zeros(num_satom, dtype='intc')
+        for j, s_j in enumerate(p2s_map):
+            p_index[s2p_map == s_j] = j
+
+        # offsets[i, j] = x_j - x_i, taken from the first shortest vector
+        # from atom i to the supercell atom of j itself.
+        self._offsets = np.array(
+            smallest_vectors[p2s_map][:, :, 0].transpose(1, 0, 2),
+            dtype='double')
+
+        # All (k, i, l) with l < multiplicity[k, i]
+        k, i, l = np.nonzero(
+            np.arange(smallest_vectors.shape[2]) < multiplicity[:, :, None])
+        j = p_index[k]
+        vectors = smallest_vectors[k, i, l] - self._offsets[i, j]
+        lattice_points = np.rint(vectors)
+        is_lattice_point = (
+            np.abs(vectors - lattice_points) < symprec).all(axis=1)
+        vectors[is_lattice_point] = lattice_points[is_lattice_point]
+        self._lattice_points, n = np.unique(np.round(vectors, decimals=10),
+                                            axis=0,
+                                            return_inverse=True)
+        n = np.ravel(n)
+
+        # C[n, i, alpha, j, beta]
+        sqrt_mm = np.sqrt(masses[i] * masses[j])
+        coef = np.zeros((len(self._lattice_points),
+                         num_patom, num_patom, 3, 3), dtype='double')
+        np.add.at(coef,
+                  (n, i, j),
+                  force_constants[p2s_map[i], k] /
+                  (sqrt_mm * multiplicity[k, i])[:, None, None])
+        num_band = num_patom * 3
+        self._coef = np.array(
+            coef.transpose(0, 1, 3, 2, 4).reshape(-1, num_band * num_band),
+            dtype='double', order='C')
+
+    def get_dimension(self):
+        return self._num_patom * 3
+
+    def get_number_of_lattice_points(self):
+        return len(self._lattice_points)
+
+    def get_batch_size(self, max_bytes=2 ** 26):
+        """Number of q-points whose matrices and phases fit in max_bytes"""
+        num_band = self._num_patom * 3
+        return max(1, max_bytes // ((num_band * num_band +
+                                     len(self._lattice_points)) * 16))
+
+    def get_dynamical_matrices(self, qpoints):
+        """Dynamical matrices of shape (num_qpoints, num_band, num_band)
+
+        All q-points are done at once, so the memory is that of the
+        returned matrices plus the phase table of shape
+        (num_qpoints, num_lattice_points). Large sets of q-points are
+        given block by block.
+
+        """
+        qpoints = np.reshape(qpoints, (-1, 3))
+        num_patom = self._num_patom
+        num_band = num_patom * 3
+
+        arg = 2 * np.pi * np.dot(qpoints, self._lattice_points.T)
+        dms = np.empty((len(qpoints), num_band * num_band), dtype='c16')
+        dms.real = np.dot(np.cos(arg), self._coef)
+        dms.imag = np.dot(np.sin(arg), self._coef)
+        dms = dms.reshape(-1, num_patom, 3, num_patom, 3)
+        dms *= np.exp(2j * np.pi * np.dot(
+            qpoints, self._offsets.reshape(-1, 3).T)).reshape(
+                -1, num_patom, 1, num_patom, 1)
+        dms = dms.reshape(-1, num_band, num_band)
+
+        # Impose Hermitian condition
+        dms = (dms + dms.conj().transpose(0, 2, 1)) / 2
+        if self._decimals is None:
+            return dms
+        else:
+            return dms.round(decimals=self._decimals)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+"""Harmonic force constants fitted to displacements and forces
+
+The force constants of the symmetry-independent atoms of a supercell are
+solved by least squares from any number of supercell configurations,
+e.g. frames of a PWmat MD run (MOVEMENT) or supercells with all atoms
+displaced randomly (get_random_displacements):
+
+    F_i = - sum_j Phi(i, j) u_j
+
+Every configuration is used through all space group operations of the
+supercell, so that each one gives data for every independent atom, and
+the fitted force constants obey the symmetry. Configurations are added
+in batches, whose normal equations are accumulated, so the memory does
+not depend on the number of configurations. The force constants of the
+other atoms are then obtained by the symmetry operations.
+
+    fit = ForceConstantsFit(lattice, positions, rotations, translations)
+    for displacements, forces in batches:
+        fit.add(displacements, forces)
+    force_constants = fit.solve()
+
+"""
+
+import numpy as np
+
+__author__  = "Paul Chern"
+__email__   = "peng.chen.iphy@gmail.com"
+__licence__ = "GPL"
+__date__    = "Nov. 2017"
+
+def get_random_displacements(num_supercells, num_atom, distance, seed=None):
+    """Cartesian displacements of all atoms in random directions
+
+    Every atom of every supercell is displaced by distance. Returns an
+    array of shape (num_supercells, num_atom, 3).
+
+    """
+    rng = np.random.RandomState(seed)
+    displacements = rng.normal(size=(num_supercells, num_atom, 3))
+    displacements *= distance / np.sqrt(
+        (displacements ** 2).sum(axis=2))[:, :, None]
+    return displacements
+
+def get_displacements(reference_positions, positions, lattice):
+    """Cartesian displacements from reference positions
+
+    Positions are fractional, of shape (..., num_atom, 3), and lattice
+    vectors are rows. Differences are wrapped to the nearest image.
+
+    """
+    diff = np.asarray(positions, dtype='double') - reference_positions
+    diff -= np.rint(diff)
+    return np.dot(diff, lattice)
+
+def get_atom_mapping(reference_positions, positions, lattice, tolerance=1.0):
+    """Order of atoms of positions to follow reference_positions
+
+    Returns mapping with positions[mapping[i]] closest to
+    reference_positions[i]. ValueError is raised if an atom is not
+    within tolerance (Angstrom) or two atoms are mapped to the same one.
+
+    """
+    reference_positions = np.asarray(reference_positions, dtype='double')
+    positions = np.asarray(positions, dtype='double')
+    mapping = np.zeros(len(reference_positions), dtype='intc')
+    for i, x in enumerate(reference_positions):
+        d = get_displacements(x, positions, lattice)
+        dist2 = (d ** 2).sum(axis=1)
+        j = dist2.argmin()
+        if dist2[j] > tolerance ** 2:
+            raise ValueError("Atom %d is further than %s Angstrom from any "
+                             "atom of the reference structure." %
+                             (i + 1, tolerance))
+        mapping[i] = j
+    if len(np.unique(mapping)) != len(mapping):
+        raise ValueError("Atoms could not be mapped one-to-one onto the "
+                         "reference structure.")
+    return mapping
+
+class ForceConstantsFit(object):
+    """Least squares fit of supercell force constants
+
+    Args:
+        lattice: Lattice vectors of the supercell as rows.
+        positions: Fractional positions of the atoms of the supercell
+            at equilibrium.
+        rotations, translations: Space group operations of the supercell
+            (fractional), e.g. from phonopy's Symmetry.
+        symprec: Tolerance to map atoms by the operations.
+        max_elements: Bound of the number of elements of the design
+            matrix of a batch. Larger batches are split.
+
+    """
+    def __init__(self,
+                 lattice,
+                 positions,
+                 rotations,
+                 translations,
+                 symprec=1e-5,
+                 max_elements=2 ** 24):
+        from pwmat2phonopy.interface.pwmat import (get_atom_permutations,
+                                                   get_cartesian_rotations)
+
+        self._lattice = np.array(lattice, dtype='double')
+        self._num_atom = len(positions)
+        self._max_elements = max_elements
+
+        # perms[n, i] = j: operation n maps atom j onto atom i.
+        # images[n, j] = i is its inverse.
+        perms = get_atom_permutations(positions,
+                                      rotations,
+                                      translations,
+                                      self._lattice,
+                                      symprec=symprec)
+        self._images = np.argsort(perms, axis=1)
+        self._r_carts = get_cartesian_rotations(rotations, self._lattice)
+        self._independent_atoms = np.unique(perms.min(axis=0))
+
+        size = self._num_atom * 3
+        self._ata = np.zeros((size, size), dtype='double')
+        self._atb = np.zeros((size, len(self._independent_atoms) * 3),
+                             dtype='double')
+        self._num_configurations = 0
+
+    def get_independent_atoms(self):
+        return self._independent_atoms
+
+    def get_number_of_operations(self):
+        return len(self._r_carts)
+
+    def get_number_of_configurations(self):
+        return self._num_configurations
+
+    def add(self, displacements, forces):
+        """Add configurations
+
+        Args:
+            displacements, forces: Cartesian, of shape
+                (num_configurations, num_atom, 3) or (num_atom, 3).
+
+        """
+        displacements = np.asarray(displacements,
+                                   dtype='double').reshape(-1, self._num_atom, 3)
+        forces = np.asarray(forces, dtype='double').reshape(-1, self._num_atom, 3)
+        assert len(displacements) == len(forces), \
+            "Numbers of displacements and forces are different."
+
+        num_ops = len(self._r_carts)
+        row_size = self._num_atom * 3
+        ops_per_block = max(
+            1, min(num_ops, self._max_elements // row_size))
+        confs_per_block = max(
+            1, self._max_elements // (row_size * ops_per_block))
+
+        for m0 in range(0, len(displacements), confs_per_block):
+            u = displacements[m0:m0 + confs_per_block]
+            f = forces[m0:m0 + confs_per_block]
+            for n0 in range(0, num_ops, ops_per_block):
+                images = self._images[n0:n0 + ops_per_block]
+                r_carts = self._r_carts[n0:n0 + ops_per_block]
+                # u'_b = R^T u_g(b), f'_a = R^T f_g(a) as row vectors
+                a = np.matmul(u[:, images], r_carts).reshape(-1, row_size)
+                b = np.matmul(f[:, images[:, self._independent_atoms]],
+                              r_carts).reshape(len(a), -1)
+                self._ata += np.dot(a.T, a)
+                self._atb += np.dot(a.T, b)
+
+        self._num_configurations += len(displacements)
+
+    def solve(self, rcond=1e-10):
+        """Force constants of shape (num_atom, num_atom, 3, 3)
+
+        The normal equations are solved by the pseudo-inverse, so a
+        uniform translation, which displacements with the drift removed
+        do not contain, does not make the problem singular.
+
+        """
+        num_atom = self._num_atom
+        num_indep = len(self._independent_atoms)
+        x = np.dot(np.linalg.pinv(self._ata, rcond=rcond), self._atb)
+        # x[(b, beta), (k, alpha)] = -Phi(a_k, b)[alpha, beta]
+        fc_indep = -x.reshape(num_atom, 3, num_indep, 3).transpose(2, 0, 3, 1)
+
+        force_constants = np.zeros((num_atom, num_atom, 3, 3), dtype='double')
+        is_done = np.zeros(num_atom, dtype=bool)
+        for k, a in enumerate(self._independent_atoms):
+            # Phi(g(a), g(b)) = R Phi(a, b) R^T
+            for images, r in zip(self._images, self._r_carts):
+                i = images[a]
+                if is_done[i]:
+                    continue
+                force_constants[i, images] = np.matmul(
+                    np.matmul(r, fc_indep[k]), r.T)
+                is_done[i] = True
+
+        return force_constants
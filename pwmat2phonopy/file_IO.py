@@ -44,6 +44,10 @@ import numpy as np
 # FORCE_SETS
 #
 def write_FORCE_SETS(dataset, filename='FORCE_SETS'):
+    if 'displacements' in dataset:
+        _write_FORCE_SETS_random(dataset, filename=filename)
+        return
+
     num_atom = dataset['natom']
     displacements = dataset['first_atoms']
     forces = [x['forces'] for x in dataset['first_atoms']]
@@ -59,6 +63,24 @@ def write_FORCE_SETS(dataset, filename='FORCE_SETS'):
             for f in forces[count]:
                 fp.write("%15.10f %15.10f %15.10f\n" % (tuple(f)))
 
+def _write_FORCE_SETS_random(dataset, filename='FORCE_SETS'):
+    """FORCE_SETS of supercells with all atoms displaced
+
+    Every supercell is a block of num_atom lines of displacement and
+    force (dx dy dz fx fy fz) that starts with a comment line.
+
+    """
+    with open(filename, 'w') as fp:
+        for i, (disps, forces) in enumerate(zip(dataset['displacements'],
+                                                dataset['forces'])):
+            if i > 0:
+                fp.write("\n")
+            fp.write("# File: %-5d\n" % (i + 1))
+            for d, f in zip(disps, forces):
+                fp.write(("%20.16f %20.16f %20.16f " +
+                          "%15.10f %15.10f %15.10f\n") %
+                         (tuple(d) + tuple(f)))
+
 def parse_FORCE_SETS(is_translational_invariance=False, filename="FORCE_SETS"):
     with open(filename, 'r') as f:
         return _get_set_of_forces(f, is_translational_invariance)
@@ -68,8 +90,13 @@ def parse_FORCE_SETS_from_strings(strings, is_translational_invariance=False):
                               is_translational_invariance)
 
 def _get_set_of_forces(f, is_translational_invariance):
+    first_line = _get_line_ignore_blank(f)
+    if first_line[0] == '#' or len(first_line.split()) == 6:
+        return _get_set_of_forces_random(f, first_line,
+                                         is_translational_invariance)
+
     set_of_forces = []
-    num_atom = int(_get_line_ignore_blank(f))
+    num_atom = int(first_line)
     num_displacements = int(_get_line_ignore_blank(f))
 
     for i in range(num_displacements):
@@ -96,6 +123,31 @@ def _get_set_of_forces(f, is_translational_invariance):
 
     return dataset
 
+def _get_set_of_forces_random(f, first_line, is_translational_invariance):
+    blocks = [[]]
+    for line in [first_line] + f.readlines():
+        line = line.strip()
+        if line == '' or line[0] == '#':
+            if blocks[-1]:
+                blocks.append([])
+            continue
+        blocks[-1].append([float(x) for x in line.split()[:6]])
+    if not blocks[-1]:
+        blocks.pop()
+
+    num_atom = len(blocks[0])
+    if [len(b) for b in blocks if len(b) != num_atom]:
+        raise ValueError("Numbers of atoms of the supercells in FORCE_SETS "
+                         "are different.")
+    data = np.array(blocks, dtype='double').reshape(-1, num_atom, 6)
+    forces = data[:, :, 3:].copy()
+    if is_translational_invariance:
+        forces -= forces.mean(axis=1)[:, None, :]
+
+    return {'natom': num_atom,
+            'displacements': data[:, :, :3].copy(),
+            'forces': forces}
+
 def _get_line_ignore_blank(f):
     line = f.readline().strip()
     if line == '':
@@ -208,28 +260,35 @@ def parse_disp_yaml(filename="disp.yaml", return_cell=False):
     except ImportError:
         from yaml import Loader
 
-    from phonopy.structure.atoms import PhonopyAtoms as Atoms
-
     with open(filename) as f:
         dataset = yaml.load(f, Loader=Loader)
         natom = dataset['natom']
         new_dataset = {}
         new_dataset['natom'] = natom
-        new_first_atoms = []
-        for first_atoms in dataset['displacements']:
-            first_atoms['atom'] -= 1
-            atom1 = first_atoms['atom']
-            disp1 = first_atoms['displacement']
-            if 'direction' in first_atoms:
-                direct1 = first_atoms['direction']
-                new_first_atoms.append({'number': atom1,
-                                        'displacement': disp1,
-                                        'direction':direct1})
-            else:
-                new_first_atoms.append({'number': atom1, 'displacement': disp1})
-        new_dataset['first_atoms'] = new_first_atoms
+        if 'random_displacements' in dataset:
+            # All atoms displaced, see write_random_disp_yaml
+            new_dataset['displacements'] = np.array(
+                [x['displacements'] for x in dataset['random_displacements']],
+                dtype='double').reshape(-1, natom, 3)
+        else:
+            new_first_atoms = []
+            for first_atoms in dataset['displacements']:
+                first_atoms['atom'] -= 1
+                atom1 = first_atoms['atom']
+                disp1 = first_atoms['displacement']
+                if 'direction' in first_atoms:
+                    direct1 = first_atoms['direction']
+                    new_first_atoms.append({'number': atom1,
+                                            'displacement': disp1,
+                                            'direction':direct1})
+                else:
+                    new_first_atoms.append({'number': atom1,
+                                            'displacement': disp1})
+            new_dataset['first_atoms'] = new_first_atoms
 
         if return_cell:
+            from phonopy.structure.atoms import PhonopyAtoms as Atoms
+
             lattice = dataset['lattice']
             if 'points' in dataset:
                 data_key = 'points'
@@ -274,6 +333,29 @@ def write_disp_yaml(displacements,
     with open(filename, 'w') as w:
         w.write("\n".join(text))
 
+def write_random_disp_yaml(displacements,
+                           supercell,
+                           filename='phonon/disp.yaml'):
+    """disp.yaml of supercells with all atoms displaced
+
+    displacements are Cartesian, of shape (num_supercells, num_atom, 3).
+
+    """
+    text = []
+    text.append("natom: %4d" % supercell.get_number_of_atoms())
+    text.append("random_displacements:")
+    for i, disps in enumerate(displacements):
+        text.append("- supercell: %4d" % (i + 1))
+        text.append("  displacements:")
+        for d in disps:
+            text.append("  - [ %20.16f,%20.16f,%20.16f ]" % tuple(d))
+
+    text.append(str(supercell))
+
+    os.mkdir('phonon')
+    with open(filename, 'w') as w:
+        w.write("\n".join(text))
+
 #
 # DISP (old phonopy displacement format)
 #
@@ -291,18 +373,86 @@ def parse_DISP(filename='DISP'):
 # QPOINTS
 #
 def parse_QPOINTS(filename="QPOINTS"):
-    from phonopy.cui.settings import fracval
+    """Q-points of QPOINTS, or of a .npy file of shape (num_qpoints, 3)"""
+    if filename.endswith('.npy'):
+        return np.array(np.load(filename), dtype='double').reshape(-1, 3)
+    return np.concatenate(
+        [np.zeros((0, 3))] + list(iter_QPOINTS(filename=filename)))
+
+def get_QPOINTS_size(filename="QPOINTS"):
+    """Number of q-points of QPOINTS or of a .npy file"""
+    if filename.endswith('.npy'):
+        return len(np.load(filename, mmap_mode='r'))
+    with open(filename, 'r') as f:
+        return int(f.readline().strip())
+
+def iter_QPOINTS(filename="QPOINTS", chunk_size=100000):
+    """Q-points of QPOINTS (or of a .npy file) chunk by chunk
+
+    Every chunk of chunk_size lines is converted at once. Fractions such
+    as 1/3 are also read, a line at a time. A .npy file is memory-mapped,
+    so neither holds all q-points in memory.
+
+    """
+    if filename.endswith('.npy'):
+        qpoints = np.load(filename, mmap_mode='r')
+        for i in range(0, len(qpoints), chunk_size):
+            yield np.array(qpoints[i:i + chunk_size],
+                           dtype='double').reshape(-1, 3)
+        return
 
     with open(filename, 'r') as f:
         num_qpoints = int(f.readline().strip())
-        qpoints = []
-        for i in range(num_qpoints):
-            qpoints.append([fracval(x) for x in f.readline().strip().split()])
-        return np.array(qpoints)
+        for i in range(0, num_qpoints, chunk_size):
+            lines = [f.readline()
+                     for j in range(min(chunk_size, num_qpoints - i))]
+            yield _parse_qpoint_lines(lines, i + 2, num_qpoints, filename)
+
+def _parse_qpoint_lines(lines, first_line_number, num_qpoints, filename):
+    # Three values per line; lines are never merged, so an extra or
+    # missing column is an error rather than a shift of the q-points.
+    rows = [line.split() for line in lines]
+    for j, (line, row) in enumerate(zip(lines, rows)):
+        if line == '':
+            raise ValueError("%s ends after %d of %d q-points." %
+                             (filename, first_line_number + j - 2,
+                              num_qpoints))
+        if len(row) != 3:
+            raise ValueError("Line %d of %s has %d values instead of 3." %
+                             (first_line_number + j, filename, len(row)))
+    try:
+        return np.array(rows, dtype='double').reshape(-1, 3)
+    except ValueError:
+        from phonopy.cui.settings import fracval
+        return np.array([[fracval(x) for x in row] for row in rows],
+                        dtype='double').reshape(-1, 3)
 
 #
 # BORN
 #
+def write_BORN(borns, epsilon, atom_indices=None, factor=None,
+               filename="BORN"):
+    """Write BORN
+
+    borns are the Born effective charges of the independent atoms of the
+    primitive cell. atom_indices (starting from 0) are only written as a
+    comment in the first line. The default unit conversion factor is the
+    one of eV and Angstrom (PWmat, VASP).
+
+    """
+    if factor is None:
+        from pwmat2phonopy.units import Hartree, Bohr
+        factor = Hartree * Bohr
+
+    with open(filename, 'w') as w:
+        line = "%.8f  # epsilon and Z* of atoms" % factor
+        if atom_indices is not None:
+            line += " " + " ".join(["%d" % (i + 1) for i in atom_indices])
+        w.write(line + "\n")
+        w.write(("%13.8f" * 9 + "\n") % tuple(np.ravel(epsilon)))
+        for z in borns:
+            w.write(("%13.8f" * 9 + "\n") % tuple(np.ravel(z)))
+
 def parse_BORN(primitive, symprec=1e-5, is_symmetry=True, filename="BORN"):
     with open(filename, 'r') as f:
         return _parse_BORN_from_file_object(f, primitive, symprec, is_symmetry)
@@ -431,18 +581,128 @@ def read_thermal_properties_yaml(filenames, factor=1.0):
         entropy = np.array(entropy).T * factor
         fe_phonon = np.array(fe_phonon).T * factor
     else:
-        print('')
-        print("Check your input files")
-        print("Disagreement of temperature range or step")
-        for t, fname in zip(temp, filenames):
-            print("%s: Range [ %d, %d ], Step %f" %
-                  (fname, int(t[0]), int(t[-1]), t[1] - t[0]))
-        print('')
-        print("Stop phonopy-qha")
-        sys.exit(1)
+        _stop_by_temperatures(temp, filenames)
 
     return temperatures, cv, entropy, fe_phonon, num_modes, num_integrated_modes
 
+def read_thermal_properties(filenames, factor=1.0, num_processes=None):
+    """Thermal properties of many volumes as stacked arrays
+
+    For every thermal_properties.yaml, the binary file written next to it
+    (thermal_properties.hdf5 or thermal_properties.npz) is read when it is
+    not older than the yaml. The other yaml files are parsed by up to
+    num_processes processes (all cores by default). Binary files may also
+    be given directly. Returns the same as read_thermal_properties_yaml,
+    the temperatures as an array.
+
+    """
+    import multiprocessing
+
+    data = [None] * len(filenames)
+    yaml_indices = []
+    for i, filename in enumerate(filenames):
+        binary_filename = _get_thermal_properties_binary(filename)
+        if binary_filename is None:
+            yaml_indices.append(i)
+        else:
+            data[i] = _read_thermal_properties_binary(binary_filename)
+
+    if num_processes is None:
+        num_processes = multiprocessing.cpu_count()
+    num_processes = min(num_processes, len(yaml_indices))
+    yaml_filenames = [filenames[i] for i in yaml_indices]
+    if num_processes > 1:
+        pool = multiprocessing.Pool(num_processes)
+        try:
+            yaml_data = pool.map(_read_thermal_properties_yaml_file,
+                                 yaml_filenames)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        yaml_data = [_read_thermal_properties_yaml_file(filename)
+                     for filename in yaml_filenames]
+    for i, d in zip(yaml_indices, yaml_data):
+        data[i] = d
+
+    temp = [d[0] for d in data]
+    if not _is_temperatures_match(temp):
+        _stop_by_temperatures(temp, filenames)
+    cv = np.array([d[1] for d in data]).T * factor
+    entropy = np.array([d[2] for d in data]).T * factor
+    fe_phonon = np.array([d[3] for d in data]).T * factor
+    num_modes = []
+    num_integrated_modes = []
+    if all([d[4] is not None for d in data]):
+        num_modes = [d[4] for d in data]
+        num_integrated_modes = [d[5] for d in data]
+
+    return temp[0], cv, entropy, fe_phonon, num_modes, num_integrated_modes
+
+def _get_thermal_properties_binary(filename):
+    # Binary file to be read in place of filename, or None
+    base, ext = os.path.splitext(filename)
+    if ext in ('.hdf5', '.npz'):
+        return filename
+    for binary_filename in (base + '.hdf5', base + '.npz'):
+        if not os.path.isfile(binary_filename):
+            continue
+        if binary_filename.endswith('.hdf5'):
+            try:
+                import h5py
+            except ImportError:
+                continue
+        if (not os.path.exists(filename) or
+            os.path.getmtime(binary_filename) >= os.path.getmtime(filename)):
+            return binary_filename
+    return None
+
+def _read_thermal_properties_binary(filename):
+    from pwmat2phonopy.thermal_properties import read_thermal_properties_hdf5
+
+    tp = read_thermal_properties_hdf5(filename)
+    return (tp['temperature'],
+            tp['heat_capacity'],
+            tp['entropy'],
+            tp['free_energy'],
+            int(tp['num_modes']),
+            int(tp['num_integrated_modes']))
+
+def _read_thermal_properties_yaml_file(filename):
+    import yaml
+    try:
+        from yaml import CLoader as Loader
+    except ImportError:
+        from yaml import Loader
+
+    with open(filename) as f:
+        tp_yaml = yaml.load(f.read(), Loader=Loader)
+    table = np.array([[v['temperature'],
+                       v['heat_capacity'],
+                       v['entropy'],
+                       v['free_energy']]
+                      for v in tp_yaml['thermal_properties']],
+                     dtype='double').reshape(-1, 4)
+    if 'num_modes' in tp_yaml and 'num_integrated_modes' in tp_yaml:
+        num_modes = tp_yaml['num_modes']
+        num_integrated_modes = tp_yaml['num_integrated_modes']
+    else:
+        num_modes = None
+        num_integrated_modes = None
+    return (table[:, 0], table[:, 1], table[:, 2], table[:, 3],
+            num_modes, num_integrated_modes)
+
+def _stop_by_temperatures(temperatures, filenames):
+    print('')
+    print("Check your input files")
+    print("Disagreement of temperature range or step")
+    for t, fname in zip(temperatures, filenames):
+        print("%s: Range [ %d, %d ], Step %f" %
+              (fname, int(t[0]), int(t[-1]), t[1] - t[0]))
+    print('')
+    print("Stop phonopy-qha")
+    sys.exit(1)
+
 def read_cp(filename):
     return _parse_QHA_data(filename)
 
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+"""Mode Gruneisen parameters of many q-points at once
+
+phonopy's Gruneisen builds and solves the dynamical matrices of the
+original, expanded and compressed volumes q-point by q-point. The mode
+Gruneisen parameter of band j at q is
+
+    gamma_j(q) = -V / (2 omega_j(q)^2) <e_j(q)|dD(q)|e_j(q)> / (V+ - V-)
+
+with dD = D(V+) - D(V-) and e the eigenvectors of D(V). Here the
+dynamical matrices of a block of q-points of the three volumes are built
+by DynamicalMatrixBatch, the matrices of V are solved by one call of
+numpy.linalg.eigh and <e|dD|e> is the diagonal of e^H dD e of the whole
+block. Only at q-points with degenerate eigenvalues dD is diagonalized
+within each degenerate set, as by phonopy's rotate_eigenvectors.
+
+    gruneisen = GruneisenBatch(phonon.get_dynamical_matrix(),
+                               phonon_plus.get_dynamical_matrix(),
+                               phonon_minus.get_dynamical_matrix())
+    gamma, eigenvalues = gruneisen.run(qpoints)
+
+"""
+
+import numpy as np
+
+__author__  = "Paul Chern"
+__email__   = "peng.chen.iphy@gmail.com"
+__licence__ = "GPL"
+__date__    = "Nov. 2017"
+
+def get_gruneisen_parameters(dynamical_matrices,
+                             dynamical_matrices_plus,
+                             dynamical_matrices_minus,
+                             volume,
+                             volume_plus,
+                             volume_minus,
+                             cutoff=1e-4):
+    """Mode Gruneisen parameters of stacked dynamical matrices
+
+    Eigenvalues closer than cutoff are taken as degenerate as by phonopy's
+    degenerate_sets. Returns the Gruneisen parameters and eigenvalues of
+    shape (num_qpoints, num_band) and the eigenvectors rotated to
+    diagonalize dD, of shape (num_qpoints, num_band, num_band).
+
+    """
+    eigenvalues, eigenvectors = np.linalg.eigh(dynamical_matrices)
+    eigenvalues = np.array(eigenvalues.real, dtype='double', order='C')
+    dD = dynamical_matrices_plus - dynamical_matrices_minus
+    edDe_matrices = np.matmul(eigenvectors.conj().transpose(0, 2, 1),
+                              np.matmul(dD, eigenvectors))
+    edDe = np.array(np.diagonal(edDe_matrices, axis1=1, axis2=2).real,
+                    dtype='double', order='C')
+
+    # Eigenvalues are sorted, so a degenerate set is a run of neighbours.
+    is_degenerate = np.abs(np.diff(eigenvalues, axis=1)) < cutoff
+    for i in np.nonzero(is_degenerate.any(axis=1))[0]:
+        start = 0
+        for j, is_deg in enumerate(is_degenerate[i]):
+            if is_deg:
+                continue
+            if j > start:
+                _rotate(edDe, eigenvectors, edDe_matrices, i, start, j + 1)
+            start = j + 1
+        if start < len(eigenvalues[i]) - 1:
+            _rotate(edDe, eigenvectors, edDe_matrices, i, start,
+                    len(eigenvalues[i]))
+
+    dV = volume_plus - volume_minus
+    gruneisen = -edDe / dV / eigenvalues * volume / 2
+    return gruneisen, eigenvalues, eigenvectors
+
+def _rotate(edDe, eigenvectors, edDe_matrices, i, start, end):
+    # dD diagonalized within bands start, ..., end - 1 at q-point i
+    edDe[i, start:end], rotation = np.linalg.eigh(
+        edDe_matrices[i, start:end, start:end])
+    eigenvectors[i, :, start:end] = np.dot(eigenvectors[i, :, start:end],
+                                           rotation)
+
+def get_frequencies(eigenvalues, factor):
+    """Frequencies of eigenvalues, negative for imaginary modes"""
+    return np.sqrt(np.abs(eigenvalues)) * np.sign(eigenvalues) * factor
+
+class GruneisenBatch(object):
+    """Mode Gruneisen parameters as phonopy's Gruneisen for blocks of q-points
+
+    Args:
+        dynmat, dynmat_plus, dynmat_minus: phonopy DynamicalMatrix of the
+            original, expanded and compressed volumes. With non-analytical
+            term correction the matrices are built q-point by q-point.
+        max_bytes: Memory of the matrices of a block of q-points.
+
+    """
+    def __init__(self, dynmat, dynmat_plus, dynmat_minus, max_bytes=2 ** 26):
+        from pwmat2phonopy.dynamical_matrix import get_dynamical_matrix_batch
+
+        self._dynmats = (dynmat, dynmat_plus, dynmat_minus)
+        self._volumes = [d.get_primitive().get_volume() for d in self._dynmats]
+        self._batches = [get_dynamical_matrix_batch(d) for d in self._dynmats]
+        if None in self._batches:
+            self._batches = None
+        num_band = dynmat.get_dimension()
+
+        # Four stacks of matrices: D, D+, D-, e^H dD e (and eigenvectors)
+        self._batch_size = max(1, max_bytes // (num_band * num_band * 16 * 5))
+
+    def get_batch_size(self):
+        return self._batch_size
+
+    def is_batch(self):
+        return self._batches is not None
+
+    def get_dynamical_matrices(self, qpoints, q_direction=None):
+        """Dynamical matrices of the three volumes at qpoints
+
+        q_direction is used at Gamma with non-analytical term correction.
+
+        """
+        if self._batches is not None:
+            return [b.get_dynamical_matrices(qpoints) for b in self._batches]
+        dms = []
+        for dynmat in self._dynmats:
+            dms_volume = []
+            for q in qpoints:
+                if (dynmat.is_nac() and q_direction is not None and
+                    (np.abs(q) < 1e-5).all()):
+                    dynmat.set_dynamical_matrix(q, q_direction=q_direction)
+                else:
+                    dynmat.set_dynamical_matrix(q)
+                dms_volume.append(dynmat.get_dynamical_matrix())
+            dms.append(np.array(dms_volume))
+        return dms
+
+    def run(self, qpoints, is_band_connection=False):
+        """Gruneisen parameters and eigenvalues at qpoints
+
+        With is_band_connection, qpoints are a path along which bands are
+        connected as by phonopy's Gruneisen (then q-points at Gamma with
+        non-analytical term correction take the direction of the path).
+
+        """
+        qpoints = np.reshape(qpoints, (-1, 3))
+        q_direction = None
+        if is_band_connection:
+            from phonopy.phonon.band_structure import estimate_band_connection
+            q_direction = qpoints[0] - qpoints[-1]
+            band_order = list(range(self._dynmats[0].get_dimension()))
+            prev_eigvecs = None
+
+        gruneisen = []
+        eigenvalues = []
+        for i in range(0, len(qpoints), self._batch_size):
+            dms = self.get_dynamical_matrices(qpoints[i:i + self._batch_size],
+                                              q_direction=q_direction)
+            gamma, eigvals, eigvecs = get_gruneisen_parameters(
+                *(dms + self._volumes))
+            if is_band_connection:
+                for j in range(len(gamma)):
+                    if prev_eigvecs is not None:
+                        band_order = estimate_band_connection(prev_eigvecs,
+                                                              eigvecs[j],
+                                                              band_order)
+                    gamma[j] = gamma[j][band_order]
+                    eigvals[j] = eigvals[j][band_order]
+                    prev_eigvecs = eigvecs[j]
+            gruneisen.append(gamma)
+            eigenvalues.append(eigvals)
+
+        num_band = self._dynmats[0].get_dimension()
+        return (np.concatenate([np.zeros((0, num_band))] + gruneisen),
+                np.concatenate([np.zeros((0, num_band))] + eigenvalues))
+
+def get_band_distances(path, primitive):
+    """Distances along a path from its first q-point, as phonopy-gruneisen"""
+    rec_lattice = np.linalg.inv(primitive.get_cell())
+    dq = np.zeros_like(path)
+    dq[1:] = path[1:] - path[:-1]
+    return np.cumsum(np.sqrt((np.dot(dq, rec_lattice.T) ** 2).sum(axis=1)))
+
+def write_gruneisen_mesh_yaml(mesh,
+                              qpoints,
+                              weights,
+                              gruneisen,
+                              frequencies,
+                              filename="gruneisen.yaml"):
+    """gruneisen.yaml of a sampling mesh as by phonopy's Gruneisen Mesh"""
+    with open(filename, 'w') as w:
+        w.write("mesh: [ %5d, %5d, %5d ]\n" % tuple(mesh))
+        w.write("nqpoint: %d\n" % len(qpoints))
+        w.write("phonon:\n")
+        for q, weight, gs, freqs in zip(qpoints,
+                                        weights,
+                                        gruneisen,
+                                        frequencies):
+            lines = ["- q-position: [ %10.7f, %10.7f, %10.7f ]" % tuple(q),
+                     "  multiplicity: %d" % weight,
+                     "  band:"]
+            for j, (g, freq) in enumerate(zip(gs, freqs)):
+                lines.append("  - # %d" % (j + 1))
+                lines.append("    gruneisen: %15.10f" % g)
+                lines.append("    frequency: %15.10f" % freq)
+            lines.append("\n")
+            w.write("\n".join(lines))
+
+def write_gruneisen_mesh_hdf5(mesh,
+                              qpoints,
+                              weights,
+                              gruneisen,
+                              frequencies,
+                              filename="gruneisen.hdf5"):
+    """gruneisen.hdf5 of a sampling mesh as by phonopy's Gruneisen Mesh"""
+    import h5py
+
+    with h5py.File(filename, 'w') as w:
+        w.create_dataset('mesh', data=np.array(mesh, dtype='intc'))
+        w.create_dataset('gruneisen', data=gruneisen)
+        w.create_dataset('weight', data=weights)
+        w.create_dataset('frequency', data=frequencies)
+        w.create_dataset('qpoint', data=qpoints)
+
+def write_gruneisen_band_yaml(paths,
+                              distances,
+                              gruneisen,
+                              frequencies,
+                              filename="gruneisen_band.yaml"):
+    """Band structure of Gruneisen parameters as by phonopy-gruneisen --band
+
+    The distances start from zero on every path as in phonopy's file.
+
+    """
+    with open(filename, 'w') as w:
+        w.write("path:\n\n")
+        for path, ds, gamma, freqs_path in zip(paths,
+                                               distances,
+                                               gruneisen,
+                                               frequencies):
+            w.write("- nqpoint: %d\n" % len(path))
+            w.write("  phonon:\n")
+            for q, d, gs, freqs in zip(path, ds, gamma, freqs_path):
+                lines = ["  - q-position: [ %10.7f, %10.7f, %10.7f ]" %
+                         tuple(q),
+                         "    distance: %10.7f" % d,
+                         "    band:"]
+                for j, (g, freq) in enumerate(zip(gs, freqs)):
+                    lines.append("    - # %d" % (j + 1))
+                    lines.append("      gruneisen: %15.10f" % g)
+                    lines.append("      frequency: %15.10f" % freq)
+                lines.append("\n")
+                w.write("\n".join(lines))
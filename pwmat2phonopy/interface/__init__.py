@@ -33,7 +33,6 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 import os
-from phonopy.file_IO import parse_disp_yaml, write_FORCE_SETS
 
 def read_crystal_structure(filename=None,
                            interface_mode=None,
@@ -187,6 +186,9 @@ def create_FORCE_SETS(interface_mode,
                       disp_filename='disp.yaml',
                       force_sets_filename='FORCE_SETS',
                       log_level=0):
+    import numpy as np
+    from pwmat2phonopy.file_IO import parse_disp_yaml, write_FORCE_SETS
+
     if (interface_mode is None or
         interface_mode == 'vasp' or
         interface_mode == 'pwmat' or
@@ -197,7 +199,10 @@ def create_FORCE_SETS(interface_mode,
         interface_mode == 'crystal'):
         disp_dataset = parse_disp_yaml(filename=disp_filename)
         num_atoms = disp_dataset['natom']
-        num_displacements = len(disp_dataset['first_atoms'])
+        if 'displacements' in disp_dataset:
+            num_displacements = len(disp_dataset['displacements'])
+        else:
+            num_displacements = len(disp_dataset['first_atoms'])
         if force_sets_zero_mode:
             num_displacements += 1
         force_sets = get_force_sets(interface_mode,
@@ -211,6 +216,9 @@ def create_FORCE_SETS(interface_mode,
         disp_dataset, supercell = parse_disp_yaml(filename=disp_filename,
                                                   return_cell=True)
         from phonopy.interface.wien2k import parse_set_of_forces
+        if 'displacements' in disp_dataset:
+            print("Random displacements are not supported for WIEN2k.")
+            return 1
         num_displacements = len(disp_dataset['first_atoms'])
         if force_sets_zero_mode:
             num_displacements += 1
@@ -234,8 +242,11 @@ def create_FORCE_SETS(interface_mode,
     if force_sets:
         if force_sets_zero_mode:
             force_sets = _subtract_residual_forces(force_sets)
-        for forces, disp in zip(force_sets, disp_dataset['first_atoms']):
-            disp['forces'] = forces
+        if 'displacements' in disp_dataset:
+            disp_dataset['forces'] = np.array(force_sets, dtype='double')
+        else:
+            for forces, disp in zip(force_sets, disp_dataset['first_atoms']):
+                disp['forces'] = forces
         write_FORCE_SETS(disp_dataset, filename=force_sets_filename)
 
     if log_level > 0:
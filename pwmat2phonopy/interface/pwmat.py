@@ -40,14 +40,12 @@ except ImportError:
     from io import StringIO
 import io
 import numpy as np
-from phonopy.structure.atoms import PhonopyAtoms as Atoms
-from phonopy.structure.atoms import symbol_map, atom_data
-from phonopy.structure.cells import get_primitive, get_supercell
-from phonopy.structure.symmetry import (Symmetry, get_site_symmetry,
-                                        get_pointgroup_operations)
-from phonopy.harmonic.force_constants import similarity_transformation
-from phonopy.file_IO import (write_FORCE_SETS, write_force_constants_to_hdf5,
-                             write_FORCE_CONSTANTS)
+from pwmat2phonopy.file_IO import (write_FORCE_SETS,
+                                   write_force_constants_to_hdf5,
+                                   write_FORCE_CONSTANTS)
+
+# phonopy modules are imported in the functions that use them. Importing
+# phonopy loads its whole API, which parse_set_of_forces (-f) never needs.
 
 def parse_set_of_forces(num_atoms,
                         forces_filenames,
@@ -169,6 +167,9 @@ def read_pwmat_from_strings(strings, symbols=None):
     return _get_atoms_from_atom_config(StringIO(strings).readlines(), symbols)
 
 def _get_atoms_from_atom_config(lines, symbols):
+    from phonopy.structure.atoms import PhonopyAtoms as Atoms
+    from phonopy.structure.atoms import atom_data
+
     num_atoms = int(lines[0].split()[0])
     num_lines = len(lines)
 
@@ -196,13 +197,29 @@ def _get_atoms_from_atom_config(lines, symbols):
 
     return atoms
 
+#
+# total energy in PWmat REPORT
+#
+def read_pwmat_total_energy(filename="REPORT"):
+    """Last E_tot (eV) of the SCF iterations, None if there is none yet"""
+    energy = None
+    with open(filename) as f:
+        for line in f:
+            if line.strip().startswith('E_tot') and '=' in line:
+                energy = float(line.split('=')[1].split()[0])
+    return energy
+
 def _is_exist_symbols(symbols):
+    from phonopy.structure.atoms import symbol_map
+
     for s in symbols:
         if not (s in symbol_map):
             return False
     return True
 
 def _expand_symbols(num_atoms, symbols=None):
+    from phonopy.structure.atoms import symbol_map, atom_data
+
     expanded_symbols = []
     is_symbols = True
     if symbols is None:
@@ -378,6 +395,37 @@ def _get_reduced_symbols(symbols):
 #
 # Non-analytical term
 #
+def get_born_pwmat(born_filename="OUT.BORN",
+                   cell_filename="atom.config",
+                   primitive_matrix=None,
+                   supercell_matrix=None,
+                   is_symmetry=True,
+                   symmetrize_tensors=True,
+                   symprec=1e-5):
+    """Born effective charges and dielectric constant of a PWmat run
+
+    The dielectric tensor and the Born effective charges of the unit cell
+    in cell_filename are read from the output of a PWmat DFPT or
+    finite-field run (see _read_born_and_epsilon_from_pwmat) and are
+    symmetrized and reduced to the independent atoms of the primitive
+    cell by _get_borns.
+
+    """
+    ucell = read_pwmat(cell_filename)
+    borns, epsilon = _read_born_and_epsilon_from_pwmat(
+        born_filename, ucell.get_number_of_atoms())
+    if len(borns) == 0 or len(epsilon) == 0:
+        return None
+    else:
+        return _get_borns(ucell,
+                          borns,
+                          epsilon,
+                          primitive_matrix=primitive_matrix,
+                          supercell_matrix=supercell_matrix,
+                          is_symmetry=is_symmetry,
+                          symmetrize_tensors=symmetrize_tensors,
+                          symprec=symprec)
+
 def get_born_vasprunxml(filename="vasprun.xml",
                         primitive_matrix=None,
                         supercell_matrix=None,
@@ -385,10 +433,15 @@ def get_born_vasprunxml(filename="vasprun.xml",
                         symmetrize_tensors=False,
                         symprec=1e-5):
     import io
+    from phonopy.structure.atoms import PhonopyAtoms as Atoms
+
     borns = []
     epsilon = []
     with io.open(filename, "rb") as f:
-        vasprun = VasprunxmlExpat(f)
+        vasprun = VasprunxmlExpat(f,
+                                  quantities=('epsilon', 'born', 'lattice',
+                                              'points', 'symbols'),
+                                  is_last_only=True)
         if vasprun.parse():
             epsilon = vasprun.get_epsilon()
             borns = vasprun.get_born()
@@ -417,6 +470,8 @@ def get_born_OUTCAR(poscar_filename="POSCAR",
                     is_symmetry=True,
                     symmetrize_tensors=False,
                     symprec=1e-5):
+    from phonopy.interface.vasp import read_vasp
+
     if outcar_filename is None:
         filename = "OUTCAR"
     else:
@@ -441,6 +496,9 @@ def symmetrize_borns_and_epsilon(borns,
                                  ucell,
                                  symprec=1e-5,
                                  is_symmetry=True):
+    from phonopy.structure.symmetry import (Symmetry,
+                                            get_pointgroup_operations)
+
     lattice = ucell.get_cell()
     positions = ucell.get_scaled_positions()
     u_sym = Symmetry(ucell, is_symmetry=is_symmetry, symprec=symprec)
@@ -449,38 +507,77 @@ def symmetrize_borns_and_epsilon(borns,
     ptg_ops = get_pointgroup_operations(rotations)
     epsilon_ = symmetrize_2nd_rank_tensor(epsilon, ptg_ops, lattice)
 
-    for i, Z in enumerate(borns):
-        site_sym = get_site_symmetry(i,
-                                     lattice,
-                                     positions,
-                                     rotations,
-                                     translations,
-                                     symprec)
-        Z = symmetrize_2nd_rank_tensor(Z, site_sym, lattice)
-
-    borns_ = np.zeros_like(borns)
-    for i in range(len(borns)):
-        count = 0
-        for r, t in zip(rotations, translations):
-            count += 1
-            diff = np.dot(positions, r.T) + t - positions[i]
-            diff -= np.rint(diff)
-            dist = np.sqrt(np.sum(np.dot(diff, lattice) ** 2, axis=1))
-            j = np.nonzero(dist < symprec)[0][0]
-            r_cart = similarity_transformation(lattice.T, r)
-            borns_[i] += similarity_transformation(r_cart, borns[j])
-        borns_[i] /= count
+    # Z_i = 1/N sum_n R_n Z_perm[n, i] R_n^-1
+    perms = get_atom_permutations(positions,
+                                  rotations,
+                                  translations,
+                                  lattice,
+                                  symprec=symprec)
+    r_carts = get_cartesian_rotations(rotations, lattice)
+    r_carts_inv = np.linalg.inv(r_carts)
+    borns_ = np.matmul(np.matmul(r_carts[:, None], np.asarray(borns)[perms]),
+                       r_carts_inv[:, None]).sum(axis=0) / len(rotations)
 
     return borns_, epsilon_
 
 def symmetrize_2nd_rank_tensor(tensor, symmetry_operations, lattice):
-    sym_cart = [similarity_transformation(lattice.T, r)
-                for r in symmetry_operations]
-    sum_tensor = np.zeros_like(tensor)
-    for sym in sym_cart:
-        sum_tensor += similarity_transformation(sym, tensor)
+    sym_cart = get_cartesian_rotations(symmetry_operations, lattice)
+    sum_tensor = np.einsum('nab,bc,ncd->ad',
+                           sym_cart,
+                           tensor,
+                           np.linalg.inv(sym_cart))
     return sum_tensor / len(symmetry_operations)
 
+def get_cartesian_rotations(rotations, lattice):
+    """Rotations in Cartesian coordinates, L^T R (L^T)^-1 for all R"""
+    lat_T = np.transpose(lattice)
+    return np.einsum('ij,njk,kl->nil',
+                     lat_T,
+                     np.asarray(rotations, dtype='double'),
+                     np.linalg.inv(lat_T))
+
+def get_atom_permutations(positions,
+                          rotations,
+                          translations,
+                          lattice,
+                          symprec=1e-5,
+                          max_elements=2 ** 18):
+    """Atom mapped onto each atom by each space group operation
+
+    perms[n, i] = j where R_n x_j + t_n = x_i modulo lattice vectors.
+    Distances are measured in Cartesian coordinates. All pairs of atoms
+    are compared at once for blocks of operations, whose size is chosen
+    so that the difference array has at most max_elements elements.
+
+    """
+    positions = np.asarray(positions, dtype='double')
+    rotations = np.asarray(rotations)
+    translations = np.asarray(translations, dtype='double')
+    num_ops = len(rotations)
+    num_atom = len(positions)
+    ops_per_block = max(1, max_elements // (num_atom * num_atom * 3))
+    atoms_per_block = min(
+        num_atom, max(1, max_elements // (ops_per_block * num_atom * 3)))
+
+    perms = np.zeros((num_ops, num_atom), dtype='intc')
+    for n0 in range(0, num_ops, ops_per_block):
+        n1 = min(n0 + ops_per_block, num_ops)
+        # rotated[n, j] = R_n x_j + t_n
+        rotated = (np.einsum('nkl,jl->njk', rotations[n0:n1], positions) +
+                   translations[n0:n1, None, :])
+        for i0 in range(0, num_atom, atoms_per_block):
+            i1 = min(i0 + atoms_per_block, num_atom)
+            diff = rotated[:, None, :, :] - positions[None, i0:i1, None, :]
+            diff -= np.rint(diff)
+            diff_cart = np.matmul(diff, lattice)
+            dist2 = np.einsum('...a,...a->...', diff_cart, diff_cart)
+            if (dist2.min(axis=2) > symprec ** 2).any():
+                raise ValueError("Atom mapping by a symmetry operation "
+                                 "was not found. Check symprec.")
+            perms[n0:n1, i0:i1] = dist2.argmin(axis=2)
+
+    return perms
+
 def _get_borns(ucell,
                borns,
                epsilon,
@@ -546,6 +643,9 @@ def _extract_independent_borns(borns,
                                supercell_matrix=None,
                                is_symmetry=True,
                                symprec=1e-5):
+    from phonopy.structure.cells import get_primitive, get_supercell
+    from phonopy.structure.symmetry import Symmetry
+
     if primitive_matrix is None:
         pmat = np.eye(3)
     else:
@@ -568,45 +668,189 @@ def _extract_independent_borns(borns,
     return reduced_borns, s_indep_atoms
 
 def _read_born_and_epsilon_from_OUTCAR(filename):
-    with open(filename) as outcar:
-        borns = []
-        epsilon = []
-
-        while True:
-            line = outcar.readline()
-            if not line:
+    borns = []
+    epsilon = []
+    with _mmap_OUTCAR(filename) as outcar:
+        pos = outcar.rfind(b"MACROSCOPIC STATIC DIELECTRIC TENSOR")
+        if pos > -1:
+            lines = _get_lines(outcar, _get_next_line(outcar, pos), 4)[1:]
+            if len(lines) == 3:
+                epsilon = _lines_to_array(lines)
+
+        # The last BORN block with the ion lines
+        num_atom = _get_NIONS(outcar)
+        end = len(outcar)
+        while num_atom:
+            pos = outcar.rfind(b"BORN", 0, end)
+            if pos < 0:
+                break
+            start = _get_next_line(outcar, pos)
+            lines = _get_lines(outcar, start, 2)
+            if len(lines) == 2 and "ion" in lines[1]:
+                start = _get_next_line(outcar, _get_next_line(outcar, start))
+                lines = _get_lines(outcar, start, num_atom * 4 - 1)
+                rows = [x for i, x in enumerate(lines) if i % 4 != 3]
+                if len(rows) == num_atom * 3:
+                    borns = _lines_to_array(rows)[:, 1:].reshape(-1, 3, 3)
                 break
+            end = _get_line_start(outcar, pos)
 
-            if "NIONS" in line:
-                num_atom = int(line.split()[11])
-
-            if "MACROSCOPIC STATIC DIELECTRIC TENSOR" in line:
-                epsilon = []
-                outcar.readline()
-                epsilon.append([float(x) for x in outcar.readline().split()])
-                epsilon.append([float(x) for x in outcar.readline().split()])
-                epsilon.append([float(x) for x in outcar.readline().split()])
-
-            if "BORN" in line:
-                outcar.readline()
-                line = outcar.readline()
-                if "ion" in line:
-                    for i in range(num_atom):
-                        born = []
-                        born.append([float(x)
-                                     for x in outcar.readline().split()][1:])
-                        born.append([float(x)
-                                     for x in outcar.readline().split()][1:])
-                        born.append([float(x)
-                                     for x in outcar.readline().split()][1:])
-                        outcar.readline()
-                        borns.append(born)
-
-        borns = np.array(borns, dtype='double')
-        epsilon = np.array(epsilon, dtype='double')
+    borns = np.array(borns, dtype='double')
+    epsilon = np.array(epsilon, dtype='double')
 
     return borns, epsilon
 
+#
+# OUTCAR is memory-mapped and searched backwards for section markers.
+#
+class _mmap_OUTCAR(object):
+    """Read-only memory map of a file, used as a context manager"""
+    def __init__(self, filename):
+        import mmap
+        with open(filename, 'rb') as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError: # Empty file can not be mapped.
+                self._mmap = None
+
+    def __enter__(self):
+        if self._mmap is None:
+            return b""
+        return self._mmap
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._mmap is not None:
+            self._mmap.close()
+
+def _get_line_start(buf, pos):
+    return buf.rfind(b"\n", 0, pos) + 1
+
+def _get_next_line(buf, pos):
+    """Position of the line following the line at pos"""
+    end = buf.find(b"\n", pos)
+    if end < 0:
+        return len(buf)
+    return end + 1
+
+def _get_lines(buf, pos, num_lines):
+    """At most num_lines lines from pos as strings"""
+    end = pos
+    for i in range(num_lines):
+        end = _get_next_line(buf, end)
+    return buf[pos:end].decode('latin-1').splitlines()
+
+def _lines_to_array(lines, num_labels=0):
+    """Numbers of lines of the same number of columns by one conversion
+
+    The first num_labels columns, e.g. "1X", are dropped.
+
+    """
+    if num_labels:
+        lines = [line.split(None, num_labels)[-1] for line in lines]
+    return np.array(" ".join(lines).split(),
+                    dtype='double').reshape(len(lines), -1)
+
+def _get_NIONS(buf):
+    import re
+    m = re.search(br"NIONS\s*=\s*(\d+)", buf)
+    if m is None:
+        return 0
+    return int(m.group(1))
+
+def _read_born_and_epsilon_from_pwmat(filename, num_atom):
+    """Read the dielectric tensor and Born effective charges
+
+    The last block titled "DIELECTRIC TENSOR" and the last one titled
+    "BORN EFFECTIVE CHARGES" (case insensitive) are used, so the
+    converged values of a run printing intermediate steps are taken.
+    The dielectric block consists of three rows and the Born block of
+    three rows per atom, in the order of atom.config, each row being the
+    three tensor elements, optionally after a row index:
+
+        DIELECTRIC TENSOR
+           5.9  0.0  0.0
+           ...
+
+        BORN EFFECTIVE CHARGES (e)
+         atom    1  Ca
+           1   2.57  0.00  0.00
+           ...
+
+    A block ends at the next title, or at an empty line after its rows.
+    Empty arrays are returned if a block is missing. ValueError is raised
+    if a block has another line or another number of rows.
+
+    """
+    with open(filename) as f:
+        lines = f.readlines()
+
+    titles = []
+    for i, line in enumerate(lines):
+        title = _get_pwmat_section_title(line)
+        if title is not None:
+            titles.append((i, title))
+
+    blocks = {}
+    for j, (i, title) in enumerate(titles):
+        if j + 1 < len(titles):
+            end = titles[j + 1][0]
+        else:
+            end = len(lines)
+        blocks[title] = (i + 1, end)
+
+    epsilon = []
+    if "DIELECTRIC TENSOR" in blocks:
+        epsilon = _read_tensor_rows(lines,
+                                    blocks["DIELECTRIC TENSOR"],
+                                    3,
+                                    "DIELECTRIC TENSOR",
+                                    filename)
+    borns = []
+    if "BORN EFFECTIVE CHARGES" in blocks:
+        borns = _read_tensor_rows(lines,
+                                  blocks["BORN EFFECTIVE CHARGES"],
+                                  num_atom * 3,
+                                  "BORN EFFECTIVE CHARGES",
+                                  filename)
+
+    epsilon = np.array(epsilon, dtype='double').reshape(-1, 3)
+    borns = np.array(borns, dtype='double').reshape(-1, 3, 3)
+
+    return borns, epsilon
+
+def _get_pwmat_section_title(line):
+    upper = line.strip().upper()
+    for title in ("DIELECTRIC TENSOR", "BORN EFFECTIVE CHARGES"):
+        if upper == title or upper.startswith(title + " "):
+            return title
+    return None
+
+def _read_tensor_rows(lines, block, num_rows, title, filename):
+    # Rows of the block (start, end) of lines; atom lines are skipped.
+    start, end = block
+    rows = []
+    for i in range(start, end):
+        ary = lines[i].split()
+        if not ary:
+            if rows:
+                break
+            continue
+        if ary[0].lower() == 'atom':
+            continue
+        try:
+            if len(ary) == 4:
+                int(ary[0])
+            elif len(ary) != 3:
+                raise ValueError
+            rows.append([float(x) for x in ary[-3:]])
+        except ValueError:
+            raise ValueError("Line %d of %s is not a row of %s:\n%s" %
+                             (i + 1, filename, title, lines[i].rstrip()))
+    if len(rows) != num_rows:
+        raise ValueError("%s of %s has %d rows instead of %d." %
+                         (title, filename, len(rows), num_rows))
+    return rows
+
 #
 # vasprun.xml handling
 #
@@ -619,13 +863,19 @@ class VasprunWrapper(object):
         self._fileptr = fileptr
 
     def read(self, size=None):
-        element = self._fileptr.next()
-        if element.find("PRECFOCK") == -1:
+        try:
+            element = next(self._fileptr)
+        except StopIteration:
+            return b""
+        if element.find(b"PRECFOCK") == -1:
             return element
         else:
-            return "<i type=\"string\" name=\"PRECFOCK\"></i>"
+            return b"<i type=\"string\" name=\"PRECFOCK\"></i>"
 
 class Vasprun(object):
+    # The version is written in <generator> at the top of vasprun.xml.
+    HEADER_SIZE = 65536
+
     def __init__(self, fileptr, use_expat=False):
         self._fileptr = fileptr
         self._use_expat = use_expat
@@ -634,11 +884,11 @@ class Vasprun(object):
         if self._use_expat:
             return self._parse_expat_vasprun_xml()
         else:
-            vasprun_etree = self._parse_etree_vasprun_xml(tag='varray')
+            vasprun_etree = self._parse_etree_vasprun_xml(tags=('varray',))
             return self._get_forces(vasprun_etree)
 
     def read_force_constants(self):
-        vasprun = self._parse_etree_vasprun_xml()
+        vasprun = self._parse_etree_vasprun_xml(tags=('array', 'varray'))
         return self._get_force_constants(vasprun)
 
     def _get_forces(self, vasprun_etree):
@@ -648,9 +898,17 @@ class Vasprun(object):
         forces = []
         for event, element in vasprun_etree:
             if element.attrib['name'] == 'forces':
-                for v in element:
-                    forces.append([float(x) for x in v.text.split()])
-        return np.array(forces)
+                forces.append(self._get_varray(element))
+        if forces:
+            return np.vstack(forces)
+        else:
+            return np.array(forces)
+
+    def _get_varray(self, element):
+        """Values of <v> of a <varray> converted at once"""
+        rows = [v.text for v in element.findall('./v')]
+        values = np.array(" ".join(rows).split(), dtype='double')
+        return values.reshape(len(rows), -1)
 
     def _get_force_constants(self, vasprun_etree):
         fc_tmp = None
@@ -668,29 +926,19 @@ class Vasprun(object):
             # Get Hessian matrix (normalized by masses)
             if element.tag == 'varray':
                 if element.attrib['name'] == 'hessian':
-                    fc_tmp = []
-                    for v in element.findall('./v'):
-                        fc_tmp.append([float(x)
-                                       for x in v.text.strip().split()])
+                    fc_tmp = self._get_varray(element)
 
         if fc_tmp is None:
             return False
         else:
-            fc_tmp = np.array(fc_tmp)
             if fc_tmp.shape != (num_atom * 3, num_atom * 3):
                 return False
-            # num_atom = fc_tmp.shape[0] / 3
-            force_constants = np.zeros((num_atom, num_atom, 3, 3),
-                                       dtype='double')
-
-            for i in range(num_atom):
-                for j in range(num_atom):
-                    force_constants[i, j] = fc_tmp[i*3:(i+1)*3, j*3:(j+1)*3]
+            force_constants = _hessian_to_force_constants(fc_tmp, num_atom)
+            del fc_tmp
 
             # Inverse normalization by atomic weights
-            for i in range(num_atom):
-                for j in range(num_atom):
-                    force_constants[i, j] *= -np.sqrt(masses[i] * masses[j])
+            sqrt_masses = np.sqrt(np.outer(masses, masses))
+            force_constants *= -sqrt_masses[:, :, None, None]
 
             return force_constants, elements
 
@@ -713,23 +961,50 @@ class Vasprun(object):
 
         return None
 
-    def _parse_etree_vasprun_xml(self, tag=None):
+    def _parse_etree_vasprun_xml(self, tags=None):
         if self._is_version528():
-            return self._parse_by_etree(VasprunWrapper(self._fileptr), tag=tag)
+            return self._parse_by_etree(VasprunWrapper(self._fileptr),
+                                        tags=tags)
         else:
-            return self._parse_by_etree(self._fileptr, tag=tag)
+            return self._parse_by_etree(self._fileptr, tags=tags)
 
-    def _parse_by_etree(self, fileptr, tag=None):
+    def _parse_by_etree(self, fileptr, tags=None):
+        """Yield (event, element) at the end of elements of tags
+
+        The tree is not kept. An element of tags is cleared after it is
+        consumed, i.e., when the next one is requested, and the children
+        of the root, e.g. <calculation>, are removed when they end. With
+        tags=None, every element is yielded and only the latter is done
+        since elements are still needed by their ancestors.
+
+        """
         try:
             import xml.etree.cElementTree as etree
-            for event, elem in etree.iterparse(fileptr):
-                if tag is None or elem.tag == tag:
-                    yield event, elem
         except ImportError:
-            print("Python 2.5 or later is needed.")
-            print("For creating FORCE_SETS file with Python 2.4, you can use "
-                  "phonopy 1.8.5.1 with python-lxml .")
-            sys.exit(1)
+            try:
+                import xml.etree.ElementTree as etree
+            except ImportError:
+                print("Python 2.5 or later is needed.")
+                print("For creating FORCE_SETS file with Python 2.4, you can "
+                      "use phonopy 1.8.5.1 with python-lxml .")
+                sys.exit(1)
+
+        root = None
+        depth = 0
+        for event, elem in etree.iterparse(fileptr, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                depth += 1
+                continue
+
+            depth -= 1
+            if tags is None or elem.tag in tags:
+                yield event, elem
+                if tags is not None:
+                    elem.clear()
+            if depth == 1:
+                root.clear()
 
     def _parse_expat_vasprun_xml(self):
         if self._is_version528():
@@ -738,15 +1013,21 @@ class Vasprun(object):
             return self._parse_by_expat(self._fileptr)
 
     def _parse_by_expat(self, fileptr):
-        vasprun = VasprunxmlExpat(fileptr)
+        vasprun = VasprunxmlExpat(fileptr,
+                                  quantities=('forces',),
+                                  is_last_only=True)
         vasprun.parse()
         return vasprun.get_forces()[-1]
 
     def _is_version528(self):
-        for line in self._fileptr:
-            if '\"version\"' in str(line):
-                self._fileptr.seek(0)
-                if '5.2.8' in str(line):
+        # Only the header is read, not the whole file.
+        header = self._fileptr.read(self.HEADER_SIZE)
+        self._fileptr.seek(0)
+        if isinstance(header, bytes):
+            header = header.decode('latin-1')
+        for line in header.splitlines():
+            if '\"version\"' in line:
+                if '5.2.8' in line:
                     sys.stdout.write(
                         "\n"
                         "**********************************************\n"
@@ -755,9 +1036,73 @@ class Vasprun(object):
                     return True
                 else:
                     return False
+        return False
+
+class _ArrayStack(object):
+    """Arrays of the same shape stacked in a preallocated buffer
+
+    The buffer grows by doubling. With is_last_only=True, only the array
+    appended last is kept, so memory does not grow with the number of
+    ionic steps.
+
+    """
+    def __init__(self, is_last_only=False):
+        self._is_last_only = is_last_only
+        self._buffer = None
+        self._num = 0
+
+    def append(self, array):
+        if self._is_last_only or self._buffer is None:
+            if self._is_last_only:
+                size = 1
+            else:
+                size = 4
+            self._buffer = np.empty((size,) + array.shape, dtype='double')
+            self._num = 0
+        elif self._num == len(self._buffer):
+            buffer = np.empty((self._num * 2,) + self._buffer.shape[1:],
+                              dtype='double')
+            buffer[:self._num] = self._buffer
+            self._buffer = buffer
+        self._buffer[self._num] = array
+        self._num += 1
+
+    def get(self):
+        if self._buffer is None:
+            return np.array([])
+        return self._buffer[:self._num]
+
+class _RowBuffer(object):
+    """Rows of numbers of one <varray> or <energy> in a numpy buffer"""
+    def __init__(self, num_rows=None):
+        self._num_rows = num_rows
+        self._buffer = None
+        self._num = 0
+
+    def append(self, row):
+        if self._buffer is None:
+            self._buffer = np.empty((self._num_rows or 4, len(row)),
+                                    dtype='double')
+        elif self._num == len(self._buffer):
+            buffer = np.empty((self._num * 2, self._buffer.shape[1]),
+                              dtype='double')
+            buffer[:self._num] = self._buffer
+            self._buffer = buffer
+        self._buffer[self._num] = row
+        self._num += 1
+
+    def get(self):
+        if self._buffer is None:
+            return np.zeros((0, 0), dtype='double')
+        return self._buffer[:self._num]
 
 class VasprunxmlExpat(object):
-    def __init__(self, fileptr):
+    # Quantities that can be selected by the quantities argument
+    QUANTITIES = ('forces', 'stress', 'points', 'lattice', 'symbols',
+                  'energies', 'epsilon', 'born', 'efermi', 'k_weights',
+                  'eigenvalues', 'projectors')
+
+    def __init__(self, fileptr, quantities=None, is_last_only=False):
         """Parsing vasprun.xml by Expat
 
         Args:
@@ -766,12 +1111,28 @@ class VasprunxmlExpat(object):
 
                import io
                io.open(filename, "rb")
+           quantities: Names in QUANTITIES to be collected. None collects
+               all of them. Elements of other quantities are not
+               processed.
+           is_last_only: Keep only the last ionic step of forces, stress,
+               points, lattice and energies. The getters then return
+               arrays with one step, so that [-1] works in both cases.
 
         """
 
         import xml.parsers.expat
 
         self._fileptr = fileptr
+        if quantities is None:
+            self._quantities = set(self.QUANTITIES)
+        else:
+            for q in quantities:
+                if q not in self.QUANTITIES:
+                    raise ValueError("Unknown quantity of vasprun.xml: %s" % q)
+            self._quantities = set(quantities)
+        # Number of atoms is needed to preallocate buffers of varrays.
+        if self._quantities & set(['forces', 'points']):
+            self._quantities.add('symbols')
 
         self._is_forces = False
         self._is_stress = False
@@ -797,20 +1158,16 @@ class VasprunxmlExpat(object):
         self._is_projected = False
         self._is_proj_eig = False
 
-        self._all_forces = []
-        self._all_stress = []
-        self._all_points = []
-        self._all_lattice = []
+        self._all_forces = _ArrayStack(is_last_only)
+        self._all_stress = _ArrayStack(is_last_only)
+        self._all_points = _ArrayStack(is_last_only)
+        self._all_lattice = _ArrayStack(is_last_only)
         self._symbols = []
-        self._all_energies = []
-        self._born = []
-        self._forces = None
-        self._stress = None
-        self._points = None
-        self._lattice = None
+        self._all_energies = _ArrayStack(is_last_only)
+        self._born = None
+        self._rows = None
         self._energies = None
         self._epsilon = None
-        self._born_atom = None
         self._efermi = None
         self._k_weights = None
         self._eigenvalues = None
@@ -822,7 +1179,7 @@ class VasprunxmlExpat(object):
         self._p.buffer_text = True
         self._p.StartElementHandler = self._start_element
         self._p.EndElementHandler = self._end_element
-        self._p.CharacterDataHandler = self._char_data
+        self._p.CharacterDataHandler = None
 
     def parse(self):
         try:
@@ -833,31 +1190,35 @@ class VasprunxmlExpat(object):
             return True
 
     def get_forces(self):
-        return np.array(self._all_forces)
+        return self._all_forces.get()
 
     def get_stress(self):
-        return np.array(self._all_stress)
+        return self._all_stress.get()
 
     def get_epsilon(self):
-        return np.array(self._epsilon)
+        if self._epsilon is None:
+            return np.array(None)
+        return self._epsilon.get()
 
     def get_efermi(self):
         return self._efermi
 
     def get_born(self):
-        return np.array(self._born)
+        if self._born is None:
+            return np.array([])
+        return self._born.get().reshape(-1, 3, 3)
 
     def get_points(self):
-        return np.array(self._all_points)
+        return self._all_points.get()
 
     def get_lattice(self):
-        return np.array(self._all_lattice)
+        return self._all_lattice.get()
 
     def get_symbols(self):
         return self._symbols
 
     def get_energies(self):
-        return np.array(self._all_energies)
+        return self._all_energies.get()
 
     def get_k_weights(self):
         return self._k_weights
@@ -868,6 +1229,23 @@ class VasprunxmlExpat(object):
     def get_projectors(self):
         return self._projectors
 
+    def _is_wanted(self, quantity):
+        return quantity in self._quantities
+
+    def _get_num_atom_rows(self):
+        if self._symbols:
+            return len(self._symbols)
+        else:
+            return None
+
+    def _set_char_data_handler(self):
+        # Character data, most of which is white space between elements,
+        # is only handled inside elements whose values are collected.
+        if self._is_v or self._is_i or self._is_c or self._is_r:
+            self._p.CharacterDataHandler = self._char_data
+        else:
+            self._p.CharacterDataHandler = None
+
     def _start_element(self, name, attrs):
         # Used not to collect energies in <scstep>
         if name == 'scstep':
@@ -885,48 +1263,52 @@ class VasprunxmlExpat(object):
             self._is_epsilon or
             self._is_born or
             self._is_positions or
-            self._is_basis,
+            self._is_basis or
             self._is_k_weights):
             if name == 'v':
                 self._is_v = True
 
         if name == 'varray':
             if 'name' in attrs.keys():
-                if attrs['name'] == 'forces':
+                if attrs['name'] == 'forces' and self._is_wanted('forces'):
                     self._is_forces = True
-                    self._forces = []
+                    self._rows = _RowBuffer(self._get_num_atom_rows())
 
-                if attrs['name'] == 'stress':
+                if attrs['name'] == 'stress' and self._is_wanted('stress'):
                     self._is_stress = True
-                    self._stress = []
+                    self._rows = _RowBuffer(3)
 
-                if attrs['name'] == 'weights':
+                if (attrs['name'] == 'weights' and
+                    self._is_wanted('k_weights')):
                     self._is_k_weights = True
                     self._k_weights = []
 
-                if attrs['name'] == 'epsilon':
+                if attrs['name'] == 'epsilon' and self._is_wanted('epsilon'):
                     self._is_epsilon = True
-                    self._epsilon = []
+                    self._epsilon = _RowBuffer(3)
 
                 if not self._is_structure:
-                    if attrs['name'] == 'positions':
+                    if (attrs['name'] == 'positions' and
+                        self._is_wanted('points')):
                         self._is_positions = True
-                        self._points = []
+                        self._rows = _RowBuffer(self._get_num_atom_rows())
 
-                    if attrs['name'] == 'basis':
+                    if (attrs['name'] == 'basis' and
+                        self._is_wanted('lattice')):
                         self._is_basis = True
-                        self._lattice = []
+                        self._rows = _RowBuffer(3)
 
         if name == 'i':
             if 'name' in attrs.keys():
-                if attrs['name'] == 'efermi':
+                if attrs['name'] == 'efermi' and self._is_wanted('efermi'):
                     self._is_i = True
                     self._is_efermi = True
 
         if self._is_energy and name == 'i':
             self._is_i = True
 
-        if name == 'energy' and (not self._is_scstep):
+        if (name == 'energy' and (not self._is_scstep) and
+            self._is_wanted('energies')):
             self._is_energy = True
             self._energies = []
 
@@ -938,15 +1320,19 @@ class VasprunxmlExpat(object):
 
         if self._is_born and name == 'set':
             self._is_set = True
-            self._born_atom = []
 
         if name == 'array':
             if 'name' in attrs.keys():
-                if attrs['name'] == 'atoms':
+                if attrs['name'] == 'atoms' and self._is_wanted('symbols'):
                     self._is_symbols = True
 
-                if attrs['name'] == 'born_charges':
+                if (attrs['name'] == 'born_charges' and
+                    self._is_wanted('born')):
                     self._is_born = True
+                    rows = self._get_num_atom_rows()
+                    if rows is not None:
+                        rows *= 3
+                    self._born = _RowBuffer(rows)
 
         if self._is_projected and not self._is_proj_eig:
             if name == 'set':
@@ -981,17 +1367,19 @@ class VasprunxmlExpat(object):
             if name == 'r':
                 self._is_r = True
 
-        if name == 'projected':
+        if name == 'projected' and self._is_wanted('projectors'):
             self._is_projected = True
             self._projectors = []
 
         if name == 'eigenvalues':
             if self._is_projected:
                 self._is_proj_eig = True
-            else:
+            elif self._is_wanted('eigenvalues'):
                 self._is_eigenvalues = True
                 self._eigenvalues = []
 
+        self._set_char_data_handler()
+
     def _end_element(self, name):
         if name == 'scstep':
             self._is_scstep = False
@@ -1002,26 +1390,28 @@ class VasprunxmlExpat(object):
         if name == 'varray':
             if self._is_forces:
                 self._is_forces = False
-                self._all_forces.append(self._forces)
+                self._all_forces.append(self._rows.get())
 
             if self._is_stress:
                 self._is_stress = False
-                self._all_stress.append(self._stress)
+                self._all_stress.append(self._rows.get())
 
             if self._is_k_weights:
                 self._is_k_weights = False
 
             if self._is_positions:
                 self._is_positions = False
-                self._all_points.append(self._points)
+                self._all_points.append(self._rows.get())
 
             if self._is_basis:
                 self._is_basis = False
-                self._all_lattice.append(self._lattice)
+                self._all_lattice.append(self._rows.get())
 
             if self._is_epsilon:
                 self._is_epsilon = False
 
+            self._rows = None
+
         if name == 'array':
             if self._is_symbols:
                 self._is_symbols = False
@@ -1029,9 +1419,10 @@ class VasprunxmlExpat(object):
             if self._is_born:
                 self._is_born = False
 
-        if name == 'energy' and (not self._is_scstep):
+        if name == 'energy' and self._is_energy:
             self._is_energy = False
-            self._all_energies.append(self._energies)
+            self._all_energies.append(np.array(self._energies,
+                                               dtype='double'))
 
         if name == 'v':
             self._is_v = False
@@ -1063,38 +1454,25 @@ class VasprunxmlExpat(object):
 
         if name == 'set':
             self._is_set = False
-            if self._is_born:
-                self._born.append(self._born_atom)
-                self._born_atom = None
+
+        self._set_char_data_handler()
 
     def _char_data(self, data):
         if self._is_v:
-            if self._is_forces:
-                self._forces.append(
-                    [float(x) for x in data.split()])
+            if self._is_forces or self._is_stress:
+                self._rows.append([float(x) for x in data.split()])
 
-            if self._is_stress:
-                self._stress.append(
-                    [float(x) for x in data.split()])
+            if self._is_positions or self._is_basis:
+                self._rows.append([float(x) for x in data.split()])
 
             if self._is_epsilon:
-                self._epsilon.append(
-                    [float(x) for x in data.split()])
-
-            if self._is_positions:
-                self._points.append(
-                    [float(x) for x in data.split()])
-
-            if self._is_basis:
-                self._lattice.append(
-                    [float(x) for x in data.split()])
+                self._epsilon.append([float(x) for x in data.split()])
 
             if self._is_k_weights:
                 self._k_weights.append(float(data))
 
             if self._is_born:
-                self._born_atom.append(
-                    [float(x) for x in data.split()])
+                self._born.append([float(x) for x in data.split()])
 
         if self._is_i:
             if self._is_energy:
@@ -1118,30 +1496,430 @@ class VasprunxmlExpat(object):
                 self._eigenvalues[s][k].append(vals)
 
 
+#
+# PWmat MOVEMENT
+#
+class Movement(object):
+    """Frames of PWmat MOVEMENT with random access
+
+    On the first pass, the byte offsets of the frames and of their
+    lattice, position and force blocks are found and cached in
+    MOVEMENT.index.npz next to the file. The cache is used as long as the
+    size and modification time of MOVEMENT match; if MOVEMENT has grown,
+    e.g. of a running MD, only the new part is scanned, provided the
+    cached frames still start where they did and the title of the first
+    frame is unchanged. Otherwise, e.g. for MOVEMENT overwritten by a
+    restarted MD, the whole file is scanned again. Values are
+    converted from a memory map for the requested frames only.
+
+    Frame indices are an integer, a slice or a sequence of integers;
+    for an integer one frame is returned, otherwise arrays of frames:
+
+        movement = Movement("MOVEMENT")
+        positions = movement.get_positions(-1)       # (num_atom, 3)
+        forces = movement.get_forces(slice(0, None, 10))  # (n, num_atom, 3)
+
+    Positions are fractional, lattice vectors are rows in Angstrom,
+    forces are in eV/Angstrom (MOVEMENT stores -force as OUT.FORCE) and
+    energies are the values of "Etot,Ep,Ek (eV)" in the frame title.
+
+    """
+    FRAME_MARKER = b"atoms,Iteration"
+    SECTION_MARKERS = (b"Lattice vector", b"Position", b"Force")
+    INDEX_VERSION = 2
+
+    def __init__(self, filename="MOVEMENT", use_cache=True):
+        self._filename = filename
+        self._index_filename = filename + ".index.npz"
+        self._use_cache = use_cache
+        self._mmap = None
+        self._open()
+        self._read_index()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_mmap'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def get_number_of_frames(self):
+        return len(self)
+
+    def get_number_of_atoms(self):
+        return self._num_atom
+
+    def get_atomic_numbers(self):
+        lines = self._get_block_lines(0, 2, self._num_atom)
+        return np.array([int(line.split()[0]) for line in lines], dtype='intc')
+
+    def get_frame_offsets(self):
+        """Byte offsets of frames and of their lattice, position and force
+        blocks, shape (num_frames, 4)"""
+        return self._offsets
+
+    def get_lattice(self, index):
+        return self._get_frames(index, self._parse_lattice)
+
+    def get_positions(self, index):
+        return self._get_frames(index, self._parse_positions)
+
+    def get_forces(self, index):
+        return self._get_frames(index, self._parse_forces)
+
+    def get_energies(self, index):
+        return self._get_frames(index, self._parse_energies)
+
+    def _get_frames(self, index, parse):
+        indices = np.arange(len(self))[index]
+        if indices.ndim == 0:
+            return parse([indices])[0]
+        return parse(indices)
+
+    def _parse_lattice(self, indices):
+        lattices = []
+        for i in indices:
+            lines = self._get_block_lines(i, 0, 3)
+            lattices.append([[float(x) for x in line.split()[:3]]
+                             for line in lines])
+        return np.array(lattices, dtype='double').reshape(-1, 3, 3)
+
+    def _parse_positions(self, indices):
+        return self._parse_atom_rows(indices, 1)
+
+    def _parse_forces(self, indices):
+        return -self._parse_atom_rows(indices, 2)
+
+    def _parse_atom_rows(self, indices, section):
+        num_atom = self._num_atom
+        blocks = []
+        for i in indices:
+            blocks.append(b" ".join(self._get_block_lines(i, section, num_atom)))
+        values = np.array(b" ".join(blocks).split(), dtype='double')
+        return values.reshape(len(indices), num_atom, -1)[:, :, 1:4].copy()
+
+    def _parse_energies(self, indices):
+        energies = []
+        for i in indices:
+            start = self._offsets[i, 0]
+            title = self._mmap[start:self._mmap.find(b"\n", start)]
+            values = title.split(b"=")[2].split(b",")[0].split()
+            energies.append([float(x) for x in values])
+        return np.array(energies, dtype='double')
+
+    def _get_block_lines(self, index, section, num_lines):
+        start = self._offsets[index, section + 1]
+        if start < 0:
+            raise ValueError("%s block of frame %d not found in %s." %
+                             (self.SECTION_MARKERS[section].decode(),
+                              index + 1, self._filename))
+        end = start
+        for i in range(num_lines):
+            end = _get_next_line(self._mmap, end)
+        return self._mmap[start:end].splitlines()
+
+    def _open(self):
+        import mmap
+        with open(self._filename, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _read_index(self):
+        stat = os.stat(self._filename)
+        offsets = None
+        if self._use_cache and os.path.exists(self._index_filename):
+            try:
+                index = np.load(self._index_filename)
+                if int(index['version']) == self.INDEX_VERSION:
+                    size = int(index['size'])
+                    mtime = float(index['mtime'])
+                    if size == stat.st_size and mtime == stat.st_mtime:
+                        offsets = index['offsets']
+                    elif (size < stat.st_size and
+                          len(index['offsets']) > 0 and
+                          self._is_prefix(index['offsets'],
+                                          index['title'].item())):
+                        # Scan only from the last frame, which may have
+                        # been incomplete.
+                        offsets = index['offsets']
+                        offsets = np.vstack(
+                            (offsets[:-1], self._scan(offsets[-1, 0])))
+                        self._write_index(offsets, stat)
+            except (IOError, OSError, KeyError, ValueError):
+                offsets = None
+
+        if offsets is None:
+            offsets = self._scan(0)
+            if self._use_cache:
+                self._write_index(offsets, stat)
+
+        self._offsets = np.array(offsets, dtype='int64').reshape(-1, 4)
+        if len(self._offsets) > 0:
+            start = self._offsets[0, 0]
+            self._num_atom = int(self._mmap[start:start + 64].split()[0])
+        else:
+            self._num_atom = 0
+
+    def _write_index(self, offsets, stat):
+        if len(offsets) > 0:
+            title = self._get_title(offsets[0, 0])
+        else:
+            title = b""
+        try:
+            with open(self._index_filename, 'wb') as f:
+                np.savez(f,
+                         version=self.INDEX_VERSION,
+                         size=stat.st_size,
+                         mtime=stat.st_mtime,
+                         title=np.array(title),
+                         offsets=offsets)
+        except (IOError, OSError): # e.g. read-only directory
+            pass
+
+    def _get_title(self, start):
+        return self._mmap[start:_get_next_line(self._mmap, start)].rstrip()
+
+    def _is_prefix(self, offsets, title):
+        """Whether the cached frames are still those of the file"""
+        if offsets[-1, 0] >= len(self._mmap):
+            return False
+        if self._get_title(offsets[0, 0]) != title:
+            return False
+        for start in offsets[:, 0]:
+            if (start > 0 and self._mmap[start - 1:start] != b"\n" or
+                self.FRAME_MARKER not in self._get_title(start)):
+                return False
+        return True
+
+    def _scan(self, pos):
+        """Offsets of frames starting after pos"""
+        mm = self._mmap
+        offsets = []
+        pos = mm.find(self.FRAME_MARKER, pos)
+        while pos > -1:
+            frame_start = mm.rfind(b"\n", 0, pos) + 1
+            next_frame = mm.find(self.FRAME_MARKER, pos + 1)
+            if next_frame < 0:
+                frame_end = len(mm)
+            else:
+                frame_end = mm.rfind(b"\n", 0, next_frame) + 1
+            row = [frame_start]
+            for marker in self.SECTION_MARKERS:
+                i = mm.find(marker, frame_start, frame_end)
+                if i < 0:
+                    row.append(-1)
+                else:
+                    row.append(_get_next_line(mm, i))
+            offsets.append(row)
+            pos = next_frame
+        return np.array(offsets, dtype='int64').reshape(-1, 4)
+
 #
 # XDATCAR
 #
+class Xdatcar(object):
+    """Frames of XDATCAR read on demand from a memory map
+
+    Only the byte offsets of the frames are found when the file is
+    opened. Positions of a frame, or of a chunk of frames, are converted
+    when they are requested, so a trajectory much larger than the memory
+    can be processed frame by frame, strided or sliced. For a
+    variable-cell XDATCAR, which repeats the header before every frame,
+    the lattice of each frame is read from its own header.
+
+    Lattice vectors are given as rows. An Xdatcar can be pickled, e.g.
+    sent to worker processes, which map the file again and share the
+    offsets.
+
+        xdatcar = Xdatcar("XDATCAR")
+        for positions, lattice in xdatcar.iter_frames(step=10):
+            ...
+
+    """
+    # comment, scale, three lattice vectors, symbols, numbers of atoms
+    HEADER_LINES = 7
+
+    def __init__(self, filename="XDATCAR"):
+        self._filename = filename
+        self._mmap = None
+        self._open()
+        self._read_header()
+        self._find_frames()
+
+    def __len__(self):
+        return len(self._frame_starts)
+
+    def __iter__(self):
+        return self.iter_frames()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_mmap'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def get_symbols(self):
+        return self._symbols
+
+    def get_numbers_of_atoms(self):
+        return self._numbers_of_atoms
+
+    def get_number_of_atoms(self):
+        return self._num_atom
+
+    def get_number_of_frames(self):
+        return len(self)
+
+    def is_variable_cell(self):
+        return self._is_variable_cell
+
+    def get_frame_offsets(self):
+        """Byte offsets of the first position line of the frames"""
+        return self._frame_starts
+
+    def get_positions(self, index):
+        """Positions of a frame as written (Direct or Cartesian)"""
+        return self._get_positions_block([self._check_index(index)])[0]
+
+    def get_lattice(self, index=0):
+        if not self._is_variable_cell:
+            return self._lattice.copy()
+        index = self._check_index(index)
+        end = self._config_starts[index]
+        start = end
+        for i in range(self.HEADER_LINES):
+            start = self._mmap.rfind(b"\n", 0, start - 1) + 1
+        return self._parse_lattice(self._mmap[start:end].splitlines())
+
+    def iter_frames(self, start=0, stop=None, step=1):
+        """Yield positions and lattice of frames in range(start, stop, step)"""
+        for i in range(*slice(start, stop, step).indices(len(self))):
+            yield self.get_positions(i), self.get_lattice(i)
+
+    def iter_chunks(self, chunk_size=1000, start=0, stop=None, step=1):
+        """Yield frame indices, positions and lattices of chunks of frames
+
+        Positions are of shape (n, num_atom, 3) and lattices (n, 3, 3)
+        with n <= chunk_size. The positions of a chunk are converted at
+        once.
+
+        """
+        indices = np.arange(len(self))[slice(start, stop, step)]
+        for i in range(0, len(indices), chunk_size):
+            chunk = indices[i:i + chunk_size]
+            lattices = np.array([self.get_lattice(j) for j in chunk],
+                                dtype='double').reshape(-1, 3, 3)
+            yield chunk, self._get_positions_block(chunk), lattices
+
+    def _open(self):
+        import mmap
+        with open(self._filename, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _check_index(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("Frame index out of range.")
+        return index
+
+    def _read_header(self):
+        lines = self._mmap[:_get_next_line(
+            self._mmap, self._nth_line(self.HEADER_LINES - 1))].splitlines()
+        self._lattice = self._parse_lattice(lines)
+        self._symbols = [x.decode('latin-1') for x in lines[5].split()]
+        self._numbers_of_atoms = np.array(
+            [int(x) for x in lines[6].split()[:len(self._symbols)]],
+            dtype='intc')
+        self._num_atom = self._numbers_of_atoms.sum()
+
+    def _nth_line(self, n):
+        pos = 0
+        for i in range(n):
+            pos = _get_next_line(self._mmap, pos)
+        return pos
+
+    def _parse_lattice(self, lines):
+        scale = float(lines[1])
+        lattice = [[float(x) for x in line.split()[:3]] for line in lines[2:5]]
+        return np.array(lattice, dtype='double') * scale
+
+    def _find_frames(self):
+        mm = self._mmap
+        config_starts = []
+        frame_starts = []
+        pos = mm.find(b"configuration")
+        while pos > -1:
+            config_starts.append(mm.rfind(b"\n", 0, pos) + 1)
+            pos = _get_next_line(mm, pos)
+            frame_starts.append(pos)
+            pos = mm.find(b"configuration", pos)
+        config_starts.append(len(mm))
+        self._config_starts = np.array(config_starts, dtype='int64')
+        self._frame_starts = np.array(frame_starts, dtype='int64')
+
+        # A header between the first two frames means variable cell.
+        self._is_variable_cell = False
+        if len(frame_starts) > 1:
+            num_lines = mm[frame_starts[0]:config_starts[1]].count(b"\n")
+            self._is_variable_cell = (num_lines > self._num_atom)
+
+    def _get_positions_block(self, indices):
+        num_atom = self._num_atom
+        blocks = []
+        for i in indices:
+            block = self._mmap[self._frame_starts[i]:self._config_starts[i + 1]]
+            if self._is_variable_cell: # Drop the header of the next frame
+                block = b"\n".join(block.split(b"\n", num_atom)[:num_atom])
+            blocks.append(block)
+        values = np.array(b" ".join(blocks).split(), dtype='double')
+        return values.reshape(len(indices), num_atom, -1)[:, :, :3]
+
 def read_XDATCAR(filename="XDATCAR"):
-    lattice = None
-    symbols = None
-    numbers_of_atoms = None
-    with open(filename) as f:
-        f.readline()
-        scale = float(f.readline())
-        a = [float(x) for x in f.readline().split()[:3]]
-        b = [float(x) for x in f.readline().split()[:3]]
-        c = [float(x) for x in f.readline().split()[:3]]
-        lattice = np.transpose([a, b, c]) * scale
-        symbols = f.readline().split()
-        numbers_of_atoms = np.array(
-            [int(x) for x in f.readline().split()[:len(symbols)]], dtype='intc')
-
-    if lattice is not None:
-        data = np.loadtxt(filename, skiprows=7, comments='D')
-        return (data.reshape((-1, numbers_of_atoms.sum(), 3)),
-                np.array(lattice, dtype='double', order='C'))
+    """Positions of all frames and the lattice (column vectors)
+
+    Use Xdatcar to go through long trajectories frame by frame.
+
+    """
+    with Xdatcar(filename) as xdatcar:
+        num_atom = xdatcar.get_number_of_atoms()
+        positions = [chunk for i, chunk, lattices in xdatcar.iter_chunks()]
+        lattice = xdatcar.get_lattice(0)
+    if positions:
+        positions = np.concatenate(positions)
     else:
-        return None
+        positions = np.zeros((0, num_atom, 3), dtype='double')
+    return (positions,
+            np.array(lattice.T, dtype='double', order='C'))
 
 #
 # OUTCAR handling (obsolete)
@@ -1150,28 +1928,34 @@ def read_force_constant_OUTCAR(filename):
     return get_force_constants_OUTCAR(filename)
 
 def get_force_constants_OUTCAR(filename):
-    file = open(filename)
-    while 1:
-        line = file.readline()
-        if line == '':
-            print("Force constants could not be found.")
-            return 0
+    with _mmap_OUTCAR(filename) as outcar:
+        if outcar[:19] == b" SECOND DERIVATIVES":
+            pos = 0
+        else:
+            pos = outcar.rfind(b"\n SECOND DERIVATIVES")
+            if pos < 0:
+                print("Force constants could not be found.")
+                return 0
+            pos += 1
 
-        if line[:19] == " SECOND DERIVATIVES":
-            break
+        pos = _get_next_line(outcar, _get_next_line(outcar, pos))
+        num_atom = int(_get_lines(outcar, pos, 1)[0].split()[-1][:-1])
+        pos = _get_next_line(outcar, pos)
+        fc_tmp = _lines_to_array(_get_lines(outcar, pos, num_atom * 3),
+                                 num_labels=1)
 
-    file.readline()
-    num_atom = int(((file.readline().split())[-1].strip())[:-1])
+    force_constants = _hessian_to_force_constants(fc_tmp, num_atom)
+    force_constants *= -1
 
-    fc_tmp = []
-    for i in range(num_atom * 3):
-        fc_tmp.append([float(x) for x in (file.readline().split())[1:]])
+    return force_constants
 
-    fc_tmp = np.array(fc_tmp)
+def _hessian_to_force_constants(hessian, num_atom):
+    """(3N, 3N) matrix to C-contiguous (N, N, 3, 3) force constants
 
-    force_constants = np.zeros((num_atom, num_atom, 3, 3), dtype=float)
-    for i in range(num_atom):
-        for j in range(num_atom):
-            force_constants[i, j] = -fc_tmp[i*3:(i+1)*3, j*3:(j+1)*3]
+    fc[i, j, a, b] = hessian[3i + a, 3j + b]. The reshape and transpose
+    are views, so only the returned array is allocated.
 
-    return force_constants
+    """
+    return np.array(
+        hessian.reshape(num_atom, 3, num_atom, 3).transpose(0, 2, 1, 3),
+        dtype='double', order='C')
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+"""Mode Gruneisen parameters with PWmat
+
+    PWmatRunPhonopy.py gruneisen [--strain 0.01]
+    PWmatRunPhonopy.py gruneisen --collect [--wait 600] [--hdf5]
+
+Run in the directory of etot.input, atom.config, the pseudopotentials and
+pwmat2phonopy.in, the first command creates gruneisen/orig, gruneisen/plus
+and gruneisen/minus with the unit cell of atom.config and the unit cell
+scaled isotropically to 1 + strain and 1 - strain times its volume. The
+displacements of orig are used for all three volumes (see
+pwmat_qha.create_volumes). The supercell SCF runs of the three volumes
+are listed in gruneisen/jobs.list and submitted as one PBS job array, so
+they run side by side instead of one phonon calculation after another.
+The pseudopotentials are copied once to gruneisen/ and linked into the
+jobs.
+
+The second command creates FORCE_SETS of every volume whose forces are
+all there. Once all three are, the mode Gruneisen parameters are
+calculated by pwmat2phonopy.gruneisen for the dynamical matrices of the
+three volumes built block by block of q-points, along BAND of
+pwmat2phonopy.in (gruneisen/gruneisen_band.yaml) and on its MP mesh
+(gruneisen/gruneisen.yaml, and gruneisen.hdf5 with --hdf5), in the
+formats of phonopy-gruneisen. With BORN = .TRUE. in pwmat2phonopy.in, a
+BORN file has to be put in the phonon directory of each volume.
+
+"""
+
+import os
+import sys
+import time
+from optparse import OptionParser
+
+__author__  = "Paul Chern"
+__email__   = "peng.chen.iphy@gmail.com"
+__licence__ = "GPL"
+__date__    = "Nov. 2017"
+
+DIRECTORIES = ('orig', 'plus', 'minus')
+
+def get_gruneisen_parser():
+    parser = OptionParser(usage="PWmatRunPhonopy.py gruneisen [options]")
+    parser.set_defaults(gruneisen_dir="gruneisen",
+                        strain=0.01,
+                        queue="test",
+                        is_submit=True,
+                        is_collect=False,
+                        wait=None,
+                        is_hdf5=False)
+    parser.add_option(
+        "--dir", dest="gruneisen_dir", type="string",
+        help="Directory of the calculation")
+    parser.add_option(
+        "--strain", dest="strain", type="float",
+        help="Volumes are 1 + strain and 1 - strain times that of "
+        "atom.config")
+    parser.add_option(
+        "--queue", dest="queue", type="string",
+        help="PBS queue")
+    parser.add_option(
+        "--no_submit", dest="is_submit", action="store_false",
+        help="Prepare the job array without submitting it")
+    parser.add_option(
+        "--collect", dest="is_collect", action="store_true",
+        help="Collect finished volumes, and calculate the Gruneisen "
+        "parameters when all are done")
+    parser.add_option(
+        "--wait", dest="wait", type="int",
+        help="With --collect, collect every WAIT seconds until all are done")
+    parser.add_option(
+        "--hdf5", dest="is_hdf5", action="store_true",
+        help="Write gruneisen.hdf5 of the mesh too")
+    return parser
+
+def get_volume_scales(strain):
+    """Volume ratios of orig, plus and minus"""
+    return [1.0, 1.0 + strain, 1.0 - strain]
+
+def prepare(options, log_level=1):
+    """Create the three volumes, displacements and job array"""
+    from pwmat2phonopy.interface.pwmat_qha import (read_inputs,
+                                                   create_volumes,
+                                                   submit_jobs,
+                                                   write_state)
+
+    gruneisen_dir = os.path.abspath(options.gruneisen_dir)
+    inputs = read_inputs(gruneisen_dir)
+    if inputs is None:
+        return 1
+    etot_input, pwmat2phonopy, confs_scf = inputs
+
+    scales = get_volume_scales(options.strain)
+    volumes = create_volumes(gruneisen_dir,
+                             DIRECTORIES,
+                             scales,
+                             etot_input,
+                             pwmat2phonopy,
+                             confs_scf,
+                             log_level=log_level)
+    pwmat2phonopy.creat_phonopy_conf(
+        filename=os.path.join(gruneisen_dir, 'band_dos.conf'))
+    state = {'directories': list(DIRECTORIES),
+             'scales': scales,
+             'volumes': volumes['volumes'],
+             'num_forces': volumes['num_forces'],
+             'is_shared_displacements': volumes['is_shared_displacements'],
+             'is_force_sets': [False] * len(DIRECTORIES)}
+    write_state(gruneisen_dir, state, filename='gruneisen.json')
+
+    jobs = volumes['jobs']
+    submit_jobs(gruneisen_dir,
+                jobs,
+                confs_scf,
+                pwmat2phonopy,
+                options.queue,
+                'gruneisen',
+                is_submit=options.is_submit)
+
+    if log_level > 0:
+        print("%d PWmat runs of the three volumes are in %s/jobs.list%s." %
+              (len(jobs), options.gruneisen_dir,
+               ("" if options.is_submit else " (not submitted)")))
+        if pwmat2phonopy.get_is_born():
+            print("Please put BORN of each volume in %s/*/phonon." %
+                  options.gruneisen_dir)
+        print("Please run PWmatRunPhonopy.py gruneisen --collect when they "
+              "are finished.")
+    return 0
+
+def collect(gruneisen_dir, log_level=1):
+    """Create FORCE_SETS of the finished volumes
+
+    Returns True when FORCE_SETS of all three volumes are there.
+
+    """
+    from pwmat2phonopy.interface.pwmat_qha import (create_force_sets,
+                                                   read_state,
+                                                   write_state)
+
+    state = read_state(gruneisen_dir, filename='gruneisen.json')
+    for i, directory in enumerate(state['directories']):
+        if not state['is_force_sets'][i]:
+            state['is_force_sets'][i] = create_force_sets(
+                os.path.join(gruneisen_dir, directory, 'phonon'),
+                state['num_forces'][i])
+    write_state(gruneisen_dir, state, filename='gruneisen.json')
+
+    num_done = state['is_force_sets'].count(True)
+    if log_level > 0:
+        print("%d of %d volumes are done." %
+              (num_done, len(state['directories'])))
+    return num_done == len(state['directories'])
+
+def load_phonons(gruneisen_dir, settings, log_level=0):
+    """Phonopy objects of orig, plus and minus with their force constants"""
+    import pwmat2phonopy.driver as driver
+    from pwmat2phonopy.interface.pwmat_qha import read_state
+
+    state = read_state(gruneisen_dir, filename='gruneisen.json')
+    cwd = os.getcwd()
+    phonons = []
+    for directory in state['directories']:
+        volume_dir = os.path.join(gruneisen_dir, directory)
+        settings.set_cell_filename(os.path.join(volume_dir, 'atom.config'))
+        os.chdir(os.path.join(volume_dir, 'phonon'))
+        try:
+            phonons.append(driver.load_phonopy(settings, log_level=log_level))
+        finally:
+            os.chdir(cwd)
+    return phonons
+
+def run_gruneisen(gruneisen_dir, is_hdf5=False, log_level=1):
+    """Mode Gruneisen parameters along the band paths and on the mesh
+
+    Returns the GruneisenBatch of the three volumes.
+
+    """
+    import numpy as np
+    import pwmat2phonopy.driver as driver
+    from phonopy.structure.grid_points import get_qpoints
+    from pwmat2phonopy.gruneisen import (GruneisenBatch,
+                                         get_band_distances,
+                                         get_frequencies,
+                                         write_gruneisen_band_yaml,
+                                         write_gruneisen_mesh_yaml,
+                                         write_gruneisen_mesh_hdf5)
+
+    settings = driver.load_settings(
+        filename=os.path.join(gruneisen_dir, 'band_dos.conf'))[0]
+    settings.set_calculator('pwmat')
+    phonon, phonon_plus, phonon_minus = load_phonons(gruneisen_dir, settings)
+    gruneisen = GruneisenBatch(phonon.get_dynamical_matrix(),
+                               phonon_plus.get_dynamical_matrix(),
+                               phonon_minus.get_dynamical_matrix())
+    factor = phonon.get_unit_conversion_factor()
+    primitive = phonon.get_primitive()
+    if log_level > 0 and not gruneisen.is_batch():
+        print("Dynamical matrices with non-analytical term correction are "
+              "built q-point by q-point.")
+
+    if settings.get_bands():
+        paths = [np.array(path, dtype='double')
+                 for path in settings.get_bands()]
+        distances = []
+        gammas = []
+        frequencies = []
+        for path in paths:
+            gamma, eigenvalues = gruneisen.run(path, is_band_connection=True)
+            distances.append(get_band_distances(path, primitive))
+            gammas.append(gamma)
+            frequencies.append(get_frequencies(eigenvalues, factor))
+        write_gruneisen_band_yaml(
+            paths, distances, gammas, frequencies,
+            filename=os.path.join(gruneisen_dir, 'gruneisen_band.yaml'))
+        if log_level > 0:
+            print("Gruneisen parameters along the band paths are written "
+                  "into %s." % os.path.join(gruneisen_dir,
+                                           'gruneisen_band.yaml'))
+
+    (mesh,
+     mesh_shift,
+     t_symmetry,
+     q_symmetry,
+     is_gamma_center) = settings.get_mesh()
+    if mesh is not None:
+        qpoints, weights = get_qpoints(
+            mesh,
+            np.linalg.inv(primitive.get_cell()),
+            q_mesh_shift=mesh_shift,
+            is_time_reversal=t_symmetry,
+            is_gamma_center=is_gamma_center,
+            rotations=phonon.get_primitive_symmetry(
+                ).get_pointgroup_operations(),
+            is_mesh_symmetry=q_symmetry)
+        gamma, eigenvalues = gruneisen.run(qpoints)
+        frequencies = get_frequencies(eigenvalues, factor)
+        filenames = [os.path.join(gruneisen_dir, 'gruneisen.yaml')]
+        write_gruneisen_mesh_yaml(mesh, qpoints, weights, gamma, frequencies,
+                                  filename=filenames[0])
+        if is_hdf5:
+            filenames.append(os.path.join(gruneisen_dir, 'gruneisen.hdf5'))
+            write_gruneisen_mesh_hdf5(mesh, qpoints, weights, gamma,
+                                      frequencies, filename=filenames[1])
+        if log_level > 0:
+            print("Gruneisen parameters of %d q-points on the mesh are "
+                  "written into %s." % (len(qpoints), " and ".join(filenames)))
+    return gruneisen
+
+def main(argv=None):
+    import pwmat2phonopy.driver as driver
+    from pwmat2phonopy.cui.show_log import print_error_message
+
+    parser = get_gruneisen_parser()
+    (options, args) = parser.parse_args(argv)
+    try:
+        if not options.is_collect:
+            return prepare(options)
+        gruneisen_dir = os.path.abspath(options.gruneisen_dir)
+        while not collect(gruneisen_dir):
+            if options.wait is None:
+                return 0
+            sys.stdout.flush()
+            time.sleep(options.wait)
+        run_gruneisen(gruneisen_dir, is_hdf5=options.is_hdf5)
+        return 0
+    except driver.DriverError as e:
+        print_error_message(str(e))
+        return 1
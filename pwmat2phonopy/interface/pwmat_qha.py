@@ -0,0 +1,502 @@
+#!/usr/bin/env python
+
+"""Quasi-harmonic volume sweep with PWmat
+
+    PWmatRunPhonopy.py qha [--volumes 7] [--range 0.06] [--tmax 1000]
+    PWmatRunPhonopy.py qha --collect [--wait 600]
+
+Run in the directory of etot.input, atom.config, the pseudopotentials and
+pwmat2phonopy.in, the first command creates qha/volume-001, ... with the
+unit cell scaled isotropically to volumes from 1 - range to 1 + range
+times its own. The displacements of the first volume are used for every
+volume of the same space group, which isotropic scaling keeps; a volume
+whose symmetry is found different gets its own. The supercell SCF runs of
+all volumes and one SCF run of the unit cell per volume (for E(V)) are
+listed in qha/jobs.list and submitted as one PBS job array. The
+pseudopotentials are copied once to qha/ and linked into the jobs.
+
+The second command can be run while the jobs are running: FORCE_SETS is
+created for every volume whose forces are all there, the thermal
+properties of these volumes are calculated in parallel by
+pwmat2phonopy.batch, and the total energies are read from REPORT of the
+finished unit cell runs. The progress is kept in qha/qha.json. Once all
+volumes are done, e-v.dat is written and phonopy's QHA is run in qha/,
+writing the same files as phonopy-qha.
+
+"""
+
+import os
+import sys
+import json
+import time
+from optparse import OptionParser
+
+__author__  = "Paul Chern"
+__email__   = "peng.chen.iphy@gmail.com"
+__licence__ = "GPL"
+__date__    = "Nov. 2017"
+
+def get_qha_parser():
+    parser = OptionParser(usage="PWmatRunPhonopy.py qha [options]")
+    parser.set_defaults(qha_dir="qha",
+                        num_volumes=7,
+                        volume_range=0.06,
+                        t_max=1000.0,
+                        t_step=10.0,
+                        queue="test",
+                        is_submit=True,
+                        is_collect=False,
+                        wait=None,
+                        num_workers=None,
+                        eos="vinet",
+                        pressure=0.0)
+    parser.add_option(
+        "--dir", dest="qha_dir", type="string",
+        help="Directory of the campaign")
+    parser.add_option(
+        "--volumes", dest="num_volumes", type="int",
+        help="Number of volumes")
+    parser.add_option(
+        "--range", dest="volume_range", type="float",
+        help="Volumes are 1 - range to 1 + range times that of atom.config")
+    parser.add_option(
+        "--tmax", dest="t_max", type="float",
+        help="Maximum temperature of the thermal properties")
+    parser.add_option(
+        "--tstep", dest="t_step", type="float",
+        help="Temperature step of the thermal properties")
+    parser.add_option(
+        "--queue", dest="queue", type="string",
+        help="PBS queue")
+    parser.add_option(
+        "--no_submit", dest="is_submit", action="store_false",
+        help="Prepare the job array without submitting it")
+    parser.add_option(
+        "--collect", dest="is_collect", action="store_true",
+        help="Collect finished volumes, and run QHA when all are done")
+    parser.add_option(
+        "--wait", dest="wait", type="int",
+        help="With --collect, collect every WAIT seconds until all are done")
+    parser.add_option(
+        "-j", "--jobs", dest="num_workers", type="int",
+        help="Processes for the thermal properties of the volumes")
+    parser.add_option(
+        "--eos", dest="eos", type="string",
+        help="Equation of state: vinet, murnaghan or birch_murnaghan")
+    parser.add_option(
+        "--pressure", dest="pressure", type="float",
+        help="Pressure in GPa")
+    return parser
+
+def get_volume_scales(num_volumes, volume_range):
+    """Volume ratios evenly spaced from 1 - volume_range to 1 + volume_range"""
+    import numpy as np
+
+    return np.linspace(1 - volume_range, 1 + volume_range, num_volumes)
+
+def get_job_dirname(i, pre_dirname='forces'):
+    return "{pre_dirname}-{0:0{width}}".format(i + 1,
+                                               pre_dirname=pre_dirname,
+                                               width=3)
+
+def read_inputs(campaign_dir):
+    """PWmat inputs of a campaign in the current directory
+
+    Returns the InputParser of etot.input, set up for the supercell SCF
+    runs, the pwmat2phonopyParser and the configures of etot.input as
+    they were read, or None after writing pwmat2phonopy.in to be edited.
+
+    """
+    import pwmat2phonopy.driver as driver
+    from pwmat2phonopy.interface import pwmat_run
+
+    for filename in ('etot.input', 'atom.config'):
+        driver.check_file_exists(filename)
+    etot_input = pwmat_run.InputParser(filename='etot.input')
+    pwmat2phonopy = pwmat_run.pwmat2phonopyParser(etotinput=etot_input)
+    if not os.path.exists('pwmat2phonopy.in'):
+        pwmat2phonopy.write_input()
+        print("pwmat2phonopy.in has been written. Please edit it and run "
+              "again.")
+        return None
+    pwmat2phonopy.read_input(filename='pwmat2phonopy.in')
+    if os.path.exists(campaign_dir):
+        raise driver.DriverError("%s exists already." % campaign_dir)
+    confs_scf = dict(etot_input.get_configures())
+    etot_input.set_configures(
+        'nodes', pwmat2phonopy.get_configures('nodes')['val'].strip())
+    etot_input.set_configures('job', 'scf')
+    etot_input.set_configures('in.atom', 'atom.config')
+    return etot_input, pwmat2phonopy, confs_scf
+
+def create_volumes(campaign_dir,
+                   directories,
+                   scales,
+                   etot_input,
+                   pwmat2phonopy,
+                   confs_scf,
+                   is_unitcell_scf=False,
+                   log_level=1):
+    """Scaled unit cells with their displacements and SCF inputs
+
+    atom.config is scaled isotropically by the volume ratios of scales
+    into campaign_dir/directory. The displacements of the first volume are
+    used for every volume of the same space group, which isotropic
+    scaling keeps; a volume whose symmetry is found different gets its
+    own. With is_unitcell_scf, directory/scf is an SCF run of the unit
+    cell. Returns the volumes, the numbers of displacements, whether
+    they are shared and the directories of the PWmat runs relative to
+    campaign_dir.
+
+    """
+    import pwmat2phonopy.driver as driver
+    from pwmat2phonopy.interface.pwmat import write_pwmat
+
+    dir0 = os.getcwd()
+    os.mkdir(campaign_dir)
+    num_random = pwmat2phonopy.get_random_displacements()
+    lines = ['DIM = ' + pwmat2phonopy.get_configures('dim')['val'].strip(),
+             'CREATE_DISPLACEMENTS = .TRUE.']
+    if num_random > 0:
+        lines.append('RANDOM_DISPLACEMENTS = %d' % num_random)
+    lines.append('')
+    with open(os.path.join(campaign_dir, 'disp.conf'), 'w') as w:
+        w.write("\n".join(lines))
+    settings = driver.load_settings(
+        filename=os.path.join(campaign_dir, 'disp.conf'))[0]
+    settings.set_calculator('pwmat')
+    settings.set_cell_filename(os.path.join(dir0, 'atom.config'))
+    unitcell = driver.read_cell(settings)[0]
+
+    volumes = {'volumes': [],
+               'num_forces': [],
+               'is_shared_displacements': [],
+               'jobs': []}
+    dataset = None
+    symmetry = None
+    for directory, scale in zip(directories, scales):
+        volume_dir = os.path.join(campaign_dir, directory)
+        os.mkdir(volume_dir)
+        cell = unitcell.copy()
+        cell.set_cell(unitcell.get_cell() * scale ** (1.0 / 3))
+        write_pwmat(os.path.join(volume_dir, 'atom.config'), cell)
+
+        os.chdir(volume_dir)
+        try:
+            settings.set_cell_filename('atom.config')
+            cell, optional_structure_file_information = driver.read_cell(
+                settings)
+            phonon = driver.init_phonopy(cell, settings)
+            is_shared = (dataset is not None and
+                         _get_symmetry(phonon) == symmetry)
+            displacements = driver.create_displacements(
+                phonon,
+                settings,
+                optional_structure_file_information,
+                displacement_dataset=(dataset if is_shared else None))
+            if dataset is None:
+                symmetry = _get_symmetry(phonon)
+                if num_random > 0:
+                    dataset = {'displacements': displacements}
+                else:
+                    dataset = phonon.get_displacement_dataset()
+        finally:
+            os.chdir(dir0)
+
+        etot_input.set_configures(
+            'mp_n123', pwmat2phonopy.get_configures('mp_n123')['val'].strip())
+        for j in range(len(displacements)):
+            job = os.path.join(directory, 'phonon', get_job_dirname(j))
+            etot_input.write_input(
+                os.path.join(campaign_dir, job, 'etot.input'))
+            volumes['jobs'].append(job)
+        if is_unitcell_scf:
+            scf_dir = os.path.join(volume_dir, 'scf')
+            os.mkdir(scf_dir)
+            write_pwmat(os.path.join(scf_dir, 'atom.config'), cell)
+            etot_input.set_configures('mp_n123', confs_scf['mp_n123'])
+            etot_input.write_input(os.path.join(scf_dir, 'etot.input'))
+            volumes['jobs'].append(os.path.join(directory, 'scf'))
+
+        volumes['volumes'].append(cell.get_volume())
+        volumes['num_forces'].append(len(displacements))
+        volumes['is_shared_displacements'].append(is_shared)
+        if log_level > 0:
+            print("%s: volume %10.4f, %d displacements%s" %
+                  (directory, cell.get_volume(), len(displacements),
+                   (" (shared)" if is_shared else "")))
+    return volumes
+
+def submit_jobs(campaign_dir,
+                jobs,
+                confs_scf,
+                pwmat2phonopy,
+                queue,
+                job_name,
+                is_submit=True):
+    """Stage the pseudopotentials and submit the runs as one PBS job array
+
+    The pseudopotentials in the current directory are copied once to
+    campaign_dir and linked into the jobs, which are listed in
+    campaign_dir/jobs.list for campaign_dir/job_name.pbs.
+
+    """
+    from pwmat2phonopy.interface import pwmat_run
+
+    dir0 = os.getcwd()
+    pwmat_run.stage_pseudopotentials(
+        confs_scf, dir0, campaign_dir,
+        [os.path.join(campaign_dir, job) for job in jobs])
+    with open(os.path.join(campaign_dir, 'jobs.list'), 'w') as w:
+        w.write("\n".join(jobs) + "\n")
+
+    nodes = pwmat2phonopy.get_configures('nodes')['val'].strip()
+    node1, node2 = [int(x) for x in nodes.split()[:2]]
+    wall_time = pwmat2phonopy.get_configures('wall_time')['val'].strip()
+    os.chdir(campaign_dir)
+    try:
+        pwmat_run.creat_pbs_array(ppn=node1 * node2,
+                                  queue=queue,
+                                  wall_time=wall_time,
+                                  num_jobs=len(jobs),
+                                  job_name=job_name,
+                                  job_list='jobs.list')
+        if is_submit:
+            import subprocess
+            subprocess.call(['qsub', '%s.pbs' % job_name])
+    finally:
+        os.chdir(dir0)
+
+def create_force_sets(phonon_dir, num_forces):
+    """Create FORCE_SETS of a volume once all its forces are there
+
+    Returns True when FORCE_SETS exists.
+
+    """
+    from pwmat2phonopy.interface import create_FORCE_SETS
+
+    force_sets_filename = os.path.join(phonon_dir, 'FORCE_SETS')
+    force_filenames = [
+        os.path.join(phonon_dir, get_job_dirname(j), 'OUT.FORCE')
+        for j in range(num_forces)]
+    if (not os.path.exists(force_sets_filename) and
+        all([os.path.exists(f) for f in force_filenames])):
+        create_FORCE_SETS('pwmat',
+                          force_filenames,
+                          disp_filename=os.path.join(phonon_dir, 'disp.yaml'),
+                          force_sets_filename=force_sets_filename)
+    return os.path.exists(force_sets_filename)
+
+def prepare(options, log_level=1):
+    """Create the volumes, displacements and job array of the campaign"""
+    import numpy as np
+    import pwmat2phonopy.driver as driver
+
+    qha_dir = os.path.abspath(options.qha_dir)
+    inputs = read_inputs(qha_dir)
+    if inputs is None:
+        return 1
+    etot_input, pwmat2phonopy, confs_scf = inputs
+
+    scales = get_volume_scales(options.num_volumes, options.volume_range)
+    directories = [get_job_dirname(i, pre_dirname='volume')
+                   for i in range(len(scales))]
+    volumes = create_volumes(qha_dir,
+                             directories,
+                             scales,
+                             etot_input,
+                             pwmat2phonopy,
+                             confs_scf,
+                             is_unitcell_scf=True,
+                             log_level=log_level)
+    for directory in directories:
+        pwmat2phonopy.creat_tprop_conf(
+            options.t_max,
+            options.t_step,
+            filename=os.path.join(qha_dir, directory, 'phonon', 'tprop.conf'))
+    state = {'directories': directories,
+             'scales': scales.tolist(),
+             'volumes': volumes['volumes'],
+             'num_forces': volumes['num_forces'],
+             'is_shared_displacements': volumes['is_shared_displacements'],
+             'energies': [None] * len(scales),
+             'is_thermal_properties': [False] * len(scales),
+             't_max': options.t_max,
+             't_step': options.t_step}
+
+    # Thermal properties are per primitive cell, E(V) per unit cell.
+    tprop_settings = driver.load_settings(
+        filename=os.path.join(qha_dir, directories[0], 'phonon',
+                              'tprop.conf'))[0]
+    primitive_matrix = tprop_settings.get_primitive_matrix()
+    if primitive_matrix is None:
+        state['factor'] = 1.0
+    else:
+        state['factor'] = 1.0 / abs(np.linalg.det(primitive_matrix))
+    write_state(qha_dir, state)
+
+    jobs = volumes['jobs']
+    submit_jobs(qha_dir,
+                jobs,
+                confs_scf,
+                pwmat2phonopy,
+                options.queue,
+                'qha',
+                is_submit=options.is_submit)
+
+    if log_level > 0:
+        print("%d PWmat runs of %d volumes are in %s/jobs.list%s." %
+              (len(jobs), len(scales), options.qha_dir,
+               ("" if options.is_submit else " (not submitted)")))
+        print("Please run PWmatRunPhonopy.py qha --collect when they are "
+              "finished.")
+    return 0
+
+def collect(qha_dir, num_workers=None, log_level=1):
+    """Collect the finished volumes of the campaign
+
+    Returns True when the energies and thermal properties of all volumes
+    are there.
+
+    """
+    from pwmat2phonopy.batch import run_batch
+    from pwmat2phonopy.interface.pwmat import read_pwmat_total_energy
+
+    state = read_state(qha_dir)
+    indices = []
+    for i, directory in enumerate(state['directories']):
+        volume_dir = os.path.join(qha_dir, directory)
+        scf_dir = os.path.join(volume_dir, 'scf')
+        if (state['energies'][i] is None and
+            os.path.exists(os.path.join(scf_dir, 'OUT.FORCE'))):
+            state['energies'][i] = read_pwmat_total_energy(
+                os.path.join(scf_dir, 'REPORT'))
+
+        if state['is_thermal_properties'][i]:
+            continue
+        if create_force_sets(os.path.join(volume_dir, 'phonon'),
+                             state['num_forces'][i]):
+            indices.append(i)
+
+    if indices:
+        directories = [os.path.join(qha_dir, state['directories'][i],
+                                    'phonon') for i in indices]
+        results = run_batch(directories,
+                            conf_filename='tprop.conf',
+                            num_workers=num_workers,
+                            log_level=log_level)
+        for i, result in zip(indices, results):
+            state['is_thermal_properties'][i] = (result['status'] == 'ok')
+    write_state(qha_dir, state)
+
+    num_done = len([i for i in range(len(state['directories']))
+                    if (state['energies'][i] is not None and
+                        state['is_thermal_properties'][i])])
+    if log_level > 0:
+        print("%d of %d volumes are done." %
+              (num_done, len(state['directories'])))
+    return num_done == len(state['directories'])
+
+def run_qha(qha_dir, eos='vinet', pressure=0.0, num_workers=None,
+            log_level=1):
+    """Write e-v.dat and run phonopy's QHA over the volumes of the campaign
+
+    Volumes with more than three imaginary modes are warned about as by
+    phonopy-qha. Returns the PhonopyQHA object.
+
+    """
+    from phonopy import PhonopyQHA
+    from pwmat2phonopy.file_IO import read_thermal_properties, read_v_e
+
+    state = read_state(qha_dir)
+    ev_filename = os.path.join(qha_dir, 'e-v.dat')
+    with open(ev_filename, 'w') as w:
+        w.write("#   cell volume   energy of cell other than phonon\n")
+        for volume, energy in zip(state['volumes'], state['energies']):
+            w.write("%20.8f %20.8f\n" % (volume, energy))
+    volumes, electronic_energies = read_v_e(ev_filename, pressure=pressure)
+
+    filenames = [os.path.join(qha_dir, directory, 'phonon',
+                              'thermal_properties.yaml')
+                 for directory in state['directories']]
+    (temperatures,
+     cv,
+     entropy,
+     fe_phonon,
+     num_modes,
+     num_integrated_modes) = read_thermal_properties(
+         filenames, factor=state['factor'], num_processes=num_workers)
+    if num_modes and log_level > 0:
+        for directory, n, n_int in zip(state['directories'],
+                                       num_modes,
+                                       num_integrated_modes):
+            if n - n_int > 3:
+                print("# Warning: %s has imaginary modes." % directory)
+
+    phonopy_qha = PhonopyQHA(volumes,
+                             electronic_energies,
+                             eos=eos,
+                             temperatures=temperatures,
+                             free_energy=fe_phonon,
+                             cv=cv,
+                             entropy=entropy,
+                             verbose=(log_level > 0))
+    # Same files as phonopy-qha
+    cwd = os.getcwd()
+    os.chdir(qha_dir)
+    try:
+        phonopy_qha.write_helmholtz_volume()
+        phonopy_qha.write_volume_temperature()
+        phonopy_qha.write_thermal_expansion()
+        phonopy_qha.write_volume_expansion()
+        phonopy_qha.write_gibbs_temperature()
+        phonopy_qha.write_bulk_modulus_temperature()
+        phonopy_qha.write_heat_capacity_P_numerical()
+        phonopy_qha.write_heat_capacity_P_polyfit()
+        phonopy_qha.write_gruneisen_temperature()
+    finally:
+        os.chdir(cwd)
+    if log_level > 0:
+        print("QHA results are written in %s." % qha_dir)
+    return phonopy_qha
+
+def _get_symmetry(phonon):
+    symmetry = phonon.get_symmetry()
+    return (symmetry.get_international_table(),
+            len(symmetry.get_symmetry_operations()['rotations']))
+
+def read_state(campaign_dir, filename='qha.json'):
+    import pwmat2phonopy.driver as driver
+
+    filename = os.path.join(campaign_dir, filename)
+    driver.check_file_exists(filename)
+    with open(filename) as f:
+        return json.load(f)
+
+def write_state(campaign_dir, state, filename='qha.json'):
+    with open(os.path.join(campaign_dir, filename), 'w') as w:
+        json.dump(state, w, indent=2)
+
+def main(argv=None):
+    import pwmat2phonopy.driver as driver
+    from pwmat2phonopy.cui.show_log import print_error_message
+
+    parser = get_qha_parser()
+    (options, args) = parser.parse_args(argv)
+    try:
+        if not options.is_collect:
+            return prepare(options)
+        qha_dir = os.path.abspath(options.qha_dir)
+        while not collect(qha_dir, num_workers=options.num_workers):
+            if options.wait is None:
+                return 0
+            sys.stdout.flush()
+            time.sleep(options.wait)
+        run_qha(qha_dir,
+                eos=options.eos,
+                pressure=options.pressure,
+                num_workers=options.num_workers)
+        return 0
+    except driver.DriverError as e:
+        print_error_message(str(e))
+        return 1
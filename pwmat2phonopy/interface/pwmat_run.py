@@ -90,13 +90,73 @@ def creat_pbs(ppn, queue, wall_time, job_name='forces'):
 
     with open(job_name+'.pbs', 'w') as w:
         w.write("\n".join(lines))
-def creat_post_process_script(num_forces):
+def creat_pbs_array(ppn, queue, wall_time, num_jobs, job_name='jobs',
+                    job_list='jobs.list'):
+    """PBS job array running PWmat in every directory listed in job_list
+
+    The directories are relative to the directory of submission, one per
+    line, and the array element i runs in the directory of line i, so
+    all of them are submitted at once by one qsub.
+
+    """
+    lines = []
+    lines.append('#PBS -N '+job_name)
+    lines.append('#PBS -l nodes=1:ppn='+str(ppn))
+    lines.append('#PBS -q '+queue)
+    lines.append('#PBS -l walltime='+wall_time)
+    lines.append('#PBS -t 1-'+str(num_jobs))
+    lines.append('')
+    lines.append('NPROCS=`wc -l < $PBS_NODEFILE`')
+    lines.append('')
+    lines.append('cd $PBS_O_WORKDIR')
+    lines.append('cd `sed -n "${PBS_ARRAYID}p" '+job_list+'`')
+    lines.append('')
+    lines.append('mpirun -np ${NPROCS} PWmat')
+    lines.append('')
+
+    with open(job_name+'.pbs', 'w') as w:
+        w.write("\n".join(lines))
+
+def stage_pseudopotentials(confs_scf, source_dir, stage_dir, job_dirs):
+    """Copy the in.psp* files of etot.input once and link them into jobs
+
+    The files are copied from source_dir to stage_dir and every job
+    directory gets a relative symbolic link to them (a copy where links
+    are not available).
+
+    """
+    import os
+    import shutil
+
+    psp_files = [confs_scf[tag] for tag in confs_scf if 'in.psp' in tag]
+    for psp in psp_files:
+        shutil.copy(os.path.join(source_dir, psp), stage_dir)
+    for job_dir in job_dirs:
+        for psp in psp_files:
+            target = os.path.join(job_dir, psp)
+            if os.path.lexists(target):
+                os.remove(target)
+            if hasattr(os, 'symlink'):
+                os.symlink(os.path.relpath(os.path.join(stage_dir, psp),
+                                           job_dir), target)
+            else:
+                shutil.copy(os.path.join(stage_dir, psp), target)
+
+def creat_post_process_script(num_forces, is_born=False, dim=None, primitive_axis=None,
+                              born_filename='./born/OUT.BORN'):
     force = ''
     for i in range(num_forces):
         force += "./{pre_filename}-{0:0{width}}/OUT.FORCE ".format(i + 1, pre_filename='forces', width=3)
     lines = []
     lines.append('#!/bin/sh')
     lines.append('PWmat2Phonopy --pwmat -f '+force)
+    if is_born:
+        born = 'PWmat2Phonopy --pwmat --born -c ../atom.config'
+        if dim is not None:
+            born += ' --dim="'+dim+'"'
+        if primitive_axis is not None:
+            born += ' --pa="'+primitive_axis+'"'
+        lines.append(born+' '+born_filename)
     lines.append('PWmat2Phonopy --pwmat -p -s band_dos.conf -c ../atom.config')
     lines.append('')
     with open('plot_phonon.sh', 'w') as w:
@@ -125,9 +185,12 @@ class pwmat2phonopyParser(object):
                        'dos':{'val':'TRUE                                               ', 'comm':'# switch to the DOS calculation'},
                        'mp':{'val':'41 41 41                                            ', 'comm':'# q-mesh for the DOS calculation'},
                        'fpitch':{'val':'0.1                                             ', 'comm':'# frequency interval for DOS calculation'},
-                       'sigma':{'val':'0.1                                              ', 'comm':'# smearing width for DOS calculation'}
+                       'sigma':{'val':'0.1                                              ', 'comm':'# smearing width for DOS calculation'},
+                       'born':{'val':'FALSE                                             ', 'comm':'# TRUE: run PWmat for Born charges and dielectric constant (NAC) with the force jobs'},
+                       'born_job':{'val':'DFPT                                          ', 'comm':'# JOB of the unit cell run for Born charges and dielectric constant'},
+                       'random_displacements':{'val':'0                                 ', 'comm':'# >0: number of supercells with all atoms displaced randomly; force constants are fitted by least squares'}
                       }
-        self._keywords = ['nodes', 'wall_time', 'mp_n123', 'dim', 'primitive_axis', 'band', 'band_labels', 'band_points', 'fc_symmetry', 'frequency_conversion_factor', 'dos', 'mp', 'fpitch', 'sigma']
+        self._keywords = ['nodes', 'wall_time', 'mp_n123', 'dim', 'primitive_axis', 'band', 'band_labels', 'band_points', 'fc_symmetry', 'frequency_conversion_factor', 'dos', 'mp', 'fpitch', 'sigma', 'born', 'born_job', 'random_displacements']
         if filename is not None:
             self.read_input(filename) # store data in self._confs
 
@@ -159,6 +222,12 @@ class pwmat2phonopyParser(object):
     def set_configures(self, key, elem):
         self._confs[key.lower()]['val'] = elem
 
+    def get_is_born(self):
+        return self._confs['born']['val'].strip().upper() in ('TRUE', '.TRUE.', 'T')
+
+    def get_random_displacements(self):
+        return int(self._confs['random_displacements']['val'])
+
     def write_input(self, filename='./pwmat2phonopy.in'):
         lines = self._get_input_lines()
         with open(filename, 'w') as w:
@@ -174,7 +243,7 @@ class pwmat2phonopyParser(object):
 
         return lines
 
-    def creat_phonopy_conf(self):
+    def creat_phonopy_conf(self, filename='band_dos.conf'):
         confs = self._confs
         unit = confs['frequency_conversion_factor']['val'].strip()
         if unit == 'THz': # THz
@@ -200,9 +269,27 @@ class pwmat2phonopyParser(object):
         lines.append('DOS = '+confs['dos']['val'].strip())
         lines.append('FPITCH = '+confs['fpitch']['val'].strip())
         lines.append('SIGMA = '+confs['sigma']['val'].strip())
+        if self.get_is_born():
+            lines.append('NAC = .TRUE.')
         lines.append('')
     
-        with open('band_dos.conf', 'w') as w:
+        with open(filename, 'w') as w:
+            w.write("\n".join(lines))
+
+    def creat_tprop_conf(self, t_max, t_step, filename='tprop.conf'):
+        """Configuration of the thermal properties of a volume (QHA)"""
+        confs = self._confs
+        lines = []
+        lines.append('DIM = '+confs['dim']['val'].strip())
+        lines.append('PRIMITIVE_AXIS = '+confs['primitive_axis']['val'].strip())
+        lines.append('FC_SYMMETRY = '+confs['fc_symmetry']['val'].strip())
+        lines.append('MP = '+confs['mp']['val'].strip())
+        lines.append('TPROP = .TRUE.')
+        lines.append('TMAX = %f' % t_max)
+        lines.append('TSTEP = %f' % t_step)
+        lines.append('')
+
+        with open(filename, 'w') as w:
             w.write("\n".join(lines))
 
 #    def write_pwmat2phonopy_input():
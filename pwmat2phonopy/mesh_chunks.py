@@ -0,0 +1,429 @@
+#!/usr/bin/env python
+
+"""Phonons on dense sampling meshes solved in chunks of q-points
+
+The irreducible q-points are split into chunks that are solved one after
+another, or across a pool of worker processes, and handed back in the
+order of the q-points. Total DOS and thermal properties are summed up
+chunk by chunk (TotalDosSum, ThermalPropertiesSum), so the memory does
+not grow with the number of q-points:
+
+    chunks = ChunkedMesh(dynamical_matrix, qpoints, factor,
+                         chunk_size=1000, num_workers=8)
+    dos = TotalDosSum(sigma=0.1)
+    for start, frequencies, eigenvectors in chunks:
+        dos.add(frequencies, weights[start:start + len(frequencies)])
+    frequency_points, total_dos = dos.get_dos()
+
+The workers are forked from the calling process and inherit the
+dynamical matrix. The BLAS they inherit is limited to blas_threads
+threads in each worker, so that the workers together do not run more
+threads than there are cores. At most two chunks per worker are in
+flight, so a slow consumer (e.g. writing mesh.yaml) does not let results pile up.
+
+"""
+
+import numpy as np
+
+__author__  = "Paul Chern"
+__email__   = "peng.chen.iphy@gmail.com"
+__licence__ = "GPL"
+__date__    = "Nov. 2017"
+
+def get_temperatures(t_min=None, t_max=None, t_step=None):
+    """Temperatures as phonopy's ThermalProperties.set_temperature_range"""
+    if t_min is None:
+        _t_min = 10
+    elif t_min < 0:
+        _t_min = 0
+    else:
+        _t_min = t_min
+
+    if t_max is None:
+        _t_max = 1000
+    elif t_max > _t_min:
+        _t_max = t_max
+    else:
+        _t_max = _t_min
+
+    if t_step is None or not t_step > 0:
+        _t_step = 10
+    else:
+        _t_step = t_step
+
+    return np.arange(_t_min, _t_max + _t_step / 2.0, _t_step, dtype='double')
+
+def get_frequencies(dynamical_matrix,
+                    qpoints,
+                    factor,
+                    is_eigenvectors=False,
+                    dynamical_matrix_batch=None,
+                    max_bytes=2 ** 26):
+    """Frequencies (and eigenvectors) at q-points as done by phonopy's Mesh
+
+    Dynamical matrices of a batch of q-points (at most max_bytes) are
+    built at once by DynamicalMatrixBatch, or one by one with
+    non-analytical term correction, and solved by one call of
+    numpy.linalg.eigvalsh, or eigh with is_eigenvectors. Returns
+    frequencies of shape (num_qpoints, num_band) and eigenvectors of
+    shape (num_qpoints, num_band, num_band), or None.
+
+    """
+    from pwmat2phonopy.dynamical_matrix import (get_dynamical_matrix_batch,
+                                                solve_dynamical_matrices)
+
+    if dynamical_matrix_batch is None:
+        dynamical_matrix_batch = get_dynamical_matrix_batch(dynamical_matrix)
+    num_band = dynamical_matrix.get_primitive().get_number_of_atoms() * 3
+    if dynamical_matrix_batch is None:
+        batch_size = max(1, max_bytes // (num_band * num_band * 16))
+    else:
+        batch_size = dynamical_matrix_batch.get_batch_size(max_bytes)
+    frequencies = np.zeros((len(qpoints), num_band), dtype='double')
+    if is_eigenvectors:
+        eigenvectors = np.zeros((len(qpoints), num_band, num_band),
+                                dtype='c16')
+    else:
+        eigenvectors = None
+
+    for i0 in range(0, len(qpoints), batch_size):
+        qpoints_batch = qpoints[i0:i0 + batch_size]
+        n = len(qpoints_batch)
+        if dynamical_matrix_batch is None:
+            dms = np.zeros((n, num_band, num_band), dtype='c16')
+            for j, q in enumerate(qpoints_batch):
+                dynamical_matrix.set_dynamical_matrix(q)
+                dms[j] = dynamical_matrix.get_dynamical_matrix()
+        else:
+            dms = dynamical_matrix_batch.get_dynamical_matrices(qpoints_batch)
+        freqs, eigvecs = solve_dynamical_matrices(
+            dms, factor, is_eigenvectors=is_eigenvectors)
+        frequencies[i0:i0 + n] = freqs
+        if is_eigenvectors:
+            eigenvectors[i0:i0 + n] = eigvecs
+
+    return frequencies, eigenvectors
+
+# Set in the worker processes by _init_worker.
+_worker_args = None
+
+def _init_worker(dynamical_matrix, factor, is_eigenvectors,
+                 blas_threads=None):
+    from pwmat2phonopy.dynamical_matrix import get_dynamical_matrix_batch
+
+    # Not in the calling process, whose BLAS is left as it is.
+    if blas_threads is not None:
+        from pwmat2phonopy.batch import limit_blas_threads
+        limit_blas_threads(blas_threads)
+
+    global _worker_args
+    _worker_args = (dynamical_matrix,
+                    get_dynamical_matrix_batch(dynamical_matrix),
+                    factor,
+                    is_eigenvectors)
+
+def _solve_chunk(start, qpoints):
+    (dynamical_matrix,
+     dynamical_matrix_batch,
+     factor,
+     is_eigenvectors) = _worker_args
+    frequencies, eigenvectors = get_frequencies(
+        dynamical_matrix,
+        qpoints,
+        factor,
+        is_eigenvectors=is_eigenvectors,
+        dynamical_matrix_batch=dynamical_matrix_batch)
+    return start, frequencies, eigenvectors
+
+class ChunkedMesh(object):
+    """Iterator over chunks of solved q-points
+
+    Yields (start, frequencies, eigenvectors) in the order of qpoints,
+    where start is the index of the first q-point of the chunk and
+    eigenvectors is None unless is_eigenvectors. With more than one
+    worker, each worker runs its BLAS with blas_threads threads; a
+    single worker runs in the calling process as it is.
+
+    """
+    def __init__(self,
+                 dynamical_matrix,
+                 qpoints,
+                 factor,
+                 chunk_size=1000,
+                 num_workers=1,
+                 is_eigenvectors=False,
+                 blas_threads=1):
+        self._dynamical_matrix = dynamical_matrix
+        self._qpoints = np.array(qpoints, dtype='double', order='C')
+        self._factor = factor
+        self._chunk_size = max(1, chunk_size)
+        self._num_workers = max(1, min(num_workers,
+                                       self.get_number_of_chunks()))
+        self._is_eigenvectors = is_eigenvectors
+        self._blas_threads = blas_threads
+
+    def get_number_of_chunks(self):
+        return -(-len(self._qpoints) // self._chunk_size)
+
+    def get_chunk_size(self):
+        return self._chunk_size
+
+    def get_number_of_workers(self):
+        return self._num_workers
+
+    def __iter__(self):
+        starts = range(0, len(self._qpoints), self._chunk_size)
+        if self._num_workers == 1:
+            _init_worker(self._dynamical_matrix,
+                         self._factor,
+                         self._is_eigenvectors)
+            for start in starts:
+                yield _solve_chunk(
+                    start, self._qpoints[start:start + self._chunk_size])
+            return
+
+        import multiprocessing
+        from collections import deque
+
+        pool = multiprocessing.Pool(self._num_workers,
+                                    initializer=_init_worker,
+                                    initargs=(self._dynamical_matrix,
+                                              self._factor,
+                                              self._is_eigenvectors,
+                                              self._blas_threads))
+        try:
+            pending = deque()
+            for start in starts:
+                pending.append(pool.apply_async(
+                    _solve_chunk,
+                    (start, self._qpoints[start:start + self._chunk_size])))
+                if len(pending) >= 2 * self._num_workers:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+        finally:
+            pool.terminate()
+            pool.join()
+
+class TotalDosSum(object):
+    """Total DOS with Gaussian smearing summed up chunk by chunk
+
+    Frequencies are collected into a histogram of bins much narrower than
+    sigma, keeping the weight and the first moment of every bin. The DOS
+    is the histogram smeared to first order in the offsets within the
+    bins, which differs from phonopy's TotalDos by about
+    (bin width / sigma)^2 / 8 relative. Without sigma, the bin width is
+    chosen from the frequency range of the first chunk so that it is
+    narrower than 1/bins_per_sigma of phonopy's default sigma.
+
+    """
+    def __init__(self, sigma=None, bins_per_sigma=200):
+        self._sigma = sigma
+        self._bins_per_sigma = bins_per_sigma
+        self._bin_width = None
+        self._first_bin = 0
+        self._hist = np.zeros(0, dtype='double')
+        self._moment = np.zeros(0, dtype='double')
+        self._sum_weights = 0.0
+        self._f_min = None
+        self._f_max = None
+
+    def add(self, frequencies, weights):
+        frequencies = np.asarray(frequencies, dtype='double')
+        f_min = frequencies.min()
+        f_max = frequencies.max()
+        if self._bin_width is None:
+            if self._sigma is not None:
+                self._bin_width = float(self._sigma) / self._bins_per_sigma
+            else:
+                self._bin_width = ((f_max - f_min) / 100.0 /
+                                   self._bins_per_sigma) or 1e-5
+            self._f_min = f_min
+            self._f_max = f_max
+        else:
+            self._f_min = min(self._f_min, f_min)
+            self._f_max = max(self._f_max, f_max)
+
+        bins = np.floor(frequencies / self._bin_width).astype('int_')
+        self._extend(bins.min(), bins.max())
+        w = np.repeat(weights, frequencies.shape[1]).astype('double')
+        offsets = frequencies.ravel() - (bins.ravel() + 0.5) * self._bin_width
+        index = bins.ravel() - self._first_bin
+        self._hist += np.bincount(index, weights=w, minlength=len(self._hist))
+        self._moment += np.bincount(index,
+                                    weights=w * offsets,
+                                    minlength=len(self._hist))
+        self._sum_weights += np.sum(weights)
+
+    def _extend(self, first, last):
+        if len(self._hist) == 0:
+            self._first_bin = first
+            self._hist = np.zeros(last - first + 1, dtype='double')
+            self._moment = np.zeros_like(self._hist)
+            return
+        last_bin = self._first_bin + len(self._hist) - 1
+        head = max(0, self._first_bin - first)
+        tail = max(0, last - last_bin)
+        if head or tail:
+            self._hist = np.pad(self._hist, (head, tail), 'constant')
+            self._moment = np.pad(self._moment, (head, tail), 'constant')
+            self._first_bin -= head
+
+    def get_sigma(self):
+        if self._sigma is None:
+            return (self._f_max - self._f_min) / 100.0
+        return self._sigma
+
+    def get_dos(self, freq_min=None, freq_max=None, freq_pitch=None):
+        """Frequency points and total DOS as phonopy's TotalDos.get_dos"""
+        sigma = self.get_sigma()
+        f_min = self._f_min - sigma * 10 if freq_min is None else freq_min
+        f_max = self._f_max + sigma * 10 if freq_max is None else freq_max
+        if freq_pitch is None:
+            f_delta = (f_max - f_min) / 200.0
+        else:
+            f_delta = freq_pitch
+        frequency_points = np.arange(f_min, f_max + f_delta * 0.1, f_delta)
+
+        nonzero = np.nonzero(self._hist)[0]
+        centers = (nonzero + self._first_bin + 0.5) * self._bin_width
+        hist = self._hist[nonzero]
+        moment = self._moment[nonzero]
+        dos = np.zeros_like(frequency_points)
+        # Frequency points in blocks to bound the size of x.
+        block = max(1, 2 ** 22 // max(1, len(centers)))
+        for i in range(0, len(frequency_points), block):
+            x = frequency_points[i:i + block, None] - centers[None, :]
+            g = np.exp(-x ** 2 / 2.0 / sigma ** 2)
+            dos[i:i + block] = (np.dot(g, hist) +
+                                np.dot(g * x, moment) / sigma ** 2)
+        dos /= np.sqrt(2 * np.pi) * sigma * self._sum_weights
+        return frequency_points, dos
+
+    def write(self, frequency_points, dos, filename='total_dos.dat'):
+        with open(filename, 'w') as w:
+            w.write("# Sigma = %f\n" % self.get_sigma())
+            for freq, d in zip(frequency_points, dos):
+                w.write("%20.10f%20.10f\n" % (freq, d))
+
+class ThermalPropertiesSum(object):
+    """Thermal properties summed up chunk by chunk
+
+    Same quantities, options and thermal_properties.yaml as phonopy's
+    ThermalProperties without projection. Temperatures are given as an
+    array, e.g. from get_temperatures.
+
+    """
+    def __init__(self,
+                 temperatures,
+                 band_indices=None,
+                 cutoff_frequency=None,
+                 pretend_real=False):
+        self._temperatures = np.extract(
+            np.logical_not(np.array(temperatures) < 0),
+            np.array(temperatures, dtype='double'))
+        if band_indices is not None:
+            self._band_indices = np.hstack(band_indices).astype('intc')
+        else:
+            self._band_indices = None
+        self._cutoff_frequency = cutoff_frequency
+        self._pretend_real = pretend_real
+
+        num_temps = len(self._temperatures)
+        self._free_energy = np.zeros(num_temps, dtype='double')
+        self._entropy = np.zeros(num_temps, dtype='double')
+        self._heat_capacity = np.zeros(num_temps, dtype='double')
+        self._zero_point_energy = 0.0
+        self._high_T_entropy = 0.0
+        self._sum_weights = 0
+        self._num_modes = 0
+        self._num_integrated_modes = 0
+        self._num_band = None
+
+    def add(self, frequencies, weights):
+        from pwmat2phonopy.units import THzToEv
+        from pwmat2phonopy.thermal_properties import get_thermal_sums
+
+        frequencies = np.asarray(frequencies, dtype='double')
+        weights = np.asarray(weights)
+        if self._band_indices is not None:
+            frequencies = frequencies[:, self._band_indices]
+        if self._pretend_real:
+            frequencies = abs(frequencies)
+        elif self._cutoff_frequency is not None:
+            frequencies = np.where(frequencies > self._cutoff_frequency,
+                                   frequencies, -1)
+        frequencies = frequencies * THzToEv
+        self._num_band = frequencies.shape[1]
+        self._sum_weights += weights.sum()
+        self._num_modes += frequencies.shape[1] * weights.sum()
+        self._num_integrated_modes += np.sum(
+            weights * (frequencies > 0).sum(axis=1))
+
+        w = np.repeat(weights, frequencies.shape[1]).astype('double')
+        positive = frequencies.ravel() > 0
+        f = frequencies.ravel()[positive]
+        w = w[positive]
+        self._zero_point_energy += np.dot(w, f) / 2
+        self._high_T_entropy -= np.dot(w, np.log(f))
+
+        fe, entropy, cv = get_thermal_sums(f, w, self._temperatures)
+        self._free_energy += fe
+        self._entropy += entropy
+        self._heat_capacity += cv
+
+    def get_number_of_modes(self):
+        return self._num_modes
+
+    def get_number_of_integrated_modes(self):
+        return self._num_integrated_modes
+
+    def get_zero_point_energy(self):
+        from pwmat2phonopy.units import EvTokJmol
+        return self._zero_point_energy / self._sum_weights * EvTokJmol
+
+    def get_high_T_entropy(self):
+        from pwmat2phonopy.units import Kb, EvTokJmol
+        return self._high_T_entropy * Kb / self._sum_weights * EvTokJmol
+
+    def get_thermal_properties(self):
+        """Temperatures, F [kJ/mol], S [J/K/mol] and C_v [J/K/mol]"""
+        from pwmat2phonopy.units import EvTokJmol
+
+        scale = EvTokJmol / self._sum_weights
+        fe = self._free_energy * scale + self.get_zero_point_energy()
+        entropy = self._entropy * scale * 1000
+        cv = self._heat_capacity * scale * 1000
+        return self._temperatures, fe, entropy, cv
+
+    def write_yaml(self, filename='thermal_properties.yaml'):
+        from pwmat2phonopy.thermal_properties import (
+            get_thermal_properties_yaml_lines)
+
+        lines = get_thermal_properties_yaml_lines(
+            *self.get_thermal_properties(),
+            natom=self._num_band // 3,
+            num_modes=self._num_modes,
+            num_integrated_modes=self._num_integrated_modes,
+            zero_point_energy=self.get_zero_point_energy(),
+            high_T_entropy=self.get_high_T_entropy(),
+            cutoff_frequency=self._cutoff_frequency,
+            band_indices=self._band_indices)
+        with open(filename, 'w') as w:
+            w.write("\n".join(lines))
+
+    def write_hdf5(self, filename='thermal_properties.hdf5'):
+        """Thermal properties as arrays in HDF5 (or .npz by the extension)"""
+        from pwmat2phonopy.thermal_properties import (
+            write_thermal_properties_hdf5)
+
+        write_thermal_properties_hdf5(
+            filename,
+            *self.get_thermal_properties(),
+            natom=self._num_band // 3,
+            num_modes=self._num_modes,
+            num_integrated_modes=self._num_integrated_modes,
+            zero_point_energy=self.get_zero_point_energy(),
+            high_T_entropy=self.get_high_T_entropy(),
+            cutoff_frequency=self._cutoff_frequency,
+            band_indices=self._band_indices)
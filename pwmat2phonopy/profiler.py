@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+
+"""Per-stage wall time, CPU time and peak memory of PWmat2Phonopy
+
+The driver marks its stages with
+
+    with stage('produce_force_constants'):
+        ...
+
+which costs nothing unless a Profiler is active. PWmat2Phonopy --profile
+activates one, prints the table at the end and writes profile.json.
+With --cprofile, every stage is also run under cProfile and the
+statistics are dumped to profile-<stage>.prof (see pstats or snakeviz).
+
+Peak RSS is sampled in a background thread from /proc/self/statm. Where
+that file does not exist, only the RSS at the start and the end of each
+stage and the peak of the whole process (getrusage) are available.
+
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+__author__  = "Paul Chern"
+__email__   = "peng.chen.iphy@gmail.com"
+__licence__ = "GPL"
+__date__    = "Nov. 2017"
+
+_active_profiler = None
+
+try:
+    _cpu_time = time.process_time
+except AttributeError: # python 2
+    _cpu_time = time.clock
+
+def get_rss():
+    """Resident set size of this process in bytes, None if unknown"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+def get_max_rss():
+    """Peak resident set size of this process in bytes, None if unknown"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin': # bytes on macOS, kilobytes elsewhere
+        return max_rss
+    return max_rss * 1024
+
+class _RSSSampler(threading.Thread):
+    def __init__(self, interval=0.01):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._interval = interval
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._peak = 0
+
+    def run(self):
+        while not self._stop_event.is_set():
+            rss = get_rss()
+            if rss is not None:
+                self.update(rss)
+            self._stop_event.wait(self._interval)
+
+    def reset(self):
+        # Returns the peak since the last reset
+        rss = get_rss() or 0
+        with self._lock:
+            peak = max(self._peak, rss)
+            self._peak = rss
+        return peak
+
+    def update(self, rss):
+        with self._lock:
+            self._peak = max(self._peak, rss)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+class Profiler(object):
+    """Collect timing and memory of the stages of a run
+
+    Stages with the same name are accumulated. A stage entered inside
+    another one is named parent/child.
+
+    """
+    def __init__(self, is_cprofile=False, cprofile_prefix="profile"):
+        self._is_cprofile = is_cprofile
+        self._cprofile_prefix = cprofile_prefix
+        self._stages = []
+        self._stage_index = {}
+        self._stack = []
+        self._sampler = None
+        self._t_start = None
+        self._t_end = None
+
+    def start(self):
+        self._t_start = time.time()
+        if get_rss() is not None:
+            self._sampler = _RSSSampler()
+            self._sampler.start()
+
+    def stop(self):
+        self._t_end = time.time()
+        if self._sampler is not None:
+            self._sampler.stop()
+            self._sampler = None
+
+    @contextmanager
+    def stage(self, name):
+        if self._stack:
+            name = "%s/%s" % (self._stack[-1], name)
+        self._stack.append(name)
+
+        # cProfile can not be nested, so only outermost stages are profiled.
+        cprofile = None
+        if self._is_cprofile and len(self._stack) == 1:
+            import cProfile
+            cprofile = cProfile.Profile()
+
+        rss_start = get_rss()
+        # Peak of the enclosing stage so far, handed back when this one
+        # ends.
+        outer_peak_rss = None
+        if self._sampler is not None:
+            outer_peak_rss = self._sampler.reset()
+        t0 = time.time()
+        c0 = _cpu_time()
+        if cprofile is not None:
+            cprofile.enable()
+        try:
+            yield
+        finally:
+            if cprofile is not None:
+                cprofile.disable()
+            wall_time = time.time() - t0
+            cpu_time = _cpu_time() - c0
+            rss_end = get_rss()
+            if self._sampler is not None:
+                peak_rss = self._sampler.reset()
+            elif rss_start is not None:
+                peak_rss = max(rss_start, rss_end)
+            else:
+                peak_rss = None
+            self._stack.pop()
+            self._add(name, wall_time, cpu_time, rss_start, rss_end, peak_rss)
+            if cprofile is not None:
+                cprofile.dump_stats("%s-%s.prof" %
+                                    (self._cprofile_prefix,
+                                     name.replace('/', '-')))
+            # The outer stage keeps its own peak and also saw this one.
+            if self._stack and self._sampler is not None:
+                self._sampler.update(max(outer_peak_rss, peak_rss))
+
+    def _add(self, name, wall_time, cpu_time, rss_start, rss_end, peak_rss):
+        if name in self._stage_index:
+            s = self._stages[self._stage_index[name]]
+            s['calls'] += 1
+            s['wall_time'] += wall_time
+            s['cpu_time'] += cpu_time
+            if rss_end is not None:
+                s['rss_end'] = rss_end
+            if peak_rss is not None:
+                s['peak_rss'] = max(s['peak_rss'] or 0, peak_rss)
+        else:
+            self._stage_index[name] = len(self._stages)
+            self._stages.append({'name': name,
+                                 'calls': 1,
+                                 'wall_time': wall_time,
+                                 'cpu_time': cpu_time,
+                                 'rss_start': rss_start,
+                                 'rss_end': rss_end,
+                                 'peak_rss': peak_rss})
+
+    def get_stages(self):
+        return self._stages
+
+    def get_total_time(self):
+        if self._t_start is None:
+            return None
+        t_end = self._t_end if self._t_end is not None else time.time()
+        return t_end - self._t_start
+
+    def get_results(self):
+        return {'total_wall_time': self.get_total_time(),
+                'max_rss': get_max_rss(),
+                'python_version': "%d.%d.%d" % sys.version_info[:3],
+                'argv': sys.argv,
+                'stages': self._stages}
+
+    def write_json(self, filename="profile.json"):
+        with open(filename, 'w') as w:
+            json.dump(self.get_results(), w, indent=2)
+
+    def show(self):
+        def _mb(x):
+            if x is None:
+                return "%10s" % '-'
+            return "%10.1f" % (x / 1024.0 ** 2)
+
+        print('')
+        print("-" * 28 + " Profile of stages " + "-" * 29)
+        print("%-29s %5s %9s %9s %10s %10s" %
+              ('stage', 'calls', 'wall [s]', 'cpu [s]', 'peak [MB]',
+               'dRSS [MB]'))
+        for s in self._stages:
+            if s['rss_start'] is not None and s['rss_end'] is not None:
+                d_rss = s['rss_end'] - s['rss_start']
+            else:
+                d_rss = None
+            print("%-29s %5d %9.3f %9.3f %s %s" %
+                  (s['name'][-29:], s['calls'], s['wall_time'], s['cpu_time'],
+                   _mb(s['peak_rss']), _mb(d_rss)))
+        total = self.get_total_time()
+        if total is not None:
+            print("%-29s %5s %9.3f %9s %s" %
+                  ('total', '', total, '', _mb(get_max_rss())))
+        print("-" * 76)
+
+def activate(profiler):
+    global _active_profiler
+    _active_profiler = profiler
+    profiler.start()
+
+def deactivate():
+    global _active_profiler
+    profiler = _active_profiler
+    _active_profiler = None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+@contextmanager
+def stage(name):
+    if _active_profiler is None:
+        yield
+    else:
+        with _active_profiler.stage(name):
+            yield
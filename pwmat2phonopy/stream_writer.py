@@ -0,0 +1,542 @@
+#!/usr/bin/env python
+
+"""Writers of phonons that append q-points as they come, and a lazy reader
+
+mesh.yaml/mesh.hdf5, qpoints.yaml/qpoints.hdf5 and band.yaml/band.hdf5
+are written in the formats of phonopy's Mesh, QpointsPhonon and
+BandStructure, but the frequencies (and eigenvectors) are given chunk by
+chunk or path by path, so that those of all q-points never have to be
+held in memory.
+
+    with MeshYamlWriter(mesh, qpoints, weights, primitive) as w:
+        for frequencies, eigenvectors in chunks:
+            w.write(frequencies, eigenvectors)
+
+In the HDF5 files, eigenvectors are stored in chunks of whole q-points
+and may be compressed (compression='gzip' or 'lzf') and stored in single
+precision (is_float32=True), which halves the file and leaves errors of
+about 1e-7. PhononHdf5Reader reads slices of q-points and bands from
+such files without loading whole datasets.
+
+"""
+
+import numpy as np
+
+__author__  = "Paul Chern"
+__email__   = "peng.chen.iphy@gmail.com"
+__licence__ = "GPL"
+__date__    = "Nov. 2017"
+
+def _create_eigenvector_dataset(f,
+                                shape,
+                                compression=None,
+                                is_float32=False,
+                                maxshape=None,
+                                chunk_bytes=2 ** 20):
+    # One HDF5 chunk holds whole eigenvector matrices of a few q-points.
+    # With maxshape, the dataset can be resized to append q-points.
+    num_band = shape[-1]
+    if is_float32:
+        dtype = 'c8'
+    else:
+        dtype = 'c16'
+    matrix_bytes = num_band * num_band * np.dtype(dtype).itemsize
+    num_q = max(1, chunk_bytes // matrix_bytes)
+    if shape[-3] > 0:
+        num_q = min(shape[-3], num_q)
+    chunks = (1,) * (len(shape) - 3) + (num_q, num_band, num_band)
+    return f.create_dataset('eigenvector',
+                            shape,
+                            dtype=dtype,
+                            chunks=chunks,
+                            maxshape=maxshape,
+                            compression=compression)
+
+class MeshYamlWriter(object):
+    def __init__(self,
+                 mesh,
+                 qpoints,
+                 weights,
+                 cell,
+                 filename='mesh.yaml',
+                 is_eigenvectors=False):
+        self._qpoints = qpoints
+        self._weights = weights
+        self._natom = cell.get_number_of_atoms()
+        self._is_eigenvectors = is_eigenvectors
+        self._count = 0
+
+        self._w = open(filename, 'w')
+        rec_lattice = np.linalg.inv(cell.get_cell()) # column vectors
+        self._w.write("mesh: [ %5d, %5d, %5d ]\n" % tuple(mesh))
+        self._w.write("nqpoint: %-7d\n" % len(qpoints))
+        self._w.write("reciprocal_lattice:\n")
+        for vec, axis in zip(rec_lattice.T, ('a*', 'b*', 'c*')):
+            self._w.write("- [ %12.8f, %12.8f, %12.8f ] # %2s\n" %
+                          (tuple(vec) + (axis,)))
+        self._w.write("natom:   %-7d\n" % self._natom)
+        self._w.write(str(cell))
+        self._w.write("\n")
+        self._w.write("phonon:\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, frequencies, eigenvectors=None):
+        """Append the next q-points
+
+        frequencies: (num_qpoints, num_band)
+        eigenvectors: (num_qpoints, num_band, num_band), needed when the
+            writer was created with is_eigenvectors=True.
+
+        """
+        w = self._w
+        for i, freqs in enumerate(frequencies):
+            iq = self._count + i
+            w.write("- q-position: [ %12.7f, %12.7f, %12.7f ]\n" %
+                    tuple(self._qpoints[iq]))
+            w.write("  weight: %-5d\n" % self._weights[iq])
+            w.write("  band:\n")
+            for j, freq in enumerate(freqs):
+                w.write("  - # %d\n" % (j + 1))
+                w.write("    frequency:  %15.10f\n" % freq)
+                if self._is_eigenvectors:
+                    w.write("    eigenvector:\n")
+                    for k in range(self._natom):
+                        w.write("    - # atom %d\n" % (k + 1))
+                        for l in (0, 1, 2):
+                            v = eigenvectors[i, k * 3 + l, j]
+                            w.write("      - [ %17.14f, %17.14f ]\n" %
+                                    (v.real, v.imag))
+            w.write("\n")
+        self._count += len(frequencies)
+
+    def close(self):
+        self._w.close()
+
+class MeshHdf5Writer(object):
+    def __init__(self,
+                 mesh,
+                 qpoints,
+                 weights,
+                 cell,
+                 filename='mesh.hdf5',
+                 is_eigenvectors=False,
+                 compression=None,
+                 is_float32=False):
+        import h5py
+
+        num_band = cell.get_number_of_atoms() * 3
+        self._count = 0
+        self._f = h5py.File(filename, 'w')
+        self._f.create_dataset('mesh', data=np.array(mesh, dtype='intc'))
+        self._f.create_dataset('qpoint', data=qpoints)
+        self._f.create_dataset('weight', data=weights)
+        self._frequency = self._f.create_dataset(
+            'frequency', (len(qpoints), num_band), dtype='double')
+        if is_eigenvectors:
+            self._eigenvector = _create_eigenvector_dataset(
+                self._f,
+                (len(qpoints), num_band, num_band),
+                compression=compression,
+                is_float32=is_float32)
+        else:
+            self._eigenvector = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, frequencies, eigenvectors=None):
+        n = len(frequencies)
+        self._frequency[self._count:self._count + n] = frequencies
+        if self._eigenvector is not None:
+            self._eigenvector[self._count:self._count + n] = eigenvectors
+        self._count += n
+
+    def close(self):
+        self._f.close()
+
+class QpointsYamlWriter(object):
+    def __init__(self,
+                 num_qpoints,
+                 cell,
+                 filename='qpoints.yaml',
+                 is_eigenvectors=False,
+                 is_dynamical_matrices=False):
+        self._natom = cell.get_number_of_atoms()
+        self._is_eigenvectors = is_eigenvectors
+        self._is_dynamical_matrices = is_dynamical_matrices
+
+        self._w = open(filename, 'w')
+        rec_lattice = np.linalg.inv(cell.get_cell()) # column vectors
+        self._w.write("nqpoint: %-7d\n" % num_qpoints)
+        self._w.write("natom:   %-7d\n" % self._natom)
+        self._w.write("reciprocal_lattice:\n")
+        for vec, axis in zip(rec_lattice.T, ('a*', 'b*', 'c*')):
+            self._w.write("- [ %12.8f, %12.8f, %12.8f ] # %2s\n" %
+                          (tuple(vec) + (axis,)))
+        self._w.write("phonon:\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self,
+              qpoints,
+              frequencies,
+              eigenvectors=None,
+              dynamical_matrices=None):
+        """Append the next q-points
+
+        qpoints: (num_qpoints, 3)
+        frequencies: (num_qpoints, num_band)
+        eigenvectors, dynamical_matrices: (num_qpoints, num_band, num_band),
+            needed when the writer was created with is_eigenvectors=True
+            or is_dynamical_matrices=True.
+
+        """
+        w = self._w
+        for i, freqs in enumerate(frequencies):
+            w.write("- q-position: [ %12.7f, %12.7f, %12.7f ]\n" %
+                    tuple(qpoints[i]))
+            if self._is_dynamical_matrices:
+                w.write("  dynamical_matrix:\n")
+                for row in dynamical_matrices[i]:
+                    w.write("  - [ ")
+                    w.write(", ".join(["%15.10f, %15.10f" % (x.real, x.imag)
+                                       for x in row]))
+                    w.write(" ]\n")
+            w.write("  band:\n")
+            for j, freq in enumerate(freqs):
+                w.write("  - # %d\n" % (j + 1))
+                w.write("    frequency: %15.10f\n" % freq)
+                if self._is_eigenvectors:
+                    w.write("    eigenvector:\n")
+                    for k in range(self._natom):
+                        w.write("    - # atom %d\n" % (k + 1))
+                        for l in (0, 1, 2):
+                            v = eigenvectors[i, k * 3 + l, j]
+                            w.write("      - [ %17.14f, %17.14f ]\n" %
+                                    (v.real, v.imag))
+            w.write("\n")
+
+    def close(self):
+        self._w.close()
+
+class QpointsHdf5Writer(object):
+    """qpoints.hdf5 appended chunk by chunk
+
+    The datasets are resizable and stored in HDF5 chunks, and every
+    write appends its q-points, so the number of q-points need not be
+    known in advance.
+
+    """
+    def __init__(self,
+                 cell,
+                 filename='qpoints.hdf5',
+                 is_eigenvectors=False,
+                 is_dynamical_matrices=False,
+                 compression=None,
+                 is_float32=False,
+                 chunk_bytes=2 ** 20):
+        import h5py
+
+        num_band = cell.get_number_of_atoms() * 3
+        num_q = max(1, chunk_bytes // (num_band * 8))
+        self._count = 0
+        self._f = h5py.File(filename, 'w')
+        self._datasets = {}
+        self._datasets['qpoint'] = self._f.create_dataset(
+            'qpoint',
+            (0, 3),
+            dtype='double',
+            chunks=(num_q, 3),
+            maxshape=(None, 3))
+        self._datasets['frequency'] = self._f.create_dataset(
+            'frequency',
+            (0, num_band),
+            dtype='double',
+            chunks=(num_q, num_band),
+            maxshape=(None, num_band))
+        if is_eigenvectors:
+            self._datasets['eigenvector'] = _create_eigenvector_dataset(
+                self._f,
+                (0, num_band, num_band),
+                compression=compression,
+                is_float32=is_float32,
+                maxshape=(None, num_band, num_band))
+        if is_dynamical_matrices:
+            self._datasets['dynamical_matrix'] = self._f.create_dataset(
+                'dynamical_matrix',
+                (0, num_band, num_band),
+                dtype='c16',
+                chunks=(max(1, chunk_bytes // (num_band * num_band * 16)),
+                        num_band,
+                        num_band),
+                maxshape=(None, num_band, num_band),
+                compression=compression)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self,
+              qpoints,
+              frequencies,
+              eigenvectors=None,
+              dynamical_matrices=None):
+        data = {'qpoint': qpoints,
+                'frequency': frequencies,
+                'eigenvector': eigenvectors,
+                'dynamical_matrix': dynamical_matrices}
+        n = len(frequencies)
+        for key, dset in self._datasets.items():
+            dset.resize(self._count + n, axis=0)
+            dset[self._count:self._count + n] = data[key]
+        self._count += n
+
+    def close(self):
+        self._f.close()
+
+class BandYamlWriter(object):
+    """band.yaml written path by path
+
+    paths: q-points of the paths, (num_paths, num_qpoints, 3)
+    cell, supercell: Primitive cell and supercell of the dynamical matrix
+    labels: Labels of the ends of the paths (num_paths + 1)
+    comment: Dictionary written at the top
+
+    """
+    def __init__(self,
+                 paths,
+                 cell,
+                 supercell,
+                 labels=None,
+                 comment=None,
+                 filename='band.yaml'):
+        self._paths = [np.array(path) for path in paths]
+        self._natom = cell.get_number_of_atoms()
+        if labels is not None and len(labels) == len(self._paths) + 1:
+            self._labels = labels
+        else:
+            self._labels = None
+        self._count = 0
+
+        rec_lattice = np.linalg.inv(cell.get_cell()) # column vectors
+        smat = supercell.get_supercell_matrix()
+        pmat = cell.get_primitive_matrix()
+        tmat = np.rint(np.dot(np.linalg.inv(pmat), smat)).astype(int)
+        nq_paths = [len(path) for path in self._paths]
+        text = []
+        if comment is not None:
+            import yaml
+            text.append(yaml.dump(comment, default_flow_style=False).rstrip())
+        text.append("nqpoint: %-7d" % np.sum(nq_paths))
+        text.append("npath: %-7d" % len(self._paths))
+        text.append("segment_nqpoint:")
+        text += ["- %d" % nq for nq in nq_paths]
+        text.append("reciprocal_lattice:")
+        for vec, axis in zip(rec_lattice.T, ('a*', 'b*', 'c*')):
+            text.append("- [ %12.8f, %12.8f, %12.8f ] # %2s" %
+                        (tuple(vec) + (axis,)))
+        text.append("natom: %-7d" % self._natom)
+        text.append(str(cell))
+        text.append("supercell_matrix:")
+        for v in tmat:
+            text.append("- [ %4d, %4d, %4d ]" % tuple(v))
+        text.append('')
+        text.append("phonon:")
+        text.append('')
+        self._w = open(filename, 'w')
+        self._w.write("\n".join(text))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, distances, frequencies, eigenvectors=None):
+        """Append the next path
+
+        distances: (num_qpoints,)
+        frequencies: (num_qpoints, num_band)
+        eigenvectors: (num_qpoints, num_band, num_band) or None
+
+        """
+        w = self._w
+        qpoints = self._paths[self._count]
+        if self._labels is not None:
+            labels = self._labels[self._count:self._count + 2]
+        else:
+            labels = None
+        for j, q in enumerate(qpoints):
+            w.write("- q-position: [ %12.7f, %12.7f, %12.7f ]\n" % tuple(q))
+            w.write("  distance: %12.7f\n" % distances[j])
+            if labels is not None:
+                if j == 0:
+                    w.write("  label: \'%s\'\n" % labels[0])
+                elif j == len(qpoints) - 1:
+                    w.write("  label: \'%s\'\n" % labels[1])
+            w.write("  band:\n")
+            for k, freq in enumerate(frequencies[j]):
+                w.write("  - # %d\n" % (k + 1))
+                w.write("    frequency: %15.10f\n" % freq)
+                if eigenvectors is not None:
+                    w.write("    eigenvector:\n")
+                    for l in range(self._natom):
+                        w.write("    - # atom %d\n" % (l + 1))
+                        for m in (0, 1, 2):
+                            v = eigenvectors[j, l * 3 + m, k]
+                            w.write("      - [ %17.14f, %17.14f ]\n" %
+                                    (v.real, v.imag))
+            w.write("\n")
+        self._count += 1
+
+    def close(self):
+        self._w.close()
+
+class BandHdf5Writer(object):
+    """band.hdf5 written path by path
+
+    All paths have to have the same number of q-points, as in
+    phonopy's band.hdf5.
+
+    """
+    def __init__(self,
+                 paths,
+                 cell,
+                 labels=None,
+                 comment=None,
+                 filename='band.hdf5',
+                 is_eigenvectors=False,
+                 compression=None,
+                 is_float32=False):
+        import h5py
+
+        paths = np.array(paths, dtype='double')
+        num_paths, num_qpoints = paths.shape[:2]
+        num_band = cell.get_number_of_atoms() * 3
+        self._count = 0
+        self._f = h5py.File(filename, 'w')
+        self._f.create_dataset('path', data=paths)
+        self._distance = self._f.create_dataset(
+            'distance', (num_paths, num_qpoints), dtype='double')
+        self._frequency = self._f.create_dataset(
+            'frequency', (num_paths, num_qpoints, num_band), dtype='double')
+        if is_eigenvectors:
+            self._eigenvector = _create_eigenvector_dataset(
+                self._f,
+                (num_paths, num_qpoints, num_band, num_band),
+                compression=compression,
+                is_float32=is_float32)
+        else:
+            self._eigenvector = None
+        if comment:
+            for key in comment:
+                if key not in ('path',
+                               'distance',
+                               'frequency',
+                               'eigenvector',
+                               'group_velocity'):
+                    self._f.create_dataset(key, data=np.bytes_(comment[key]))
+        if labels:
+            dset = self._f.create_dataset('label', (len(labels),), dtype='S10')
+            for i, l in enumerate(labels):
+                dset[i] = np.bytes_(l)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, distances, frequencies, eigenvectors=None):
+        self._distance[self._count] = distances
+        self._frequency[self._count] = frequencies
+        if self._eigenvector is not None:
+            self._eigenvector[self._count] = eigenvectors
+        self._count += 1
+
+    def close(self):
+        self._f.close()
+
+class PhononHdf5Reader(object):
+    """Lazy access to mesh.hdf5, band.hdf5 and qpoints.hdf5
+
+    Only the requested q-points and bands are read from the file. For
+    band.hdf5, the q-points are selected by (path, q-point) and the
+    selection may be a tuple:
+
+        with PhononHdf5Reader('mesh.hdf5') as r:
+            freqs = r.get_frequencies(q=slice(0, 100), band=[0, 1, 2])
+            eigvecs = r.get_eigenvectors(q=5)
+
+        with PhononHdf5Reader('band.hdf5') as r:
+            freqs = r.get_frequencies(q=(2, slice(None)), band=0)
+
+    Selections are those of h5py (integers, slices or increasing lists).
+    Eigenvectors stored in single precision are returned in double
+    precision, with the components as the second last axis and the bands
+    as the last one.
+
+    """
+    def __init__(self, filename):
+        import h5py
+        self._f = h5py.File(filename, 'r')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def keys(self):
+        return list(self._f.keys())
+
+    def get_qpoints(self):
+        if 'qpoint' in self._f:
+            return self._f['qpoint'][:]
+        return self._f['path'][:]
+
+    def get_weights(self):
+        return self._f['weight'][:]
+
+    def get_mesh_numbers(self):
+        return self._f['mesh'][:]
+
+    def get_distances(self):
+        return self._f['distance'][:]
+
+    def get_number_of_qpoints(self):
+        return int(np.prod(self._f['frequency'].shape[:-1]))
+
+    def get_number_of_bands(self):
+        return self._f['frequency'].shape[-1]
+
+    def get_frequencies(self, q=slice(None), band=slice(None)):
+        return self._f['frequency'][self._get_selection(q) + (band,)]
+
+    def get_eigenvectors(self, q=slice(None), band=slice(None)):
+        if 'eigenvector' not in self._f:
+            return None
+        selection = self._get_selection(q) + (slice(None), band)
+        return np.array(self._f['eigenvector'][selection], dtype='c16')
+
+    def close(self):
+        self._f.close()
+
+    def _get_selection(self, q):
+        if isinstance(q, tuple):
+            return q
+        return (q,)
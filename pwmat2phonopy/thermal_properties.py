@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+
+"""Harmonic thermal properties over whole temperature grids
+
+ThermalPropertiesGrid takes the frequencies and weights of a sampling mesh
+once and evaluates free energy, entropy, heat capacity and energy at all
+temperatures of a grid as array operations, blocks of temperatures times
+modes at a time. Equal frequencies are merged with their weights first,
+so degenerate bands and symmetry-equivalent q-points cost nothing. The
+same object can be run for any number of temperature grids, and saved
+and loaded again in a later run:
+
+    tp = ThermalPropertiesGrid(frequencies, weights=weights)
+    tp.run(np.linspace(0, 2000, 10001))
+    tp.write_yaml()
+    tp.write_hdf5()
+    tp.save('thermal_mesh.npz')
+    ...
+    tp = load_thermal_properties_grid('thermal_mesh.npz')
+
+Quantities, options and thermal_properties.yaml are those of phonopy's
+ThermalProperties without projection.
+
+"""
+
+import os
+import numpy as np
+
+__author__  = "Paul Chern"
+__email__   = "peng.chen.iphy@gmail.com"
+__licence__ = "GPL"
+__date__    = "Nov. 2017"
+
+def get_thermal_sums(energies, weights, temperatures, max_elements=2 ** 22):
+    """Weighted sums of mode free energies, entropies and heat capacities
+
+    energies: Positive mode energies in eV.
+    weights: Weights of the modes.
+    temperatures: Temperatures in K.
+
+    Returns the sums of F - ZPE (eV), S (eV/K) and C_v (eV/K) over the
+    modes at every temperature, zero at zero temperature. At most
+    max_elements temperatures times modes are evaluated at once.
+
+    """
+    from pwmat2phonopy.units import Kb
+
+    energies = np.asarray(energies, dtype='double')
+    weights = np.asarray(weights, dtype='double')
+    temperatures = np.asarray(temperatures, dtype='double')
+    free_energy = np.zeros(len(temperatures), dtype='double')
+    entropy = np.zeros(len(temperatures), dtype='double')
+    heat_capacity = np.zeros(len(temperatures), dtype='double')
+    if len(energies) == 0:
+        return free_energy, entropy, heat_capacity
+
+    positive = np.nonzero(temperatures > 0)[0]
+    block = max(1, max_elements // len(energies))
+    for i in range(0, len(positive), block):
+        indices = positive[i:i + block]
+        kt = Kb * temperatures[indices]
+        x = energies[None, :] / kt[:, None]
+        # 1 - exp(-x) and the occupation exp(-x) / (1 - exp(-x))
+        one_m = -np.expm1(-x)
+        occupation = np.exp(-x)
+        occupation /= one_m
+        log_term = np.log(one_m)
+        free_energy[indices] = kt * np.dot(log_term, weights)
+        occupation *= x
+        entropy[indices] = Kb * np.dot(occupation - log_term, weights)
+        occupation *= x
+        occupation /= one_m
+        heat_capacity[indices] = Kb * np.dot(occupation, weights)
+    return free_energy, entropy, heat_capacity
+
+def get_thermal_properties_yaml_lines(temperatures,
+                                      free_energy,
+                                      entropy,
+                                      heat_capacity,
+                                      natom,
+                                      num_modes,
+                                      num_integrated_modes,
+                                      zero_point_energy,
+                                      high_T_entropy,
+                                      cutoff_frequency=None,
+                                      band_indices=None):
+    """Lines of thermal_properties.yaml as written by phonopy
+
+    free_energy in kJ/mol, entropy and heat_capacity in J/K/mol,
+    zero_point_energy in kJ/mol and high_T_entropy in kJ/K/mol.
+    band_indices start from 0.
+
+    """
+    lines = []
+    lines.append("# Thermal properties / unit cell (natom)")
+    lines.append("")
+    lines.append("unit:")
+    lines.append("  temperature:   K")
+    lines.append("  free_energy:   kJ/mol")
+    lines.append("  entropy:       J/K/mol")
+    lines.append("  heat_capacity: J/K/mol")
+    lines.append("")
+    lines.append("natom: %5d" % natom)
+    if cutoff_frequency:
+        lines.append("cutoff_frequency: %8.3f" % cutoff_frequency)
+    lines.append("num_modes: %d" % num_modes)
+    lines.append("num_integrated_modes: %d" % num_integrated_modes)
+    if band_indices is not None:
+        bi = np.array(band_indices) + 1
+        lines.append("band_index: [ " + ("%d, " * (len(bi) - 1)) %
+                     tuple(bi[:-1]) + ("%d ]" % bi[-1]))
+    lines.append("")
+    lines.append("zero_point_energy: %15.7f" % zero_point_energy)
+    lines.append("high_T_entropy:    %15.7f" % (high_T_entropy * 1000))
+    lines.append("")
+    lines.append("thermal_properties:")
+    # Sometimes 'nan' of C_V is returned at low temperature.
+    heat_capacity = np.where(np.isnan(heat_capacity), 0, heat_capacity)
+    energy = free_energy + entropy * temperatures / 1000
+    block = ("- temperature:   %15.7f\n"
+             "  free_energy:   %15.7f\n"
+             "  entropy:       %15.7f\n"
+             "  heat_capacity: %15.7f\n"
+             "  energy:        %15.7f\n")
+    table = np.column_stack(
+        (temperatures, free_energy, entropy, heat_capacity, energy))
+    lines.append("\n".join([block % tuple(row) for row in table]))
+    return lines
+
+def get_binary_filename(filename='thermal_properties.yaml'):
+    """Binary file written next to a thermal_properties.yaml
+
+    The extension is .hdf5 if h5py is installed, otherwise .npz.
+
+    """
+    try:
+        import h5py
+        ext = '.hdf5'
+    except ImportError:
+        ext = '.npz'
+    return os.path.splitext(filename)[0] + ext
+
+def write_thermal_properties_hdf5(filename,
+                                  temperatures,
+                                  free_energy,
+                                  entropy,
+                                  heat_capacity,
+                                  natom,
+                                  num_modes,
+                                  num_integrated_modes,
+                                  zero_point_energy,
+                                  high_T_entropy,
+                                  cutoff_frequency=None,
+                                  band_indices=None):
+    """thermal_properties.yaml as arrays in HDF5, or .npz by the extension
+
+    Units are those of the yaml, high_T_entropy is in kJ/K/mol.
+
+    """
+    data = {'temperature': temperatures,
+            'free_energy': free_energy,
+            'entropy': entropy,
+            'heat_capacity': np.where(np.isnan(heat_capacity),
+                                      0, heat_capacity),
+            'energy': free_energy + entropy * temperatures / 1000,
+            'natom': natom,
+            'num_modes': num_modes,
+            'num_integrated_modes': num_integrated_modes,
+            'zero_point_energy': zero_point_energy,
+            'high_T_entropy': high_T_entropy}
+    if cutoff_frequency is not None:
+        data['cutoff_frequency'] = cutoff_frequency
+    if band_indices is not None:
+        data['band_index'] = band_indices
+    if filename.endswith('.npz'):
+        np.savez(filename, **data)
+    else:
+        import h5py
+        with h5py.File(filename, 'w') as w:
+            for key in data:
+                w.create_dataset(key, data=data[key])
+
+def read_thermal_properties_hdf5(filename):
+    """Dictionary of the arrays written by write_thermal_properties_hdf5"""
+    if filename.endswith('.npz'):
+        with np.load(filename) as f:
+            return dict([(key, f[key][()]) for key in f.files])
+    else:
+        import h5py
+        with h5py.File(filename, 'r') as f:
+            return dict([(key, f[key][()]) for key in f])
+
+class ThermalPropertiesGrid(object):
+    """Thermal properties of fixed mesh phonons at any temperatures
+
+    Args:
+        frequencies: Frequencies in THz of shape (num_qpoints, num_band).
+        weights: Weights of the q-points.
+        band_indices: Bands to be included (lists of indices are joined).
+        cutoff_frequency: Frequencies below are excluded.
+        pretend_real: Imaginary frequencies are taken as real.
+
+    """
+    def __init__(self,
+                 frequencies,
+                 weights=None,
+                 band_indices=None,
+                 cutoff_frequency=None,
+                 pretend_real=False):
+        from pwmat2phonopy.units import THzToEv
+
+        frequencies = np.asarray(frequencies, dtype='double')
+        if weights is None:
+            weights = np.ones(len(frequencies), dtype='intc')
+        weights = np.asarray(weights)
+        if band_indices is not None:
+            self._band_indices = np.hstack(band_indices).astype('intc')
+            frequencies = frequencies[:, self._band_indices]
+        else:
+            self._band_indices = None
+        if pretend_real:
+            frequencies = abs(frequencies)
+        elif cutoff_frequency is not None:
+            frequencies = np.where(frequencies > cutoff_frequency,
+                                   frequencies, -1)
+        self._cutoff_frequency = cutoff_frequency
+
+        energies = frequencies * THzToEv
+        self._num_band = energies.shape[1]
+        self._sum_weights = weights.sum()
+        self._num_modes = self._num_band * self._sum_weights
+        self._num_integrated_modes = np.sum(
+            weights * (energies > 0).sum(axis=1))
+
+        mode_weights = np.repeat(weights, self._num_band).astype('double')
+        positive = energies.ravel() > 0
+        self._energies, inverse = np.unique(energies.ravel()[positive],
+                                            return_inverse=True)
+        self._weights = np.bincount(np.ravel(inverse),
+                                    weights=mode_weights[positive])
+
+        self._temperatures = None
+        self._thermal_properties = None
+
+    def get_number_of_modes(self):
+        return self._num_modes
+
+    def get_number_of_integrated_modes(self):
+        return self._num_integrated_modes
+
+    def get_zero_point_energy(self):
+        """Zero point energy in kJ/mol"""
+        from pwmat2phonopy.units import EvTokJmol
+        return (np.dot(self._weights, self._energies) / 2 /
+                self._sum_weights * EvTokJmol)
+
+    def get_high_T_entropy(self):
+        """-k_B sum log(hbar omega) in kJ/K/mol"""
+        from pwmat2phonopy.units import Kb, EvTokJmol
+        return (-np.dot(self._weights, np.log(self._energies)) * Kb /
+                self._sum_weights * EvTokJmol)
+
+    def run(self, temperatures, max_elements=2 ** 22):
+        """Thermal properties at temperatures (negative ones are dropped)"""
+        from pwmat2phonopy.units import EvTokJmol
+
+        temperatures = np.array(temperatures, dtype='double').ravel()
+        self._temperatures = temperatures[np.logical_not(temperatures < 0)]
+        fe, entropy, cv = get_thermal_sums(self._energies,
+                                           self._weights,
+                                           self._temperatures,
+                                           max_elements=max_elements)
+        scale = EvTokJmol / self._sum_weights
+        self._thermal_properties = (
+            self._temperatures,
+            fe * scale + self.get_zero_point_energy(),
+            entropy * scale * 1000,
+            cv * scale * 1000)
+        return self
+
+    def get_thermal_properties(self):
+        """Temperatures, F [kJ/mol], S [J/K/mol] and C_v [J/K/mol]"""
+        return self._thermal_properties
+
+    def get_energy(self):
+        """E = F + TS in kJ/mol"""
+        temps, fe, entropy, cv = self._thermal_properties
+        return fe + temps * entropy / 1000
+
+    def write_yaml(self, filename='thermal_properties.yaml'):
+        lines = get_thermal_properties_yaml_lines(
+            *self._thermal_properties,
+            natom=self._num_band // 3,
+            num_modes=self._num_modes,
+            num_integrated_modes=self._num_integrated_modes,
+            zero_point_energy=self.get_zero_point_energy(),
+            high_T_entropy=self.get_high_T_entropy(),
+            cutoff_frequency=self._cutoff_frequency,
+            band_indices=self._band_indices)
+        with open(filename, 'w') as w:
+            w.write("\n".join(lines))
+
+    def write_hdf5(self, filename='thermal_properties.hdf5'):
+        """Thermal properties as arrays in HDF5 (or .npz by the extension)"""
+        write_thermal_properties_hdf5(
+            filename,
+            *self._thermal_properties,
+            natom=self._num_band // 3,
+            num_modes=self._num_modes,
+            num_integrated_modes=self._num_integrated_modes,
+            zero_point_energy=self.get_zero_point_energy(),
+            high_T_entropy=self.get_high_T_entropy(),
+            cutoff_frequency=self._cutoff_frequency,
+            band_indices=self._band_indices)
+
+    def save(self, filename):
+        """Mode energies and weights as .npz to be read by
+        load_thermal_properties_grid"""
+        data = {'energies': self._energies,
+                'weights': self._weights,
+                'num_band': self._num_band,
+                'sum_weights': self._sum_weights,
+                'num_integrated_modes': self._num_integrated_modes}
+        if self._cutoff_frequency is not None:
+            data['cutoff_frequency'] = self._cutoff_frequency
+        if self._band_indices is not None:
+            data['band_indices'] = self._band_indices
+        np.savez(filename, **data)
+
+def load_thermal_properties_grid(filename):
+    """ThermalPropertiesGrid saved by ThermalPropertiesGrid.save"""
+    data = np.load(filename)
+    tp = ThermalPropertiesGrid(np.zeros((0, 0)), weights=np.zeros(0))
+    tp._energies = data['energies']
+    tp._weights = data['weights']
+    tp._num_band = int(data['num_band'])
+    tp._sum_weights = data['sum_weights'][()]
+    tp._num_modes = tp._num_band * tp._sum_weights
+    tp._num_integrated_modes = data['num_integrated_modes'][()]
+    if 'cutoff_frequency' in data:
+        tp._cutoff_frequency = float(data['cutoff_frequency'])
+    if 'band_indices' in data:
+        tp._band_indices = data['band_indices']
+    return tp